@@ -0,0 +1,183 @@
+import re
+from html.parser import HTMLParser
+
+# sr-avatar.com のページ用の1パス抽出エンジン。
+# BeautifulSoup で木を作って ID ごとに find_all / previous_element を辿る代わりに、
+# HTMLParser のイベントを一度だけ流して
+#   img src -> 最も近い祖先の <a>
+#   テキストノード -> 最も近い祖先の <a> / 直前20ノード以内の <a>
+# を記録しておき、ページ内の全IDをその記録から答える。
+# 結果は従来の BeautifulSoup 版 (bench/bench_avatar_extract.py の legacy_find_avatar_link) と同じになるようにしている。
+
+# BeautifulSoup (html.parser) が空要素として扱うタグ
+VOID_TAGS = {
+    "area", "base", "basefont", "bgsound", "br", "col", "command", "embed",
+    "frame", "hr", "image", "img", "input", "isindex", "keygen", "link",
+    "menuitem", "meta", "nextid", "param", "source", "spacer", "track", "wbr",
+}
+
+# BeautifulSoup 版と同じく、テキストノードの親要素から遡るのは20ノードまで
+PREVIOUS_ELEMENT_STEPS = 20
+
+def is_room_url(room_url):
+    return room_url and ("showroom-live.com" in room_url or room_url.startswith("/room/"))
+
+class _Link:
+    __slots__ = ("href", "parts")
+
+    def __init__(self, href):
+        self.href = href
+        self.parts = []
+
+    def text(self):
+        # link.get_text(strip=True) 相当
+        return "".join(self.parts)
+
+class _Collector(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        # 開いている要素: (tag名, _Link または None, order上の開始位置)
+        self.stack = []
+        # 文書順のノード列。<a> の開始なら _Link、それ以外は None
+        self.order = []
+        self.imgs = []   # (src, 祖先<a>)
+        self.texts = []  # (text, 祖先<a>, 親要素のorder位置 or None)
+        # 次のタグが来るまでのテキストは1つの文字列ノードにまとめる (BeautifulSoup と同じ)
+        self.pending = []
+        # 閉じ済みの空要素。後から来る </br> などは無視する
+        self.closed_void = []
+
+    def _nearest_link(self):
+        for name, link, _ in reversed(self.stack):
+            if link is not None:
+                return link
+        return None
+
+    def _add_text(self, data, visible):
+        if visible:
+            stripped = data.strip()
+            if stripped:
+                for _, link, _ in self.stack:
+                    if link is not None:
+                        link.parts.append(stripped)
+        parent_pos = self.stack[-1][2] if self.stack else None
+        self.texts.append((data, self._nearest_link(), parent_pos))
+        self.order.append(None)
+
+    def _flush(self):
+        if self.pending:
+            self._add_text("".join(self.pending), True)
+            self.pending = []
+
+    def _start(self, tag, attrs):
+        self._flush()
+        link = None
+        if tag == "a":
+            href = None
+            for k, v in attrs:
+                if k == "href":
+                    href = v
+                    break
+            link = _Link(href)
+
+        if tag == "img":
+            src = None
+            for k, v in attrs:
+                if k == "src":
+                    src = v
+                    break
+            if src:
+                self.imgs.append((src, self._nearest_link()))
+
+        pos = len(self.order)
+        self.order.append(link)
+        if tag not in VOID_TAGS:
+            self.stack.append((tag, link, pos))
+
+    def _end(self, tag):
+        self._flush()
+        for i in range(len(self.stack) - 1, -1, -1):
+            if self.stack[i][0] == tag:
+                del self.stack[i:]
+                return
+
+    def handle_starttag(self, tag, attrs):
+        self._start(tag, attrs)
+        if tag in VOID_TAGS:
+            self.closed_void.append(tag)
+
+    def handle_startendtag(self, tag, attrs):
+        self._start(tag, attrs)
+        self._end(tag)
+
+    def handle_endtag(self, tag):
+        if tag in self.closed_void:
+            self.closed_void.remove(tag)
+            return
+        self._end(tag)
+
+    def handle_data(self, data):
+        self.pending.append(data)
+
+    def handle_comment(self, data):
+        # コメント / DOCTYPE も文字列ノードとして検索対象になる (get_text には含めない)
+        self._flush()
+        self._add_text(data, False)
+
+    def handle_decl(self, decl):
+        self._flush()
+        self._add_text(decl, False)
+
+    def close(self):
+        super().close()
+        self._flush()
+
+class AvatarPage:
+    """1回のパースでページ内の img / テキスト / リンクの対応を保持する。"""
+
+    def __init__(self, html):
+        collector = _Collector()
+        collector.feed(html)
+        collector.close()
+        self.imgs = collector.imgs
+        self.texts = []
+        order = collector.order
+        for text, link, parent_pos in collector.texts:
+            stripped = text.strip()
+            skip = "～" in stripped or ("-" in stripped and len(stripped) > 15)
+            if link is None and parent_pos is not None:
+                # 祖先に <a> が無い場合は親要素の直前から最大20ノード遡る
+                for pos in range(parent_pos - 1, max(parent_pos - 1 - PREVIOUS_ELEMENT_STEPS, -1), -1):
+                    if order[pos] is not None:
+                        link = order[pos]
+                        break
+            self.texts.append((text, link, skip))
+
+    def find(self, target_id_str):
+        """(IDがページ内に存在したか, (room_name, room_url) または None) を返す。"""
+        present = False
+
+        for src, link in self.imgs:
+            if target_id_str in src:
+                present = True
+                if link is not None and is_room_url(link.href):
+                    return True, (link.text(), link.href)
+
+        for text, link, skip in self.texts:
+            if target_id_str in text:
+                present = True
+                if skip:
+                    continue
+                if link is not None and is_room_url(link.href):
+                    return True, (link.text(), link.href)
+
+        return present, None
+
+    def candidate_ids(self):
+        """ページ内に現れる数字列 (IDの候補) をすべて返す。"""
+        candidates = set()
+        for text, _, _ in self.texts:
+            candidates.update(re.findall(r'\d+', text))
+        for src, _ in self.imgs:
+            candidates.update(re.findall(r'\d+', src))
+        return candidates
@@ -0,0 +1,266 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+
+from avatar_extract import AvatarPage
+from search_avatar import AVATAR_BASE_URL, get_avatar_page_url, found_result
+
+# sr-avatar.com のページを一度だけ解析して
+# avatar_id -> (room_name, room_url, source_url) をSQLiteに保存しておくインデックス。
+# ページ単位で取得時刻 / ETag / Last-Modified を持ち、古くなったら条件付きGETで更新する。
+
+DB_PATH = os.environ.get(
+    "AVATAR_INDEX_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "avatar_index.sqlite")
+)
+MAX_AGE = int(os.environ.get("AVATAR_INDEX_MAX_AGE", str(7 * 24 * 3600)))
+# 404 (ページがまだ無い) は新しいページが追加されうるので短めに持つ
+NOT_FOUND_TTL = int(os.environ.get("AVATAR_INDEX_NOT_FOUND_TTL", "3600"))
+# ページに無い / リンクが無い ID は、ページの取得からこれ以上経っていれば条件付きGETで確かめ直す
+# (後からページに追加されたアバター用。変わっていなければ 304 で済む)
+MISS_REVALIDATE = int(os.environ.get("AVATAR_INDEX_MISS_REVALIDATE", "600"))
+
+# Block A/B の最終ページ (ava1137001.html) 付近まで
+DEFAULT_MAX_ID = 1140000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    url TEXT PRIMARY KEY,
+    status INTEGER NOT NULL,
+    etag TEXT,
+    last_modified TEXT,
+    fetched_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS avatars (
+    avatar_id INTEGER PRIMARY KEY,
+    room_name TEXT,
+    room_url TEXT,
+    source_url TEXT NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_avatars_source ON avatars(source_url);
+"""
+
+_conn = None
+_conn_lock = threading.Lock()
+# クロール時は複数スレッドから同じ接続に書き込むので書き込みを直列化する
+_write_lock = threading.Lock()
+
+def connect(path=DB_PATH):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def get_conn():
+    global _conn
+    with _conn_lock:
+        if _conn is None:
+            _conn = connect()
+        return _conn
+
+def extract_page(html, page_url):
+    """
+    ページ内の全アバターIDについてリンクを解決する。
+    戻り値: {avatar_id: (room_name, room_url) または None}
+    """
+    page = AvatarPage(html)
+
+    # このページの範囲に入る数字だけを候補にする
+    entries = {}
+    for cand in page.candidate_ids():
+        aid = int(cand)
+        if str(aid) != cand or get_avatar_page_url(aid) != page_url:
+            continue
+        present, found_link = page.find(cand)
+        if present:
+            entries[aid] = found_link
+    return entries
+
+def fetch_page(url, etag=None, last_modified=None):
+    # 検証子は pages テーブルで持っているので http_client のキャッシュは使わない
+    headers = {}
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    return http_client.get(url, headers, timeout=15, detect_encoding=True)
+
+def store_page(conn, url, status, etag, last_modified, entries=None):
+    with _write_lock, conn:
+        conn.execute(
+            "INSERT OR REPLACE INTO pages (url, status, etag, last_modified, fetched_at) VALUES (?, ?, ?, ?, ?)",
+            (url, status, etag, last_modified, time.time())
+        )
+        if entries is not None:
+            conn.execute("DELETE FROM avatars WHERE source_url = ?", (url,))
+            conn.executemany(
+                "INSERT OR REPLACE INTO avatars (avatar_id, room_name, room_url, source_url) VALUES (?, ?, ?, ?)",
+                [(aid, link[0] if link else None, link[1] if link else None, url) for aid, link in entries.items()]
+            )
+
+def is_fresh(status, fetched_at, max_age=MAX_AGE, now=None):
+    age = (now or time.time()) - fetched_at
+    if status == 200:
+        return age <= max_age
+    return age <= min(max_age, NOT_FOUND_TTL)
+
+def refresh_page(conn, url):
+    """
+    ページを(条件付きで)取得してインデックスを更新する。HTTPステータスを返す。
+    404 は「ページ無し」として保存するが、5xx / 429 などの一時的な失敗は保存せず
+    既存の行とアバターをそのまま残す。接続エラーは例外のまま上げる。
+    """
+    row = conn.execute("SELECT etag, last_modified FROM pages WHERE url = ? AND status = 200", (url,)).fetchone()
+    etag, last_modified = row if row else (None, None)
+
+    response = fetch_page(url, etag, last_modified)
+    if response.status_code == 304:
+        store_page(conn, url, 200, etag, last_modified)
+        return 304
+    if response.status_code == 404:
+        store_page(conn, url, 404, None, None, entries={})
+        return 404
+    if response.status_code != 200:
+        return response.status_code
+
+    entries = extract_page(response.text, url)
+    store_page(
+        conn, url, 200,
+        response.headers.get("ETag"), response.headers.get("Last-Modified"),
+        entries=entries
+    )
+    return 200
+
+def lookup(avatar_id, max_age=MAX_AGE, conn=None):
+    """
+    search_avatar と同じ形の結果dictを返す。
+    ページが未取得または古い場合はそのページだけ取得し直す。
+    """
+    return lookup_with_source(avatar_id, max_age, conn)[0]
+
+def lookup_with_source(avatar_id, max_age=MAX_AGE, conn=None):
+    """
+    (結果dict, 答えた元) を返す。答えた元は
+    "index" (インデックスだけ) / "revalidated" (304 で確認) / "fetch" (ページを取得した)。
+    """
+    conn = conn or get_conn()
+    url = get_avatar_page_url(avatar_id)
+
+    def select_page():
+        return conn.execute("SELECT status, fetched_at FROM pages WHERE url = ?", (url,)).fetchone()
+
+    def select_avatar():
+        return conn.execute(
+            "SELECT room_name, room_url FROM avatars WHERE avatar_id = ?", (avatar_id,)
+        ).fetchone()
+
+    def refresh():
+        try:
+            status = refresh_page(conn, url)
+        except Exception as e:
+            status = e
+        return status, ("revalidated" if status == 304 else "fetch")
+
+    source = "index"
+    page = select_page()
+    if page is None or not is_fresh(page[0], page[1], max_age):
+        status, source = refresh()
+        page = select_page()
+        # 取得に失敗しても以前の 200 があればそれを返す
+        if status not in (200, 304, 404) and (page is None or page[0] != 200):
+            return {"found": False, "error": f"Page fetch failed: {status}", "url": url}, source
+
+    if page[0] != 200:
+        return {"found": False, "error": f"Page not found: {page[0]}", "url": url}, source
+
+    row = select_avatar()
+    if (row is None or row[1] is None) and source == "index" and time.time() - page[1] > MISS_REVALIDATE:
+        status, source = refresh()
+        if status == 200:
+            page = select_page()
+            if page[0] != 200:
+                return {"found": False, "error": f"Page not found: {page[0]}", "url": url}, source
+            row = select_avatar()
+        elif status == 404:
+            return {"found": False, "error": "Page not found: 404", "url": url}, source
+        # 一時的な失敗なら手元の結果をそのまま返す
+
+    if row is None:
+        return {"found": False, "error": "ID not found in page", "url": url}, source
+    if row[1] is None:
+        return {"found": False, "error": "Link not found for ID", "url": url}, source
+    return found_result(row[0], row[1], url), source
+
+def iter_page_urls(max_id=DEFAULT_MAX_ID):
+    seen = set()
+    starts = [1, 101, 100001, 203001, 204001, 205001, 205101, 300001]
+    starts += range(1000001, max_id + 1, 100)
+    for aid in starts:
+        url = get_avatar_page_url(aid)
+        if url not in seen:
+            seen.add(url)
+            yield url
+    yield f"{AVATAR_BASE_URL}/ava_shop.html"
+    yield f"{AVATAR_BASE_URL}/ava999.html"
+
+def crawl(max_id=DEFAULT_MAX_ID, max_age=MAX_AGE, workers=4, conn=None):
+    """全ページを巡回してインデックスを作る。max_age (404 は NOT_FOUND_TTL) 以内に取得済みのページは飛ばす。"""
+    conn = conn or get_conn()
+    now = time.time()
+    fresh = {
+        url for url, status, fetched_at in conn.execute("SELECT url, status, fetched_at FROM pages")
+        if is_fresh(status, fetched_at, max_age, now)
+    }
+    urls = [u for u in iter_page_urls(max_id) if u not in fresh]
+
+    stats = {"pages": 0, "not_modified": 0, "errors": 0}
+
+    def work(url):
+        try:
+            return url, refresh_page(conn, url)
+        except Exception as e:
+            print(f"[avatar_index] {url}: {e}", file=sys.stderr)
+            return url, None
+
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        for url, status in pool.map(work, urls):
+            if status == 304:
+                stats["not_modified"] += 1
+            elif status != 200:
+                stats["errors"] += 1
+            stats["pages"] += 1
+
+    stats["avatars"] = conn.execute("SELECT COUNT(*) FROM avatars").fetchone()[0]
+    return stats
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="sr-avatar.com avatar ID index")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_crawl = sub.add_parser("crawl", help="Crawl avatar pages and build the index")
+    p_crawl.add_argument("--max-id", type=int, default=DEFAULT_MAX_ID)
+    p_crawl.add_argument("--max-age", type=int, default=MAX_AGE, help="Skip pages fetched within this many seconds")
+    p_crawl.add_argument("--workers", type=int, default=4)
+
+    p_lookup = sub.add_parser("lookup", help="Look up avatar IDs in the index")
+    p_lookup.add_argument("avatar_ids", nargs="+", type=int)
+
+    args = parser.parse_args(argv)
+
+    if args.command == "crawl":
+        print(json.dumps(crawl(args.max_id, args.max_age, args.workers)))
+    else:
+        for aid in args.avatar_ids:
+            print(json.dumps(dict(lookup(aid), avatar_id=aid), ensure_ascii=False))
+
+if __name__ == "__main__":
+    sys.stdout.reconfigure(encoding='utf-8')
+    main(sys.argv[1:])
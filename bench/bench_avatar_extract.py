@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+import argparse
+
+from bs4 import BeautifulSoup
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from avatar_extract import AvatarPage, is_room_url
+from stub_fixtures import avatar_page as synthetic_page
+
+# 従来の search_avatar の抽出処理 (BeautifulSoup で全体を作り、IDごとに木を走査する)
+# avatar_extract.AvatarPage と結果が一致するかの確認と速度比較に使う。
+#
+#   python bench/bench_avatar_extract.py                 # 合成ページ
+#   python bench/bench_avatar_extract.py saved/*.html    # 保存したページ
+
+def legacy_find_avatar_link(soup, target_id_str):
+    target_text_nodes = soup.find_all(string=lambda t: t and target_id_str in t)
+    target_imgs = soup.find_all('img', src=lambda s: s and target_id_str in s)
+
+    if not target_text_nodes and not target_imgs:
+        return False, None
+
+    for img in target_imgs:
+        link = img.find_parent('a')
+        if link:
+            room_name = link.get_text(strip=True)
+            room_url = link.get("href")
+            if is_room_url(room_url):
+                 return True, (room_name, room_url)
+
+    for node in target_text_nodes:
+        text = node.strip()
+        if "～" in text or ("-" in text and len(text) > 15):
+             continue
+
+        element = node.parent
+        link = None
+
+        if element.name == 'a':
+            link = element
+        else:
+            link = element.find_parent('a')
+            if not link:
+                p = element.previous_element
+                for _ in range(20):
+                    if not p: break
+                    if p.name == 'a':
+                        link = p
+                        break
+                    p = p.previous_element
+
+        if link:
+            room_name = link.get_text(strip=True)
+            room_url = link.get("href")
+            if is_room_url(room_url):
+                 return True, (room_name, room_url)
+
+    return True, None
+
+def candidate_ids(html):
+    return sorted(AvatarPage(html).candidate_ids())
+
+def bench_legacy(html, ids):
+    t0 = time.perf_counter()
+    soup = BeautifulSoup(html, "html.parser")
+    results = {i: legacy_find_avatar_link(soup, i) for i in ids}
+    return time.perf_counter() - t0, results
+
+def bench_onepass(html, ids):
+    t0 = time.perf_counter()
+    page = AvatarPage(html)
+    results = {i: page.find(i) for i in ids}
+    return time.perf_counter() - t0, results
+
+def run(name, html, repeat):
+    ids = candidate_ids(html)
+    legacy_best = min(bench_legacy(html, ids)[0] for _ in range(repeat))
+    onepass_best = min(bench_onepass(html, ids)[0] for _ in range(repeat))
+
+    _, legacy = bench_legacy(html, ids)
+    _, onepass = bench_onepass(html, ids)
+    mismatches = [i for i in ids if legacy[i] != onepass[i]]
+
+    print(f"{name}: {len(html)} bytes, {len(ids)} ids")
+    print(f"  legacy (bs4)  : {legacy_best * 1000:9.2f} ms")
+    print(f"  one-pass      : {onepass_best * 1000:9.2f} ms  (x{legacy_best / onepass_best:.1f})")
+    print(f"  mismatches    : {len(mismatches)}")
+    for i in mismatches[:10]:
+        print(f"    {i}: legacy={legacy[i]} one-pass={onepass[i]}")
+    return not mismatches
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark avatar page extraction")
+    parser.add_argument("pages", nargs="*", help="Saved ava*.html pages")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--count", type=int, default=100, help="Avatars per synthetic page")
+    args = parser.parse_args(argv)
+
+    ok = True
+    if args.pages:
+        for path in args.pages:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                ok &= run(os.path.basename(path), f.read(), args.repeat)
+    else:
+        ok &= run(f"synthetic({args.count})", synthetic_page(count=args.count), args.repeat)
+        ok &= run("synthetic(300)", synthetic_page(count=300, seed=1), args.repeat)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,98 @@
+import os
+import re
+import sys
+import time
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from ranking_parser import iter_ranking_rows
+from stub_fixtures import ranking_page as synthetic_page
+
+# 旧 scrape_ranking の contentlist-row ループと ranking_parser の比較。
+# 結果 (rank, room_id, name) が一致するかを確認し、処理時間とピークメモリを出す。
+#
+#   python bench/bench_ranking_parser.py                    # 合成ページ 10,000 行
+#   python bench/bench_ranking_parser.py --rows 50000
+#   python bench/bench_ranking_parser.py saved/*.html       # 保存したページ
+
+def legacy_parse(html):
+    ranking = []
+    items = html.split('class="contentlist-row"')
+    if len(items) > 1:
+        items.pop(0)
+        for item in items:
+            rank_match = re.search(r'is-rank-(\d+)', item)
+            id_match = re.search(r'data-room-id="(\d+)"', item)
+            name = ""
+            name_match_h4 = re.search(r'listcardinfo-main-text[^>]*>([\s\S]*?)<\/', item)
+            if name_match_h4:
+                name = name_match_h4.group(1).strip()
+            if not name:
+                alt_match = re.search(r'class="[^"]*img-main[^"]*"[^>]*alt="([^"]+)"', item)
+                if not alt_match:
+                     alt_match = re.search(r'alt="([^"]+)"', item)
+                if alt_match:
+                    potential_name = alt_match.group(1).strip()
+                    if potential_name not in ["Official", "Onlive", "Badge", "Profile", "Follow"]:
+                         name = potential_name
+            if rank_match and id_match and name:
+                ranking.append({
+                    "rank": int(rank_match.group(1)),
+                    "point": 0,
+                    "room": {
+                        "room_id": int(id_match.group(1)),
+                        "room_name": name,
+                        "url_key": ""
+                    }
+                })
+    return ranking
+
+def measure(fn, html, repeat):
+    best = float("inf")
+    for _ in range(repeat):
+        t0 = time.perf_counter()
+        result = fn(html)
+        best = min(best, time.perf_counter() - t0)
+    tracemalloc.start()
+    fn(html)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return best, peak, result
+
+def run(name, html, repeat):
+    legacy_t, legacy_mem, legacy = measure(legacy_parse, html, repeat)
+    # ジェネレータは消費しながら処理できるので、ここでは件数だけ数える
+    count_rows = lambda h: sum(1 for _ in iter_ranking_rows(h))
+    onepass_t, onepass_mem, count = measure(count_rows, html, repeat)
+
+    new = [(r["rank"], r["room_id"], r["name"]) for r in iter_ranking_rows(html)]
+    old = [(r["rank"], r["room"]["room_id"], r["room"]["room_name"]) for r in legacy]
+
+    mb = len(html) / 1e6
+    print(f"{name}: {mb:.1f} MB, {len(old)} rows")
+    print(f"  legacy split+re.search : {legacy_t * 1000:9.1f} ms  {len(old) / legacy_t:10.0f} rows/s  {mb / legacy_t:6.1f} MB/s  peak {legacy_mem / 1e6:7.1f} MB")
+    print(f"  ranking_parser         : {onepass_t * 1000:9.1f} ms  {count / onepass_t:10.0f} rows/s  {mb / onepass_t:6.1f} MB/s  peak {onepass_mem / 1e6:7.1f} MB")
+    print(f"    (ranking_parser also extracts url_key / point)")
+    print(f"  identical              : {new == old}")
+    return new == old
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark contentlist-row ranking parsing")
+    parser.add_argument("pages", nargs="*", help="Saved event pages")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args(argv)
+
+    ok = True
+    if args.pages:
+        for path in args.pages:
+            with open(path, encoding="utf-8", errors="replace") as f:
+                ok &= run(os.path.basename(path), f.read(), args.repeat)
+    else:
+        ok &= run(f"synthetic({args.rows})", synthetic_page(args.rows), args.repeat)
+    return 0 if ok else 1
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
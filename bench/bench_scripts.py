@@ -0,0 +1,275 @@
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import tempfile
+import statistics
+import subprocess
+import importlib.util
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+ROOT = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, ROOT)
+
+from stub_server import StubServer, add_config_args, config_from_args
+
+# スクリプトごとの性能をネットワーク無しで測るハーネス。
+# bench/stub_server.py をこのプロセス内で立て、SHOWROOM_BASE_URL / SR_AVATAR_BASE_URL を向けて
+#   cold start : 新しいインタプリタでモジュールを import するまでの時間
+#   parse      : スタブのレスポンス本文をこのプロセス内で解析する時間
+#   end-to-end : python <script> <args> の実行時間 (起動 + 取得 + 解析 + 出力)
+#   RSS        : end-to-end 実行時の子プロセスの最大 RSS
+#   req/304/KB : end-to-end 1回あたりの上流へのリクエスト数 / そのうち 304 の数 / 受け取ったバイト数
+# を測り、出力が期待どおりかも確認する (壊れていれば終了コード 1)。
+#
+#   python bench/bench_scripts.py
+#   python bench/bench_scripts.py --latency 50 --error-rate 0.1 --runs 10
+#   python bench/bench_scripts.py --only scrape_ranking --json
+#   python bench/bench_scripts.py --fanout 20 --latency 200    # 同じ呼び出しを20個同時に起動
+#
+# キャッシュ (event_cache / avatar_index / snapshots / result_cache / http_client) と timing の集計は実行ごとに空のディレクトリを使う。
+# --warm-cache を付けると全実行で同じディレクトリを使い回す。
+
+ROOM_ID = 100001
+# スタブ (seed 0) でルームへのリンクが付いている ID と、その room_url
+AVATAR_ID = "1000402"
+AVATAR_ROOM_URL = "https://www.showroom-live.com/room/profile?room_id=235746"
+
+def _ranking_api(html, body):
+    from scrape_ranking import find_event_id
+    find_event_id(html)
+    return json.loads(body)["ranking"]
+
+def _ranking_html(html):
+    from scrape_ranking import parse_ranking_html
+    return parse_ranking_html(html)
+
+def _event_info(html):
+    from scrape_event_info import parse_event_page
+    return parse_event_page(html)
+
+def _comment_delta(body):
+    from fetch_comment_log import compute_delta
+    return compute_delta(json.loads(body)["comment_log"])
+
+def _avatar(html):
+    from avatar_extract import AvatarPage
+    return AvatarPage(html).find(AVATAR_ID)
+
+def _room_event(html):
+    from scrape_room_event import find_event_key
+    return find_event_key(html)
+
+def _room_event_api(body):
+    from scrape_room_event import event_key_from_url
+    return event_key_from_url(json.loads(body)["event"]["event_url"])
+
+# name -> (script, args, [スタブから取る本文のパス], 解析関数, 出力の確認, 必要なモジュール)
+CASES = {
+    "scrape_ranking": (
+        "scrape_ranking.py", ["stub-event"],
+        ["/event/stub-event", "/api/event/ranking?event_id=41234"], _ranking_api,
+        lambda out: out.get("tier") in ("api", "cache") and len(out.get("ranking") or []) > 0, None),
+    "scrape_ranking (html tier)": (
+        "scrape_ranking.py", ["noid-event"],
+        ["/event/noid-event"], _ranking_html,
+        lambda out: out.get("tier") == "html" and len(out.get("ranking") or []) > 0, None),
+    "scrape_event_info": (
+        "scrape_event_info.py", ["stub-event"],
+        ["/event/stub-event"], _event_info,
+        lambda out: out.get("event_id") is not None and bool(out.get("blocks")), None),
+    "fetch_comment_log": (
+        "fetch_comment_log.py", [str(ROOM_ID)],
+        [f"/api/live/comment_log?room_id={ROOM_ID}"], json.loads,
+        lambda out: len(out.get("comment_log") or []) > 0, None),
+    "fetch_comment_log --delta": (
+        "fetch_comment_log.py", [str(ROOM_ID), "--delta"],
+        [f"/api/live/comment_log?room_id={ROOM_ID}"], _comment_delta,
+        lambda out: len(out.get("rows") or []) > 0, None),
+    "search_avatar": (
+        "search_avatar.py", [AVATAR_ID, "--json", "--no-index"],
+        ["/ava1000401.html"], _avatar,
+        lambda out: out.get("found") is True and out.get("room_url") == AVATAR_ROOM_URL, None),
+    "scrape_room_event": (
+        "scrape_room_event.py", [str(ROOM_ID)],
+        [f"/room/profile?room_id={ROOM_ID}"], _room_event,
+        lambda out: bool(out.get("event_url_key")), None),
+    "scrape_room_event (batch 50)": (
+        "scrape_room_event.py", [str(ROOM_ID + i) for i in range(50)],
+        [f"/api/room/event_and_support?room_id={ROOM_ID}"], _room_event_api,
+        lambda out: len(out.get("results") or []) == 50 and all(r.get("event_url_key") for r in out["results"]), None),
+}
+
+def script_env(base_url, cache_dir):
+    env = dict(os.environ)
+    env.update({
+        "SHOWROOM_BASE_URL": base_url,
+        "SR_AVATAR_BASE_URL": base_url,
+        "EVENT_CACHE_PATH": os.path.join(cache_dir, "event_cache.sqlite"),
+        "AVATAR_INDEX_PATH": os.path.join(cache_dir, "avatar_index.sqlite"),
+        "SNAPSHOT_DIR": os.path.join(cache_dir, "snapshots"),
+        "RESULT_CACHE_PATH": os.path.join(cache_dir, "result_cache.sqlite"),
+        "HTTP_CACHE_PATH": os.path.join(cache_dir, "http_cache.sqlite"),
+        "SCRAPER_METRICS_PATH": os.path.join(cache_dir, "scraper_metrics.sqlite"),
+        "PYTHONIOENCODING": "utf-8",
+        "PYTHONDONTWRITEBYTECODE": "1",
+    })
+    return env
+
+def run_child(cmd, env):
+    """(経過秒, 終了コード, 標準出力, 最大RSS MB) を返す。"""
+    with tempfile.TemporaryFile() as err:
+        t0 = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=ROOT, env=env, stdout=subprocess.PIPE, stderr=err)
+        out = proc.stdout.read()
+        proc.stdout.close()
+        rss = None
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            # Linux の ru_maxrss は KB
+            rss = usage.ru_maxrss / 1024
+        else:
+            proc.wait()
+        elapsed = time.perf_counter() - t0
+    return elapsed, proc.returncode, out.decode("utf-8", errors="replace"), rss
+
+def parse_output(text):
+    text = text.strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        lines = text.splitlines()
+        try:
+            return json.loads(lines[-1]) if lines else {}
+        except ValueError:
+            return {}
+
+def fetch_body(base_url, path):
+    with urllib.request.urlopen(base_url + path) as res:
+        return res.read().decode("utf-8")
+
+def upstream_totals(base_url):
+    """(リクエスト数, 304 の数, 送ったバイト数)"""
+    stats = json.loads(fetch_body(base_url, "/__stub/stats")).values()
+    return (sum(v["requests"] for v in stats), sum(v.get("not_modified", 0) for v in stats),
+            sum(v.get("bytes", 0) for v in stats))
+
+def median_ms(values):
+    return statistics.median(values) * 1000 if values else None
+
+def bench_case(name, case, server, args):
+    script, script_args, paths, parse_fn, check, needs = case
+    module = script[:-3]
+    result = {"case": name, "script": script}
+    if needs and importlib.util.find_spec(needs) is None:
+        result["skipped"] = f"{needs} is not installed"
+        return result
+
+    shared_cache = tempfile.mkdtemp(prefix="bench_cache_") if args.warm_cache else None
+    try:
+        # cold start
+        cache_dir = shared_cache or tempfile.mkdtemp(prefix="bench_cache_")
+        env = script_env(server.base_url, cache_dir)
+        cold = [run_child([sys.executable, "-c", f"import {module}"], env)[0] for _ in range(args.runs)]
+        if not shared_cache:
+            shutil.rmtree(cache_dir, ignore_errors=True)
+
+        # parse (スタブのスレッドの遅延を含まないように本文は先に取っておく)
+        bodies = [fetch_body(server.base_url, p) for p in paths]
+        parse_fn(*bodies)
+        parse = []
+        for _ in range(args.runs):
+            t0 = time.perf_counter()
+            parse_fn(*bodies)
+            parse.append(time.perf_counter() - t0)
+
+        # end-to-end
+        e2e, rss, requests, not_modified, sent, failures = [], [], [], [], [], []
+        for _ in range(args.runs):
+            cache_dir = shared_cache or tempfile.mkdtemp(prefix="bench_cache_")
+            env = script_env(server.base_url, cache_dir)
+            before = upstream_totals(server.base_url)
+            # --fanout の分だけ同じ呼び出しを同時に走らせる (result_cache の効果を見る)
+            with ThreadPoolExecutor(max_workers=args.fanout) as pool:
+                children = list(pool.map(
+                    lambda _: run_child([sys.executable, script] + script_args, env), range(args.fanout)))
+            after = upstream_totals(server.base_url)
+            requests.append(after[0] - before[0])
+            not_modified.append(after[1] - before[1])
+            sent.append(after[2] - before[2])
+            if not shared_cache:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+            for elapsed, code, out, maxrss in children:
+                e2e.append(elapsed)
+                if maxrss is not None:
+                    rss.append(maxrss)
+                output = parse_output(out)
+                if code != 0 or not check(output):
+                    failures.append(output.get("error") if isinstance(output, dict) and output.get("error") else out.strip()[:200])
+    finally:
+        if shared_cache:
+            shutil.rmtree(shared_cache, ignore_errors=True)
+
+    result.update({
+        "cold_start_ms": median_ms(cold),
+        "parse_ms": median_ms(parse),
+        "e2e_ms": median_ms(e2e),
+        "e2e_max_ms": max(e2e) * 1000,
+        "rss_mb": max(rss) if rss else None,
+        "upstream_requests": statistics.median(requests),
+        "upstream_not_modified": statistics.median(not_modified),
+        "upstream_kb": statistics.median(sent) / 1024,
+        "ok": len(e2e) - len(failures),
+        "failed": len(failures),
+    })
+    if failures:
+        result["first_failure"] = failures[0]
+    return result
+
+def fmt(value, spec="8.1f"):
+    return format(value, spec) if value is not None else " " * (int(spec.split(".")[0]) - 1) + "-"
+
+def print_table(results):
+    print(f"{'case':28} {'cold ms':>8} {'parse ms':>8} {'e2e ms':>8} {'max ms':>8} {'RSS MB':>8} {'req':>5} {'304':>5} {'KB':>8} {'ok':>7}")
+    for r in results:
+        if "skipped" in r:
+            print(f"{r['case']:28} skipped ({r['skipped']})")
+            continue
+        print(f"{r['case']:28} {fmt(r['cold_start_ms'])} {fmt(r['parse_ms'], '8.2f')} {fmt(r['e2e_ms'])} "
+              f"{fmt(r['e2e_max_ms'])} {fmt(r['rss_mb'])} {r['upstream_requests']:5.0f} {r['upstream_not_modified']:5.0f} {fmt(r['upstream_kb'])} {r['ok']:>3}/{r['ok'] + r['failed']:<3}")
+        if r.get("first_failure"):
+            print(f"    first failure: {r['first_failure']}")
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Offline benchmark of the scraper scripts against the local stub")
+    parser.add_argument("--runs", type=int, default=5, help="Runs per measurement (the median is reported)")
+    parser.add_argument("--only", action="append", help="Run only cases whose name starts with this (repeatable)")
+    parser.add_argument("--fanout", type=int, default=1, help="Identical script processes started at once per run")
+    parser.add_argument("--warm-cache", action="store_true", help="Keep the caches between runs")
+    parser.add_argument("--json", action="store_true", help="Print results as JSON")
+    add_config_args(parser)
+    args = parser.parse_args(argv)
+
+    server = StubServer(config=config_from_args(args)).start()
+    try:
+        results = []
+        for name, case in CASES.items():
+            if args.only and not any(name.startswith(o) for o in args.only):
+                continue
+            results.append(bench_case(name, case, server, args))
+    finally:
+        server.stop()
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+    else:
+        print_table(results)
+    return 1 if any(r.get("failed") for r in results) else 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
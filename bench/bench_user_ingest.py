@@ -0,0 +1,77 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import user_ingest
+
+# user_ingest (メモリ上でマージして executemany) と、Worker の save_users と同じ
+# 「ユーザーごとに SELECT してから UPSERT」の書き方で、一晩分のコメントの取り込み時間を比べる。
+#
+#   python bench/bench_user_ingest.py --comments 300000 --users 20000
+
+def synthetic_night(comments, users, rename_rate=0.05, seed=0):
+    rnd = random.Random(seed)
+    names = {uid: f"viewer{uid}" for uid in range(users)}
+    start = 1767200000
+    log = []
+    for i in range(comments):
+        uid = rnd.randrange(users)
+        if rnd.random() < rename_rate / 10:
+            names[uid] = f"viewer{uid}_{i}"
+        log.append({"created_at": start + i // 10, "user_id": uid, "name": names[uid], "comment": "w"})
+    return [{"comment_log": log[i:i + 200]} for i in range(0, len(log), 200)]
+
+def legacy_ingest(conn, docs):
+    # Worker と同じく、コメントの uid ごとに SELECT + UPSERT
+    for doc in docs:
+        for uid, name, ts in user_ingest.iter_comments(doc):
+            uid = str(uid)
+            row = conn.execute("SELECT name, history FROM users WHERE uid = ?", (uid,)).fetchone()
+            history = []
+            if row:
+                history = json.loads(row[1] or "[]")
+                if row[0] and row[0] != name:
+                    history.append({"name": row[0], "date": user_ingest.iso(ts * 1000)})
+            conn.execute(
+                """INSERT INTO users (uid, name, last_seen, history) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(uid) DO UPDATE SET
+                   name = excluded.name, last_seen = excluded.last_seen, history = excluded.history""",
+                (uid, name, ts * 1000, json.dumps(history, ensure_ascii=False))
+            )
+            conn.commit()
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark bulk user ingest")
+    parser.add_argument("--comments", type=int, default=300000)
+    parser.add_argument("--users", type=int, default=20000)
+    parser.add_argument("--legacy-limit", type=int, default=30000,
+                        help="Comments used for the per-user loop (it is slow; the rate is extrapolated)")
+    args = parser.parse_args(argv)
+
+    docs = synthetic_night(args.comments, args.users)
+    with tempfile.TemporaryDirectory() as d:
+        conn = user_ingest.connect(os.path.join(d, "bulk.sqlite"))
+        t0 = time.perf_counter()
+        observed, count = user_ingest.collect(docs)
+        stats = user_ingest.ingest(conn, observed)
+        bulk = time.perf_counter() - t0
+
+        legacy_docs = docs[:max(1, args.legacy_limit // 200)]
+        legacy_count = sum(len(d["comment_log"]) for d in legacy_docs)
+        conn2 = user_ingest.connect(os.path.join(d, "legacy.sqlite"))
+        t0 = time.perf_counter()
+        legacy_ingest(conn2, legacy_docs)
+        legacy = time.perf_counter() - t0
+
+    print(f"{count} comments, {stats['users']} users, {stats['name_changes']} name changes")
+    print(f"  user_ingest       : {bulk:8.2f} s  {count / bulk:10.0f} comments/s")
+    print(f"  per-user upsert   : {legacy:8.2f} s  {legacy_count / legacy:10.0f} comments/s  ({legacy_count} comments)")
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,141 @@
+import time
+import random
+
+# ベンチ / スタブサーバ用の合成レスポンス。
+# 実ページの構造に近い形で、乱数シードが同じなら毎回同じ内容になる。
+
+DEFAULT_EVENT_ID = 41234
+
+def room_id_for(i):
+    return 100000 + i
+
+def ranking_page(rows=10000, seed=0, event_id=DEFAULT_EVENT_ID, blocks=()):
+    """contentlist-row 形式のイベントページ。event_id=None なら eventId を埋め込まない。"""
+    # 実ページに近い行 (h4 あり / h4 空で img-main の alt / バッジ画像あり など) を混ぜる
+    rnd = random.Random(seed)
+    script = f'<script>window.__NUXT__={{eventId:{event_id}}}</script>' if event_id is not None else ''
+    parts = [f'<html><head>{script}</head><body>']
+    if blocks:
+        parts.append('<select class="block-select">')
+        parts += [f'<option value="{block_id}">{name}</option>' for block_id, name in blocks]
+        parts.append('</select>')
+    parts.append('<ul class="contentlist">')
+    for i in range(1, rows + 1):
+        room_id = room_id_for(i)
+        name = f"ルーム{i} &amp; friends"
+        kind = rnd.randrange(4)
+        badge = '<img class="badge" alt="Official">' if rnd.random() < 0.2 else ''
+        if kind == 0:
+            title = f'<h4 class="listcardinfo-main-text">{name}</h4>'
+            img = f'<img class="img-main" src="/img/{room_id}.png" alt="{name}">'
+        elif kind == 1:
+            title = '<h4 class="listcardinfo-main-text"> </h4>'
+            img = f'{badge}<img src="/img/{room_id}.png" class="img-main js-lazy" alt="{name}">'
+        elif kind == 2:
+            title = ''
+            img = f'<img alt="{name}" src="/img/{room_id}.png">'
+        else:
+            title = f'<h4 class="listcardinfo-main-text is-small">\n  {name}\n</h4>'
+            img = f'{badge}<img class="img-main" alt="{name}">'
+        parts.append(
+            f'<li class="contentlist-row"><div class="listcard listcard-ranking is-rank-{i}">'
+            f'<a href="/r/room_{room_id}" data-room-id="{room_id}">{img}</a>'
+            f'<div class="listcardinfo">{title}'
+            f'<p class="listcardinfo-sub-text">{rnd.randrange(1000, 9999999):,} pt</p>'
+            f'<a class="listcardinfo-link" href="/room/profile?room_id={room_id}">profile</a></div></div></li>\n'
+        )
+    parts.append('</ul></body></html>')
+    return "".join(parts)
+
+def ranking_entries(rows, seed=0, start=1):
+    """/api/event/ranking の ranking 要素 (rank / point / room)。"""
+    rnd = random.Random(seed * 7919 + start)
+    entries = []
+    point = 10_000_000 - (start - 1) * 1000
+    for i in range(start, start + rows):
+        point -= rnd.randrange(1, 1000)
+        room_id = room_id_for(i)
+        entries.append({
+            "rank": i,
+            "point": point,
+            "room": {"room_id": room_id, "room_name": f"ルーム{i}", "room_url_key": f"room_{room_id}"}
+        })
+    return entries
+
+def block_ranking_entries(rows, seed=0, start=1):
+    """/api/event/block_ranking の block_ranking_list 要素 (ルーム情報がフラット)。"""
+    return [
+        {"rank": e["rank"], "point": e["point"], "room_id": e["room"]["room_id"],
+         "room_name": e["room"]["room_name"], "room_url_key": e["room"]["room_url_key"]}
+        for e in ranking_entries(rows, seed, start)
+    ]
+
+def event_and_support(event_id, event_url, event_name="Stub Event"):
+    return {
+        "event": {
+            "event_id": event_id,
+            "event_name": event_name,
+            "event_url": event_url,
+            "ended_at": int(time.time()) + 86400
+        },
+        "support": None
+    }
+
+def comment_log(room_id, count=100, seed=0, now=None):
+    """/api/live/comment_log。新しい順で、呼ぶたびに先頭へ新しいコメントが増えていく。"""
+    now = int(now if now is not None else time.time())
+    rnd = random.Random(f"{seed}:{room_id}")
+    log = []
+    for i in range(count):
+        user_id = rnd.randrange(1, 5000)
+        log.append({
+            "created_at": now - i * 3,
+            "user_id": user_id,
+            "name": f"user{user_id}",
+            "comment": f"comment {i} from {room_id}",
+            "avatar_id": rnd.randrange(1000001, 1100000),
+            "ua": 3
+        })
+    return {"comment_log": log}
+
+def room_profile(room_id, event_url_key):
+    return (
+        f'<html><body><div class="room-profile" data-room-id="{room_id}">'
+        f'<a href="/event/{event_url_key}?room_id={room_id}"><img alt="event banner"></a>'
+        f'<a href="/event/contribution/{event_url_key}?room_id={room_id}">contribution</a>'
+        '</div></body></html>'
+    )
+
+def avatar_page(page_start=1000401, count=100, seed=0):
+    # sr-avatar.com のページに近い構造 (画像リンク / テキストのみ / リンク無し が混在)
+    rnd = random.Random(seed)
+    parts = [
+        "<!DOCTYPE html><html><head><title>avatar</title>",
+        "<style>.a{color:red}</style></head><body>",
+        f"<h1>{page_start}～{page_start + count - 1}</h1><table>",
+    ]
+    for aid in range(page_start, page_start + count):
+        kind = rnd.randrange(5)
+        room = rnd.randrange(100000, 400000)
+        if kind == 0:
+            parts.append(
+                f'<tr><td><a href="https://www.showroom-live.com/room/profile?room_id={room}">'
+                f'<img src="img/{aid}.png" alt=""><br><span>Room {room}</span></a></td></tr>'
+            )
+        elif kind == 1:
+            parts.append(
+                f'<tr><td><a href="/room/profile?room_id={room}">Room&amp;{room}</a></td>'
+                f'<td><p>{aid}</p></td></tr>'
+            )
+        elif kind == 2:
+            parts.append(f'<tr><td><img src="img/{aid}.png"></td><td>{aid}<!-- no link --></td></tr>')
+        elif kind == 3:
+            parts.append(
+                f'<tr><td><a href="https://twitter.com/x{room}"><img src="img/{aid}.png"></a>'
+                f'<div><b>{aid}</b></div></td></tr>'
+            )
+        else:
+            parts.append(f'<tr><td><div>ID: {aid} - {room} - deleted room</div></td></tr>')
+        parts.append("\n")
+    parts.append("</table></body></html>")
+    return "".join(parts)
@@ -0,0 +1,326 @@
+import os
+import re
+import sys
+import gzip
+import json
+import time
+import hashlib
+import random
+import argparse
+import threading
+import urllib.parse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import stub_fixtures
+
+# showroom-live.com / sr-avatar.com の代わりに応答するローカルのスタブサーバ。
+# ネットワークの無いマシンでスクリプトのベンチ / 動作確認をするためのもの。
+#
+#   python bench/stub_server.py --port 8765 --latency 30 --jitter 10 --error-rate 0.05
+#   SHOWROOM_BASE_URL=http://127.0.0.1:8765 SR_AVATAR_BASE_URL=http://127.0.0.1:8765 \
+#       python scrape_ranking.py stub-event
+#
+# 応答するパス (両サイトのパスは重ならないので1ポートで兼ねる):
+#   /event/<url_key>                   イベントページ (url_key が "noid-" で始まると eventId を埋め込まない)
+#   /api/event/ranking                 ?event_id=&page=
+#   /api/event/block_ranking           ?event_id=&block_id=&page=
+#   /api/room/event_and_support        ?room_id=
+#   /api/live/comment_log              ?room_id=
+#   /room/profile                      ?room_id=
+#   /ava*.html                         アバターページ
+#   /__stub/stats                      パスごとのリクエスト数
+#
+# HTML の応答には ETag を付けて If-None-Match に 304 を返し、1KB 以上の応答は
+# Accept-Encoding に gzip があれば圧縮する (--no-validators / --no-compress で切れる)。
+#
+# --fixtures DIR に保存済みのレスポンスがあればそちらを返す (record サブコマンドで実サイトから保存できる)。
+# ファイル名はパス + クエリ: /api/event/ranking?event_id=1 -> DIR/api/event/ranking__event_id=1
+# クエリ付きのファイルが無ければクエリ無しのファイル (DIR/api/event/ranking) を探す。
+
+def fixture_name(path, query=""):
+    name = path.strip("/") or "index"
+    if query:
+        pairs = sorted(urllib.parse.parse_qsl(query))
+        name += "__" + "&".join(f"{k}={v}" for k, v in pairs)
+    return name
+
+class StubConfig:
+    def __init__(self, fixtures=None, latency=0.0, jitter=0.0, error_rate=0.0,
+                 error_status=(503,), error_match=None, rows=1000, per_page=50,
+                 comments=100, event_id=stub_fixtures.DEFAULT_EVENT_ID, event_key="stub-event",
+                 blocks=2, seed=0, validators=True, compress=True):
+        self.fixtures = fixtures
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.error_status = tuple(error_status)
+        self.error_match = re.compile(error_match) if error_match else None
+        self.rows = rows
+        self.per_page = per_page
+        self.comments = comments
+        self.event_id = event_id
+        self.event_key = event_key
+        self.blocks = [(str(event_id * 10 + i), f"Block {chr(ord('A') + i)}") for i in range(blocks)]
+        self.seed = seed
+        self.validators = validators
+        self.compress = compress
+
+class StubState:
+    def __init__(self, config):
+        self.config = config
+        self.rnd = random.Random(config.seed)
+        self.lock = threading.Lock()
+        self.stats = {}
+        # room_id -> 最後にそのルームを載せたイベントページの url_key
+        self.room_events = {}
+        self._pages = {}
+
+    def count(self, route, status, sent=0):
+        with self.lock:
+            entry = self.stats.setdefault(route, {"requests": 0, "errors": 0, "not_modified": 0, "bytes": 0})
+            entry["requests"] += 1
+            if status >= 400:
+                entry["errors"] += 1
+            elif status == 304:
+                entry["not_modified"] += 1
+            entry["bytes"] += sent
+
+    def event_page(self, url_key):
+        # 大きいページは作るのに時間がかかるので url_key ごとに使い回す
+        with self.lock:
+            html = self._pages.get(url_key)
+        if html is None:
+            cfg = self.config
+            event_id = None if url_key.startswith("noid-") else cfg.event_id
+            html = stub_fixtures.ranking_page(cfg.rows, cfg.seed, event_id, cfg.blocks)
+            with self.lock:
+                self._pages[url_key] = html
+                for i in range(1, cfg.rows + 1):
+                    self.room_events[stub_fixtures.room_id_for(i)] = url_key
+        return html
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    server_version = "ShowroomStub/1.0"
+
+    def log_message(self, format, *args):
+        pass
+
+    @property
+    def state(self):
+        return self.server.state
+
+    def do_GET(self):
+        parsed = urllib.parse.urlsplit(self.path)
+        path, query = parsed.path, parsed.query
+        params = dict(urllib.parse.parse_qsl(query))
+        cfg = self.state.config
+
+        if path == "/__stub/stats":
+            return self.reply(200, self.state.stats, route=None)
+
+        delay = cfg.latency + (random.uniform(-cfg.jitter, cfg.jitter) if cfg.jitter else 0.0)
+        if delay > 0:
+            time.sleep(delay / 1000)
+
+        route = self.route_name(path)
+        if cfg.error_rate and (cfg.error_match is None or cfg.error_match.search(path)):
+            with self.state.lock:
+                fail = self.state.rnd.random() < cfg.error_rate
+                status = self.state.rnd.choice(cfg.error_status)
+            if fail:
+                return self.reply(status, {"errors": [{"message": "stub: injected error"}]}, route)
+
+        body = self.load_fixture(path, query)
+        if body is not None:
+            return self.reply(200, body, route)
+
+        try:
+            status, body = self.synthesize(path, params)
+        except (KeyError, ValueError) as e:
+            status, body = 400, {"errors": [{"message": f"stub: bad request ({e})"}]}
+        return self.reply(status, body, route)
+
+    def route_name(self, path):
+        if path.startswith("/event/"):
+            return "/event/*"
+        if re.match(r"^/ava[^/]*\.html$", path):
+            return "/ava*.html"
+        return path
+
+    def load_fixture(self, path, query):
+        root = self.state.config.fixtures
+        if not root:
+            return None
+        for name in (fixture_name(path, query), fixture_name(path)):
+            full = os.path.normpath(os.path.join(root, name))
+            if not full.startswith(os.path.normpath(root)):
+                continue
+            if os.path.isfile(full):
+                with open(full, "rb") as f:
+                    return f.read()
+        return None
+
+    def synthesize(self, path, params):
+        cfg = self.state.config
+
+        if path.startswith("/event/"):
+            return 200, self.state.event_page(path[len("/event/"):])
+
+        if path in ("/api/event/ranking", "/api/event/block_ranking"):
+            int(params["event_id"])
+            page = max(1, int(params.get("page", 1)))
+            start = (page - 1) * cfg.per_page + 1
+            rows = max(0, min(cfg.per_page, cfg.rows - start + 1))
+            last_page = max(1, -(-cfg.rows // cfg.per_page))
+            paging = {
+                "current_page": page,
+                "next_page": page + 1 if page < last_page else None,
+                "last_page": last_page,
+                "total_entries": cfg.rows
+            }
+            if path == "/api/event/ranking":
+                return 200, dict(ranking=stub_fixtures.ranking_entries(rows, cfg.seed, start), **paging)
+            block_seed = cfg.seed + int(params.get("block_id") or 0)
+            return 200, dict(block_ranking_list=stub_fixtures.block_ranking_entries(rows, block_seed, start), **paging)
+
+        if path == "/api/room/event_and_support":
+            room_id = int(params["room_id"])
+            with self.state.lock:
+                url_key = self.state.room_events.get(room_id, cfg.event_key)
+            base = f"http://{self.headers.get('Host', 'localhost')}"
+            return 200, stub_fixtures.event_and_support(cfg.event_id, f"{base}/event/{url_key}")
+
+        if path == "/api/live/comment_log":
+            return 200, stub_fixtures.comment_log(int(params["room_id"]), cfg.comments, cfg.seed)
+
+        if path == "/room/profile":
+            room_id = int(params["room_id"])
+            with self.state.lock:
+                url_key = self.state.room_events.get(room_id, cfg.event_key)
+            return 200, stub_fixtures.room_profile(room_id, url_key)
+
+        m = re.match(r"^/ava(\d+)\.html$", path)
+        if m:
+            return 200, stub_fixtures.avatar_page(int(m.group(1)), 100, cfg.seed)
+        if path in ("/ava_shop.html", "/ava999.html"):
+            return 200, stub_fixtures.avatar_page(2000001 if "shop" in path else 999001, 100, cfg.seed)
+
+        return 404, {"errors": [{"message": "stub: not found"}]}
+
+    def reply(self, status, body, route):
+        if isinstance(body, (dict, list)):
+            data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+            content_type = "application/json; charset=utf-8"
+        else:
+            data = body.encode("utf-8") if isinstance(body, str) else body
+            content_type = "application/json; charset=utf-8" if data[:1] in (b"{", b"[") else "text/html; charset=utf-8"
+        cfg = self.state.config
+        headers = {"Content-Type": content_type}
+        if status == 200 and cfg.validators and content_type.startswith("text/html"):
+            etag = '"' + hashlib.md5(data).hexdigest() + '"'
+            headers["ETag"] = etag
+            if etag in self.headers.get("If-None-Match", ""):
+                status, data = 304, b""
+        if status == 200 and cfg.compress and len(data) >= 1024 and "gzip" in self.headers.get("Accept-Encoding", ""):
+            data = gzip.compress(data, compresslevel=1)
+            headers["Content-Encoding"] = "gzip"
+
+        if route is not None:
+            self.state.count(route, status, len(data))
+        self.send_response(status)
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+class StubServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=0, config=None):
+        super().__init__((host, port), StubHandler)
+        self.state = StubState(config or StubConfig())
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        """バックグラウンドのスレッドで応答を始める (ベンチから使う)。"""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+def record(urls, fixtures):
+    """実サイトのレスポンスを --fixtures の形式で保存する。"""
+    import requests
+    headers = {"User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36"}
+    for url in urls:
+        parts = urllib.parse.urlsplit(url)
+        path = os.path.join(fixtures, fixture_name(parts.path, parts.query))
+        res = requests.get(url, headers=headers, timeout=30)
+        if res.status_code != 200:
+            print(f"[stub_server] {url}: HTTP {res.status_code}", file=sys.stderr)
+            continue
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(res.content)
+        print(f"{url} -> {path} ({len(res.content)} bytes)")
+
+def add_config_args(parser):
+    parser.add_argument("--fixtures", help="Directory of recorded responses served before the synthetic ones")
+    parser.add_argument("--latency", type=float, default=0.0, help="Added latency per request (ms)")
+    parser.add_argument("--jitter", type=float, default=0.0, help="Random +/- jitter on the latency (ms)")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Fraction of requests answered with an error")
+    parser.add_argument("--error-status", default="503", help="Comma separated statuses used for injected errors")
+    parser.add_argument("--error-match", help="Only inject errors on paths matching this regex")
+    parser.add_argument("--rows", type=int, default=1000, help="Rooms in the synthetic event")
+    parser.add_argument("--per-page", type=int, default=50, help="Rows per ranking API page")
+    parser.add_argument("--comments", type=int, default=100, help="Comments per comment_log response")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--no-validators", action="store_true", help="Do not send ETags / 304 on HTML pages")
+    parser.add_argument("--no-compress", action="store_true", help="Never gzip responses")
+
+def config_from_args(args):
+    return StubConfig(
+        fixtures=args.fixtures, latency=args.latency, jitter=args.jitter,
+        error_rate=args.error_rate, error_status=[int(s) for s in args.error_status.split(",") if s],
+        error_match=args.error_match, rows=args.rows, per_page=args.per_page,
+        comments=args.comments, seed=args.seed,
+        validators=not args.no_validators, compress=not args.no_compress
+    )
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Local stub of the showroom-live.com / sr-avatar.com endpoints")
+    sub = parser.add_subparsers(dest="command")
+
+    p_record = sub.add_parser("record", help="Save real responses as fixtures")
+    p_record.add_argument("urls", nargs="+")
+    p_record.add_argument("--fixtures", required=True)
+
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    add_config_args(parser)
+    args = parser.parse_args(argv)
+
+    if args.command == "record":
+        record(args.urls, args.fixtures)
+        return
+
+    server = StubServer(args.host, args.port, config_from_args(args))
+    print(f"[stub_server] serving on {server.base_url}", file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
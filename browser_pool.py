@@ -0,0 +1,196 @@
+import os
+import sys
+import time
+import atexit
+import threading
+import contextlib
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+import timing
+
+# Headless Chrome pool shared by scrape_ranking / scrape_room_event.
+# Chrome起動は数秒+数百MBかかるため、起動済みのブラウザを使い回す。
+#  - 同時に動くブラウザ数は max_browsers まで (超えた分は空きが出るまで待つ)
+#  - max_pages ページ処理したら、または RSS が max_rss_mb を超えたら作り直す
+#  - 貸し出し前に生存確認し、応答しないものは破棄する
+
+# ページ読み込みの上限 (Selenium の既定 300s は server.js の PY_TIMEOUT_MS 60s より長い)
+PAGE_LOAD_TIMEOUT = int(os.environ.get("BROWSER_PAGE_LOAD_TIMEOUT", "30"))
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36'
+
+def make_options():
+    from selenium.webdriver.chrome.options import Options
+
+    options = Options()
+    options.add_argument('--headless') # Run in background
+    options.add_argument('--disable-gpu')
+    options.add_argument('--no-sandbox')
+    options.add_argument('--disable-dev-shm-usage')
+    # Mimic a real browser
+    options.add_argument(f'user-agent={USER_AGENT}')
+    # Suppress logging
+    options.add_experimental_option('excludeSwitches', ['enable-logging'])
+    return options
+
+class PooledBrowser:
+    def __init__(self, driver):
+        self.driver = driver
+        self.pages = 0
+        self.created_at = time.monotonic()
+
+    def rss_mb(self):
+        # psutil が無い環境ではメモリによる入れ替えは行わない
+        if psutil is None:
+            return 0
+        try:
+            proc = psutil.Process(self.driver.service.process.pid)
+            procs = [proc] + proc.children(recursive=True)
+            return sum(p.memory_info().rss for p in procs) / (1024 * 1024)
+        except Exception:
+            return 0
+
+    def is_alive(self):
+        try:
+            self.driver.execute_script("return 1")
+            return True
+        except Exception:
+            return False
+
+    def quit(self):
+        try:
+            self.driver.quit()
+        except Exception:
+            pass
+
+class BrowserPool:
+    def __init__(self, max_browsers=2, max_pages=50, max_rss_mb=800, wait_timeout=60):
+        self.max_browsers = max_browsers
+        self.max_pages = max_pages
+        self.max_rss_mb = max_rss_mb
+        self.wait_timeout = wait_timeout
+        self._idle = []
+        # 貸し出し中も含めて起動済みのブラウザ全部 (close() で止めるため)
+        self._browsers = set()
+        self._in_use = 0
+        self._cond = threading.Condition()
+        self._closed = False
+
+    def _create(self):
+        from selenium import webdriver
+        with timing.stage("browser_launch"):
+            driver = webdriver.Chrome(options=make_options())
+        driver.set_page_load_timeout(PAGE_LOAD_TIMEOUT)
+        browser = PooledBrowser(driver)
+        with self._cond:
+            self._browsers.add(browser)
+        return browser
+
+    def _quit(self, browser):
+        browser.quit()
+        with self._cond:
+            self._browsers.discard(browser)
+
+    def _should_recycle(self, browser):
+        if browser.pages >= self.max_pages:
+            return True
+        if self.max_rss_mb and browser.rss_mb() > self.max_rss_mb:
+            return True
+        return False
+
+    def acquire(self):
+        deadline = time.monotonic() + self.wait_timeout
+        with self._cond:
+            # 上限に達している場合は返却を待つ (キューイング)
+            while not self._idle and self._in_use >= self.max_browsers:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError("Browser pool exhausted")
+                self._cond.wait(remaining)
+            browser = self._idle.pop() if self._idle else None
+            self._in_use += 1
+
+        try:
+            if browser is not None and not browser.is_alive():
+                self._quit(browser)
+                browser = None
+            if browser is None:
+                browser = self._create()
+        except Exception:
+            with self._cond:
+                self._in_use -= 1
+                self._cond.notify()
+            raise
+        return browser
+
+    def release(self, browser, broken=False):
+        browser.pages += 1
+        discard = broken or self._closed or self._should_recycle(browser)
+        if discard:
+            self._quit(browser)
+        with self._cond:
+            self._in_use -= 1
+            if not discard:
+                self._idle.append(browser)
+            self._cond.notify()
+
+    @contextlib.contextmanager
+    def driver(self):
+        # 空き待ちと (必要なら) 起動を含む
+        with timing.stage("browser_acquire"):
+            browser = self.acquire()
+        broken = False
+        try:
+            yield browser.driver
+        except Exception:
+            # WebDriver 側の異常で落ちた可能性があるので使い回さない
+            broken = not browser.is_alive()
+            raise
+        finally:
+            self.release(browser, broken=broken)
+
+    def close(self):
+        # 貸し出し中のものも止める (SIGTERM で止められたときに chromedriver / Chrome を残さない)
+        with self._cond:
+            self._closed = True
+            self._idle = []
+            browsers, self._browsers = list(self._browsers), set()
+        for browser in browsers:
+            browser.quit()
+
+_pool = None
+_pool_lock = threading.Lock()
+
+def get_pool():
+    global _pool
+    with _pool_lock:
+        if _pool is None:
+            _pool = BrowserPool(
+                max_browsers=int(os.environ.get("BROWSER_POOL_SIZE", "2")),
+                max_pages=int(os.environ.get("BROWSER_MAX_PAGES", "50")),
+                max_rss_mb=int(os.environ.get("BROWSER_MAX_RSS_MB", "800")),
+                wait_timeout=int(os.environ.get("BROWSER_WAIT_TIMEOUT", "60")),
+            )
+            atexit.register(_pool.close)
+        return _pool
+
+def close_pool():
+    """起動済みのプールがあれば閉じる (無ければ何もしない)。"""
+    with _pool_lock:
+        pool = _pool
+    if pool is not None:
+        pool.close()
+
+if __name__ == "__main__":
+    # 動作確認用: python browser_pool.py <url> [<url> ...]
+    pool = get_pool()
+    for url in sys.argv[1:]:
+        t0 = time.monotonic()
+        with pool.driver() as d:
+            d.get(url)
+            title = d.title
+        print(f"{time.monotonic() - t0:.2f}s {url} {title}")
@@ -0,0 +1,170 @@
+import sys
+import io
+import json
+import time
+import asyncio
+import argparse
+
+import http_client
+
+from fetch_comment_log import HEADERS, DELTA_FIELDS, log_url, compute_delta
+
+# 複数ルームの comment_log を1プロセスでまとめてポーリングし、
+# 新しいコメントだけをルームIDタグ付きの NDJSON で流す。
+#
+#   python comment_poller.py 123 456 789 --interval 5
+#   python comment_poller.py --rooms-file rooms.txt --listen 127.0.0.1:9010
+#
+# - 接続は http_client の共有セッションで使い回す (HTTP 呼び出しはスレッドで実行)
+# - 全体のリクエスト数は --global-rate (req/s)、ルームごとは --interval 秒に1回まで
+# - エラーが続くルームは間隔を倍々に延ばす (最大 --max-interval)
+
+class RateLimiter:
+    """トークンバケット。rate 回/秒、burst 回までまとめて許可する。"""
+
+    def __init__(self, rate, burst=None):
+        self.rate = rate
+        self.capacity = burst or max(1, int(rate))
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+class StdoutSink:
+    def __init__(self):
+        self.out = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', line_buffering=True)
+
+    async def start(self):
+        pass
+
+    def emit(self, record):
+        self.out.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+
+class SocketSink:
+    """TCP で接続してきたクライアント全員に NDJSON を配信する。"""
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.writers = set()
+
+    async def start(self):
+        await asyncio.start_server(self._on_connect, self.host, self.port)
+        print(f"[comment_poller] listening on {self.host}:{self.port}", file=sys.stderr)
+
+    async def _on_connect(self, reader, writer):
+        self.writers.add(writer)
+        try:
+            await reader.read()
+        finally:
+            self.writers.discard(writer)
+            writer.close()
+
+    def emit(self, record):
+        line = (json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n").encode('utf-8')
+        for writer in list(self.writers):
+            if writer.is_closing():
+                self.writers.discard(writer)
+                continue
+            writer.write(line)
+
+class CommentPoller:
+    def __init__(self, room_ids, sink, interval=5.0, max_interval=60.0, global_rate=10.0, concurrency=8, timeout=10):
+        self.room_ids = list(dict.fromkeys(str(r) for r in room_ids))
+        self.sink = sink
+        self.interval = interval
+        self.max_interval = max_interval
+        self.limiter = RateLimiter(global_rate)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.cursors = {}
+
+    def _get(self, room_id):
+        # リトライはせず、失敗したルームは間隔を延ばして次の回に任せる
+        res = http_client.get(log_url(room_id), HEADERS, self.timeout, retries=0)
+        if res.status_code != 200:
+            raise RuntimeError(f"HTTP {res.status_code}")
+        return res.json()
+
+    async def poll_once(self, room_id, semaphore):
+        await self.limiter.acquire()
+        async with semaphore:
+            data = await asyncio.to_thread(self._get, room_id)
+
+        comments, cursor, reset = compute_delta(data.get("comment_log") or [], self.cursors.get(room_id))
+        self.cursors[room_id] = cursor
+        if comments or reset:
+            self.sink.emit({
+                "room_id": room_id,
+                "cursor": cursor,
+                "reset": reset,
+                "fields": DELTA_FIELDS,
+                "rows": [[c.get(f) for f in DELTA_FIELDS] for c in comments]
+            })
+
+    async def run_room(self, room_id, semaphore):
+        delay = self.interval
+        while True:
+            started = time.monotonic()
+            try:
+                await self.poll_once(room_id, semaphore)
+                delay = self.interval
+            except Exception as e:
+                # 失敗が続くルームは間隔を延ばして他のルームに枠を回す
+                delay = min(delay * 2, self.max_interval)
+                self.sink.emit({"room_id": room_id, "error": str(e), "retry_in": delay})
+            await asyncio.sleep(max(0.0, delay - (time.monotonic() - started)))
+
+    async def run(self):
+        await self.sink.start()
+        semaphore = asyncio.Semaphore(self.concurrency)
+        await asyncio.gather(*(self.run_room(rid, semaphore) for rid in self.room_ids))
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Poll comment logs of many rooms and stream NDJSON")
+    parser.add_argument("room_ids", nargs="*")
+    parser.add_argument("--rooms-file", help="File with one room_id per line ('-' for stdin)")
+    parser.add_argument("--interval", type=float, default=5.0, help="Seconds between polls of one room")
+    parser.add_argument("--max-interval", type=float, default=60.0, help="Upper bound of the error backoff")
+    parser.add_argument("--global-rate", type=float, default=10.0, help="Max upstream requests per second")
+    parser.add_argument("--concurrency", type=int, default=8, help="Max requests in flight")
+    parser.add_argument("--listen", help="host:port to serve NDJSON over TCP instead of stdout")
+    args = parser.parse_args(argv)
+
+    room_ids = list(args.room_ids)
+    if args.rooms_file:
+        f = sys.stdin if args.rooms_file == "-" else open(args.rooms_file, encoding='utf-8')
+        with f:
+            room_ids += [line.strip() for line in f if line.strip()]
+    if not room_ids:
+        print(json.dumps({"error": "No room_id provided"}))
+        return
+
+    if args.listen:
+        host, _, port = args.listen.rpartition(":")
+        sink = SocketSink(host or "127.0.0.1", int(port))
+    else:
+        sink = StdoutSink()
+
+    poller = CommentPoller(
+        room_ids, sink,
+        interval=args.interval, max_interval=args.max_interval,
+        global_rate=args.global_rate, concurrency=args.concurrency
+    )
+    try:
+        asyncio.run(poller.run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import contextlib
+
+import timing
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# scrape_event_info / scrape_room_event / scrape_ranking が共有するイベント情報キャッシュ。
+#   room_id       -> event_url_key
+#   event_url_key -> {event_id, event_name, blocks}
+# TTL付きでSQLiteに保存し、同じキーの同時ミスは1回の取得にまとめる
+# (プロセス内はスレッドロック、プロセス間はロックファイル)。
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+DB_PATH = os.environ.get("EVENT_CACHE_PATH", os.path.join(CACHE_DIR, "event_cache.sqlite"))
+
+ROOM_EVENT_TTL = int(os.environ.get("ROOM_EVENT_TTL", "600"))
+EVENT_INFO_TTL = int(os.environ.get("EVENT_INFO_TTL", "3600"))
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS room_events (
+    room_id TEXT PRIMARY KEY,
+    event_url_key TEXT NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS events (
+    event_url_key TEXT PRIMARY KEY,
+    event_id INTEGER,
+    event_name TEXT,
+    blocks TEXT,
+    updated_at REAL
+);
+"""
+
+class EventCache:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.lock_dir = os.path.join(os.path.dirname(path), "locks")
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._db_lock = threading.Lock()
+        self._key_locks = {}
+        self._key_locks_lock = threading.Lock()
+
+    def _query(self, sql, params=()):
+        with self._db_lock:
+            return self._conn.execute(sql, params).fetchone()
+
+    def _write(self, sql, params=()):
+        with self._db_lock, self._conn:
+            self._conn.execute(sql, params)
+
+    # --- room_id -> event_url_key ---
+
+    def get_room_event(self, room_id, ttl=ROOM_EVENT_TTL):
+        row = self._query(
+            "SELECT event_url_key, updated_at FROM room_events WHERE room_id = ?", (str(room_id),)
+        )
+        if row and time.time() - row[1] <= ttl:
+            return row[0]
+        return None
+
+    def set_room_event(self, room_id, event_url_key):
+        self._write(
+            "INSERT OR REPLACE INTO room_events (room_id, event_url_key, updated_at) VALUES (?, ?, ?)",
+            (str(room_id), event_url_key, time.time())
+        )
+
+    def invalidate_room(self, room_id):
+        self._write("DELETE FROM room_events WHERE room_id = ?", (str(room_id),))
+
+    # --- event_url_key -> {event_id, event_name, blocks} ---
+
+    def get_event(self, event_url_key, ttl=EVENT_INFO_TTL):
+        row = self._query(
+            "SELECT event_id, event_name, blocks, updated_at FROM events WHERE event_url_key = ?",
+            (event_url_key,)
+        )
+        if not row or row[3] is None or time.time() - row[3] > ttl:
+            return None
+        info = {"event_url_key": event_url_key}
+        if row[0] is not None:
+            info["event_id"] = row[0]
+            info["event_name"] = row[1]
+        if row[2] is not None:
+            info["blocks"] = json.loads(row[2])
+        return info
+
+    def set_event(self, info):
+        blocks = info.get("blocks")
+        # 取れなかった項目で既存の値 (set_event_id で入れた event_id など) を消さない
+        self._write(
+            "INSERT INTO events (event_url_key, event_id, event_name, blocks, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(event_url_key) DO UPDATE SET "
+            "event_id = COALESCE(excluded.event_id, events.event_id), "
+            "event_name = COALESCE(excluded.event_name, events.event_name), "
+            "blocks = COALESCE(excluded.blocks, events.blocks), "
+            "updated_at = excluded.updated_at",
+            (
+                info["event_url_key"], info.get("event_id"), info.get("event_name"),
+                json.dumps(blocks, ensure_ascii=False) if blocks is not None else None,
+                time.time()
+            )
+        )
+
+    def get_event_id(self, event_url_key):
+        # イベントIDは開催中に変わらないのでTTLを見ない
+        row = self._query("SELECT event_id FROM events WHERE event_url_key = ?", (event_url_key,))
+        return row[0] if row else None
+
+    def set_event_id(self, event_url_key, event_id):
+        # event_id だけ分かった場合。updated_at は触らない (イベント情報としてはミス扱いのまま)
+        self._write(
+            "INSERT INTO events (event_url_key, event_id) VALUES (?, ?) "
+            "ON CONFLICT(event_url_key) DO UPDATE SET event_id = excluded.event_id",
+            (event_url_key, int(event_id))
+        )
+
+    def invalidate_event(self, event_url_key):
+        self._write("DELETE FROM events WHERE event_url_key = ?", (event_url_key,))
+
+    def clear(self):
+        with self._db_lock, self._conn:
+            self._conn.execute("DELETE FROM room_events")
+            self._conn.execute("DELETE FROM events")
+
+    # --- single-flight ---
+
+    @contextlib.contextmanager
+    def key_lock(self, key):
+        with self._key_locks_lock:
+            lock = self._key_locks.setdefault(key, threading.Lock())
+        with lock:
+            if fcntl is None:
+                yield
+                return
+            name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+            with open(os.path.join(self.lock_dir, name + ".lock"), "w") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get_or_fetch_event(self, event_url_key, fetch, ttl=EVENT_INFO_TTL):
+        info = self.get_event(event_url_key, ttl)
+        if info is not None:
+            timing.record_cache("event_cache", True)
+            return info
+        with self.key_lock("event:" + event_url_key):
+            # 待っている間に他の呼び出しが取得済みならそれを使う
+            info = self.get_event(event_url_key, ttl)
+            timing.record_cache("event_cache", info is not None)
+            if info is not None:
+                return info
+            info = fetch()
+            # event_id が特定できなかった結果 (プローブ全滅など) はTTLの間残さない
+            if info and "error" not in info and info.get("event_id"):
+                self.set_event(info)
+            return info
+
+    def get_or_fetch_room_event(self, room_id, fetch, ttl=ROOM_EVENT_TTL):
+        key = self.get_room_event(room_id, ttl)
+        if key is not None:
+            timing.record_cache("event_cache", True)
+            return key
+        with self.key_lock(f"room:{room_id}"):
+            key = self.get_room_event(room_id, ttl)
+            timing.record_cache("event_cache", key is not None)
+            if key is not None:
+                return key
+            key = fetch()
+            if key:
+                self.set_room_event(room_id, key)
+            return key
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = EventCache()
+        return _cache
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Shared event metadata cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("invalidate-event").add_argument("event_url_key")
+    sub.add_parser("invalidate-room").add_argument("room_id")
+    sub.add_parser("show-event").add_argument("event_url_key")
+    sub.add_parser("show-room").add_argument("room_id")
+    sub.add_parser("clear")
+    args = parser.parse_args(argv)
+
+    cache = get_cache()
+    if args.command == "invalidate-event":
+        cache.invalidate_event(args.event_url_key)
+    elif args.command == "invalidate-room":
+        cache.invalidate_room(args.room_id)
+    elif args.command == "show-event":
+        print(json.dumps(cache.get_event(args.event_url_key), ensure_ascii=False))
+    elif args.command == "show-room":
+        print(json.dumps({"event_url_key": cache.get_room_event(args.room_id)}))
+    else:
+        cache.clear()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,36 +1,145 @@
-import urllib.request
-import urllib.error
+import os
+import hashlib
 import sys
 import json
 import io
 
-# Force stdout to use utf-8 encoding
-sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+import http_client
+import timing
+from result_cache import cached_main
+from timing import timed_main
+
+BASE_URL = os.environ.get("SHOWROOM_BASE_URL", "https://www.showroom-live.com").rstrip("/")
+
+# User-Agent などの共通ヘッダは http_client が付ける
+HEADERS = {
+    "Referer": "https://www.showroom-live.com/",
+    "Accept": "application/json, text/plain, */*"
+}
+
+# 差分モードで返すコメントの列 (index.html などが使う項目)
+DELTA_FIELDS = ["created_at", "user_id", "name", "comment", "avatar_id"]
+
+class FetchError(Exception):
+    pass
+
+def log_url(room_id):
+    return f"{BASE_URL}/api/live/comment_log?room_id={room_id}"
+
+def request_log(room_id):
+    """comment_log の生のレスポンス本文を返す。失敗時は FetchError。"""
+    with timing.stage("fetch"):
+        response = http_client.get(log_url(room_id), HEADERS)
+    if response.status_code >= 400:
+        raise FetchError(f"HTTP {response.status_code}")
+    if response.status_code != 200:
+        raise FetchError(f"Status {response.status_code}")
+    return response.text
 
 def fetch_log(room_id):
-    url = f"https://www.showroom-live.com/api/live/comment_log?room_id={room_id}"
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
-        "Referer": "https://www.showroom-live.com/",
-        "Accept": "application/json, text/plain, */*",
-        "Accept-Language": "ja,en-US;q=0.9,en;q=0.8"
-    }
-    
-    req = urllib.request.Request(url, headers=headers)
     try:
-        with urllib.request.urlopen(req) as response:
-            if response.getcode() == 200:
-                body = response.read().decode('utf-8')
-                print(body)
-            else:
-                print(json.dumps({"error": f"Status {response.getcode()}"}))
-    except urllib.error.HTTPError as e:
-        print(json.dumps({"error": f"HTTP {e.code}"}))
+        print(request_log(room_id))
+    except FetchError as e:
+        print(json.dumps({"error": str(e)}))
     except Exception as e:
         print(json.dumps({"error": str(e)}))
 
-if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        fetch_log(sys.argv[1])
+def comment_hash(c):
+    key = f"{c.get('user_id')}\x00{c.get('comment')}\x00{c.get('created_at')}"
+    return hashlib.blake2b(key.encode('utf-8'), digest_size=6).hexdigest()
+
+def parse_cursor(cursor):
+    # カーソル: "<created_at>.<hash>-<hash>..." (その時刻のコメントのハッシュ一覧)
+    if not cursor:
+        return None, set()
+    ts, _, hashes = cursor.partition(".")
+    try:
+        return int(ts), set(h for h in hashes.split("-") if h)
+    except ValueError:
+        return None, set()
+
+def make_cursor(ts, hashes):
+    return f"{ts}." + "-".join(sorted(hashes))
+
+def compute_delta(comments, cursor=None):
+    """
+    cursor より新しいコメントだけを古い順に返す。
+    戻り値: (新しいコメントのリスト, 新しいカーソル, カーソルが無効/未指定で全件返したか)
+    """
+    since_ts, since_hashes = parse_cursor(cursor)
+    reset = since_ts is None
+
+    seen = set()
+    fresh = []
+    for c in comments:
+        try:
+            ts = int(c.get("created_at") or 0)
+        except (TypeError, ValueError):
+            continue
+        h = comment_hash(c)
+        if h in seen:
+            continue
+        seen.add(h)
+        if not reset and (ts < since_ts or (ts == since_ts and h in since_hashes)):
+            continue
+        fresh.append((ts, h, c))
+
+    fresh.sort(key=lambda x: x[0])
+
+    # 最新時刻のハッシュを新しいカーソルにする (同時刻のコメントを取りこぼさないため)
+    if fresh:
+        top_ts = fresh[-1][0]
+        top_hashes = {h for ts, h, _ in fresh if ts == top_ts}
+        if not reset and top_ts == since_ts:
+            top_hashes |= since_hashes
+        new_cursor = make_cursor(top_ts, top_hashes)
     else:
+        new_cursor = cursor if not reset else make_cursor(0, set())
+
+    return [c for _, _, c in fresh], new_cursor, reset
+
+def fetch_delta(room_id, cursor=None):
+    try:
+        raw = request_log(room_id)
+        with timing.stage("parse_json"):
+            data = json.loads(raw)
+    except FetchError as e:
+        print(json.dumps({"error": str(e)}))
+        return
+    except Exception as e:
+        print(json.dumps({"error": str(e)}))
+        return
+
+    with timing.stage("delta"):
+        comments, new_cursor, reset = compute_delta(data.get("comment_log") or [], cursor)
+    print(json.dumps({
+        "room_id": str(room_id),
+        "cursor": new_cursor,
+        "reset": reset,
+        "fields": DELTA_FIELDS,
+        "rows": [[c.get(f) for f in DELTA_FIELDS] for c in comments]
+    }, ensure_ascii=False, separators=(",", ":")))
+
+# cursor 付きの差分は呼び出し毎に値が違うので共有しない
+@timed_main("fetch_comment_log.py")
+@cached_main("fetch_comment_log.py",
+             skip=lambda argv: any(a == "--cursor" or a.startswith("--cursor=") for a in argv))
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser()
+    parser.add_argument("room_id", nargs="?")
+    parser.add_argument("--delta", action="store_true", help="Return only comments newer than --cursor, in the compact delta format")
+    parser.add_argument("--cursor", default=None, help="Cursor returned by the previous delta call")
+    args = parser.parse_args(argv)
+
+    if not args.room_id:
         print(json.dumps({"error": "No room_id provided"}))
+    elif args.delta or args.cursor is not None:
+        fetch_delta(args.room_id, args.cursor)
+    else:
+        fetch_log(args.room_id)
+
+if __name__ == "__main__":
+    # Force stdout to use utf-8 encoding
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    main(sys.argv[1:])
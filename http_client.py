@@ -0,0 +1,319 @@
+import os
+import sys
+import json
+import time
+import sqlite3
+import threading
+import urllib.parse
+
+import requests
+import urllib3
+from requests.structures import CaseInsensitiveDict
+
+import timing
+
+# 全スクリプト共通の HTTP クライアント。
+# - keep-alive のセッションをプロセス内で1つ共有する (スレッドからも asyncio.to_thread からも使える)
+# - Accept-Encoding は urllib3 が展開できるもの (gzip/deflate、brotli/zstd が入っていればそれも)
+# - ホストごとの同時リクエスト数を HOST_CONCURRENCY に抑える
+# - タイムアウトとリトライ (接続エラー / 429 / 5xx を指数バックオフ) を揃える
+# - cache=True の取得はディスク上のキャッシュ (SQLite) に保存し、
+#   max_age 秒以内ならネットワークを使わず、それ以降は ETag / Last-Modified で再検証する (304 なら保存済みの本文)
+#   キャッシュの合計サイズが CACHE_MAX_BYTES を超えたら古く使われていないものから消す
+#
+#   from http_client import get
+#   res = get(url, headers={"Referer": ...}, cache=True, max_age=300)
+#   res.status_code, res.text, res.json(), res.from_cache  # None / "hit" / "revalidated"
+#
+# 環境変数: HTTP_TIMEOUT, HTTP_RETRIES, HTTP_HOST_CONCURRENCY, HTTP_CACHE=0, HTTP_CACHE_PATH, HTTP_CACHE_MAX_MB
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+CACHE_PATH = os.environ.get("HTTP_CACHE_PATH", os.path.join(CACHE_DIR, "http_cache.sqlite"))
+CACHE_ENABLED = os.environ.get("HTTP_CACHE", "1") not in ("0", "off", "false")
+CACHE_MAX_BYTES = int(float(os.environ.get("HTTP_CACHE_MAX_MB", "64")) * 1024 * 1024)
+
+TIMEOUT = float(os.environ.get("HTTP_TIMEOUT", "15"))
+CONNECT_TIMEOUT = 5.0
+RETRIES = int(os.environ.get("HTTP_RETRIES", "2"))
+BACKOFF = 0.5
+RETRY_STATUS = (429, 500, 502, 503, 504)
+HOST_CONCURRENCY = int(os.environ.get("HTTP_HOST_CONCURRENCY", "8"))
+
+DEFAULT_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "Accept-Language": "ja,en-US;q=0.9,en;q=0.8",
+    "Accept-Encoding": urllib3.util.make_headers(accept_encoding=True)["accept-encoding"],
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS responses (
+    url TEXT PRIMARY KEY,
+    etag TEXT,
+    last_modified TEXT,
+    content_type TEXT,
+    encoding TEXT,
+    body BLOB NOT NULL,
+    size INTEGER NOT NULL,
+    fetched_at REAL NOT NULL,
+    used_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_responses_used ON responses(used_at);
+"""
+
+class HttpError(Exception):
+    def __init__(self, status_code, url):
+        super().__init__(f"HTTP {status_code}")
+        self.status_code = status_code
+        self.url = url
+
+class HttpResponse:
+    """本文を読み終えたレスポンス。キャッシュから返した場合も同じ形。"""
+
+    def __init__(self, status_code, content, headers=None, url="", encoding=None, from_cache=None):
+        self.status_code = status_code
+        self.content = content
+        self.headers = CaseInsensitiveDict(headers or {})
+        self.url = url
+        self.encoding = encoding
+        self.from_cache = from_cache
+
+    @property
+    def ok(self):
+        return 200 <= self.status_code < 400
+
+    @property
+    def text(self):
+        return self.content.decode(self.encoding or "utf-8", errors="replace")
+
+    def json(self):
+        return json.loads(self.content)
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise HttpError(self.status_code, self.url)
+        return self
+
+class HttpCache:
+    def __init__(self, path=CACHE_PATH, max_bytes=CACHE_MAX_BYTES):
+        self.path = path
+        self.max_bytes = max_bytes
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def get(self, url):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT etag, last_modified, content_type, encoding, body, fetched_at FROM responses WHERE url = ?",
+                (url,)
+            ).fetchone()
+        if not row:
+            return None
+        return {"etag": row[0], "last_modified": row[1], "content_type": row[2],
+                "encoding": row[3], "body": row[4], "fetched_at": row[5]}
+
+    def touch(self, url, revalidated=False):
+        now = time.time()
+        with self._lock, self._conn:
+            if revalidated:
+                self._conn.execute("UPDATE responses SET fetched_at = ?, used_at = ? WHERE url = ?", (now, now, url))
+            else:
+                self._conn.execute("UPDATE responses SET used_at = ? WHERE url = ?", (now, url))
+
+    def set(self, url, etag, last_modified, content_type, encoding, body):
+        now = time.time()
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses "
+                "(url, etag, last_modified, content_type, encoding, body, size, fetched_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (url, etag, last_modified, content_type, encoding, body, len(body), now, now)
+            )
+            self._evict()
+
+    def _evict(self):
+        # 新しく使われた順にサイズを足していき、上限を超えた分を消す
+        self._conn.execute(
+            "DELETE FROM responses WHERE url IN ("
+            " SELECT url FROM (SELECT url, SUM(size) OVER (ORDER BY used_at DESC, url) AS total FROM responses)"
+            " WHERE total > ?)",
+            (self.max_bytes,)
+        )
+
+    def clear(self):
+        with self._lock, self._conn:
+            self._conn.execute("DELETE FROM responses")
+
+    def stats(self):
+        with self._lock:
+            count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"entries": count, "bytes": size, "max_bytes": self.max_bytes}
+
+_session = None
+_cache = None
+_cache_failed = False
+_host_limits = {}
+_lock = threading.Lock()
+
+def get_session():
+    global _session
+    with _lock:
+        if _session is None:
+            session = requests.Session()
+            session.headers.update(DEFAULT_HEADERS)
+            adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=HOST_CONCURRENCY)
+            session.mount("https://", adapter)
+            session.mount("http://", adapter)
+            _session = session
+        return _session
+
+def get_cache():
+    """ディスクキャッシュ。開けなければ None (キャッシュ無しで続ける)。"""
+    global _cache, _cache_failed
+    if not CACHE_ENABLED:
+        return None
+    with _lock:
+        if _cache is None and not _cache_failed:
+            try:
+                _cache = HttpCache()
+            except Exception as e:
+                _cache_failed = True
+                print(f"[http_client] cache disabled: {e}", file=sys.stderr)
+        return _cache
+
+def host_limit(url):
+    host = urllib.parse.urlsplit(url).netloc
+    with _lock:
+        if host not in _host_limits:
+            _host_limits[host] = threading.BoundedSemaphore(HOST_CONCURRENCY)
+        return _host_limits[host]
+
+def retry_delay(response, attempt):
+    delay = BACKOFF * (2 ** attempt)
+    retry_after = response.headers.get("Retry-After") if response is not None else None
+    if retry_after and retry_after.isdigit():
+        delay = max(delay, min(float(retry_after), 10.0))
+    return delay
+
+def send(url, headers=None, timeout=None, retries=None):
+    """リトライ付きの GET。最後の応答 (requests.Response) を返す。接続エラーが続けば例外。"""
+    session = get_session()
+    retries = RETRIES if retries is None else retries
+    timeout = (CONNECT_TIMEOUT, timeout or TIMEOUT)
+    limit = host_limit(url)
+    for attempt in range(retries + 1):
+        try:
+            with limit:
+                response = session.get(url, headers=headers, timeout=timeout)
+                # 本文の読み込みまで同時数に含める
+                response.content
+        except (requests.ConnectionError, requests.Timeout):
+            if attempt == retries:
+                raise
+            time.sleep(retry_delay(None, attempt))
+            continue
+        if response.status_code in RETRY_STATUS and attempt < retries:
+            time.sleep(retry_delay(response, attempt))
+            continue
+        return response
+
+def wire_bytes(response):
+    # 圧縮されていれば展開前のサイズ (urllib3 が読んだバイト数)
+    try:
+        return response.raw.tell() or len(response.content)
+    except Exception:
+        return len(response.content)
+
+def response_encoding(response, detect_encoding):
+    content_type = response.headers.get("Content-Type", "")
+    if "charset=" in content_type.lower():
+        return response.encoding
+    return response.apparent_encoding if detect_encoding else "utf-8"
+
+def get(url, headers=None, timeout=None, retries=None, cache=False, max_age=0, detect_encoding=False):
+    """
+    GET して HttpResponse を返す。
+    cache=True: 200 の応答をディスクに保存し、max_age 秒以内はそのまま返す / それ以降は条件付きで再検証する。
+    detect_encoding=True: charset の無い応答の文字コードを推定する (結果はキャッシュにも保存する)。
+    """
+    store = get_cache() if cache else None
+    cached = None
+    if store is not None:
+        try:
+            cached = store.get(url)
+        except sqlite3.Error:
+            store = None
+    if cached is not None and max_age and time.time() - cached["fetched_at"] <= max_age:
+        store.touch(url)
+        timing.record_cache("http", "hit")
+        return HttpResponse(200, cached["body"], {"Content-Type": cached["content_type"] or ""},
+                            url, cached["encoding"], from_cache="hit")
+
+    request_headers = dict(headers or {})
+    if cached is not None:
+        if cached["etag"]:
+            request_headers["If-None-Match"] = cached["etag"]
+        if cached["last_modified"]:
+            request_headers["If-Modified-Since"] = cached["last_modified"]
+
+    response = send(url, request_headers, timeout, retries)
+    timing.record_download(wire_bytes(response))
+
+    if cached is not None and response.status_code == 304:
+        store.touch(url, revalidated=True)
+        timing.record_cache("http", "revalidated")
+        return HttpResponse(200, cached["body"], {"Content-Type": cached["content_type"] or ""},
+                            url, cached["encoding"], from_cache="revalidated")
+
+    if store is not None:
+        timing.record_cache("http", "miss")
+    encoding = response_encoding(response, detect_encoding)
+    if store is not None and response.status_code == 200:
+        etag = response.headers.get("ETag")
+        last_modified = response.headers.get("Last-Modified")
+        # 再検証できない応答は max_age 付きのときだけ保存する
+        if etag or last_modified or max_age:
+            try:
+                store.set(url, etag, last_modified, response.headers.get("Content-Type"), encoding, response.content)
+            except sqlite3.Error as e:
+                print(f"[http_client] cache write failed: {e}", file=sys.stderr)
+    return HttpResponse(response.status_code, response.content, response.headers, response.url, encoding)
+
+def get_json(url, headers=None, timeout=None, retries=None):
+    """200 以外は HttpError。"""
+    return get(url, headers, timeout, retries).raise_for_status().json()
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Shared HTTP client and its on-disk cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_get = sub.add_parser("get", help="Fetch a URL through the client")
+    p_get.add_argument("url")
+    p_get.add_argument("--cache", action="store_true")
+    p_get.add_argument("--max-age", type=float, default=0)
+    sub.add_parser("stats")
+    sub.add_parser("clear")
+    args = parser.parse_args(argv)
+
+    if args.command == "get":
+        started = time.perf_counter()
+        res = get(args.url, cache=args.cache, max_age=args.max_age)
+        print(json.dumps({
+            "status": res.status_code, "bytes": len(res.content), "from_cache": res.from_cache,
+            "content_encoding": res.headers.get("Content-Encoding"),
+            "elapsed": round(time.perf_counter() - started, 3)
+        }))
+        return
+    cache = get_cache()
+    if cache is None:
+        print(json.dumps({"error": "cache disabled"}))
+    elif args.command == "stats":
+        print(json.dumps(cache.stats()))
+    else:
+        cache.clear()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
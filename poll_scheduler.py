@@ -0,0 +1,357 @@
+import abc
+import sys
+import json
+import time
+import heapq
+import asyncio
+import argparse
+
+import http_client
+
+from comment_poller import RateLimiter, StdoutSink
+from fetch_comment_log import HEADERS, DELTA_FIELDS, log_url, compute_delta
+
+# ルームのコメントとイベントランキングを、変化の多い対象ほど頻繁に取りに行くスケジューラ。
+#
+#   python poll_scheduler.py --room 123 --room 456 --ranking 41234 --ranking 41234:412340 \
+#       --budget 2 --metrics-port 9020
+#   python poll_scheduler.py --targets targets.ndjson
+#       {"type": "room", "room_id": 123, "ends_at": 1767193200}
+#       {"type": "ranking", "event_id": 41234, "block_id": 412340, "ends_at": 1767193200}
+#
+# 次回までの間隔は対象ごとに
+#   activity : 1分あたりの変化量の指数移動平均
+#              (ルームは新着コメント数、ランキングはポイントが動いたルーム数 + 順位の移動量)
+#   interval = max_interval / (1 + activity / activity_ref)
+# とし、イベント終了が近ければ短く (30分前から 1/2、5分前から 1/4)、終了後は max_interval にする。
+# 全対象の 1/interval の合計が --budget (req/s) を超える場合は全体を同じ比率で延ばし、
+# 実際の送信もトークンバケットで --budget に抑える。
+# 取得結果は comment_poller と同じ NDJSON で標準出力に流し、選んだ間隔などは /metrics で見られる。
+
+EWMA_ALPHA = 0.3
+
+class Target(abc.ABC):
+    kind = None
+
+    def __init__(self, ends_at=None):
+        self.ends_at = ends_at
+        self.activity = None
+        self.last_poll = None
+        self.interval = None
+        self.polls = 0
+        self.errors = 0
+        self.consecutive_errors = 0
+
+    @property
+    @abc.abstractmethod
+    def name(self):
+        """スケジューラ内で対象を区別するキー ("room:123" など)。"""
+
+    def observe(self, changes, now):
+        """前回からの変化量を記録して activity (変化/分) を更新する。"""
+        if self.last_poll is not None:
+            minutes = max(now - self.last_poll, 1.0) / 60
+            rate = changes / minutes
+            self.activity = rate if self.activity is None else EWMA_ALPHA * rate + (1 - EWMA_ALPHA) * self.activity
+        self.last_poll = now
+
+class RoomTarget(Target):
+    kind = "room"
+
+    def __init__(self, room_id, ends_at=None):
+        super().__init__(ends_at)
+        self.room_id = str(room_id)
+        self.cursor = None
+
+    @property
+    def name(self):
+        return f"room:{self.room_id}"
+
+class RankingTarget(Target):
+    kind = "ranking"
+
+    def __init__(self, event_id, block_id=None, ends_at=None):
+        super().__init__(ends_at)
+        self.event_id = str(event_id)
+        self.block_id = str(block_id) if block_id else None
+        self.previous = None
+
+    @property
+    def name(self):
+        return f"ranking:{self.event_id}" + (f":{self.block_id}" if self.block_id else "")
+
+def desired_interval(target, now, min_interval, max_interval, activity_ref):
+    if target.ends_at is not None and now > target.ends_at:
+        return max_interval
+    if target.activity is None:
+        # まだ変化量が分からないうちは短めに取って様子を見る
+        interval = min(max_interval, min_interval * 2)
+    else:
+        interval = max_interval / (1 + target.activity / activity_ref)
+    if target.ends_at is not None:
+        left = target.ends_at - now
+        if left < 300:
+            interval *= 0.25
+        elif left < 1800:
+            interval *= 0.5
+    interval = min(max(interval, min_interval), max_interval)
+    if target.consecutive_errors:
+        # 失敗が続く対象は倍々に延ばす (max_interval の4倍まで)
+        interval = min(interval * 2 ** target.consecutive_errors, max_interval * 4)
+    return interval
+
+class PollScheduler:
+    def __init__(self, targets, sink, budget=2.0, min_interval=5.0, max_interval=120.0,
+                 activity_ref=6.0, concurrency=8, timeout=10, record_snapshots=False):
+        self.targets = {t.name: t for t in targets}
+        self.sink = sink
+        self.budget = budget
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.activity_ref = activity_ref
+        self.limiter = RateLimiter(budget)
+        self.concurrency = concurrency
+        self.timeout = timeout
+        self.record_snapshots = record_snapshots
+        self.budget_scale = 1.0
+        self.started = time.time()
+
+    # --- 取得 ---
+
+    def _get_log(self, room_id):
+        res = http_client.get(log_url(room_id), HEADERS, self.timeout, retries=0)
+        if res.status_code != 200:
+            raise RuntimeError(f"HTTP {res.status_code}")
+        return res.json()
+
+    def _get_ranking(self, event_id, block_id):
+        # fetch_api_ranking は失敗を [] にしてしまうので、例外のまま上げる方を使って
+        # エラー数とバックオフに反映させる (前回のランキングも消さない)
+        from scrape_ranking import fetch_ranking_or_raise
+        return fetch_ranking_or_raise(event_id, block_id, self.timeout, retries=0)
+
+    async def poll_room(self, target, now):
+        data = await asyncio.to_thread(self._get_log, target.room_id)
+        comments, target.cursor, reset = compute_delta(data.get("comment_log") or [], target.cursor)
+        # 初回は全件返るので変化量には数えない
+        target.observe(0 if reset else len(comments), now)
+        if comments or reset:
+            self.sink.emit({
+                "room_id": target.room_id,
+                "cursor": target.cursor,
+                "reset": reset,
+                "fields": DELTA_FIELDS,
+                "rows": [[c.get(f) for f in DELTA_FIELDS] for c in comments]
+            })
+
+    async def poll_ranking(self, target, now):
+        ranking = await asyncio.to_thread(self._get_ranking, target.event_id, target.block_id)
+        current = {}
+        for entry in ranking:
+            room = entry.get("room") or {}
+            if room.get("room_id") is not None:
+                current[room["room_id"]] = (entry.get("point") or 0, entry.get("rank") or 0)
+
+        changed = 0
+        if target.previous is not None:
+            for room_id, (point, rank) in current.items():
+                prev = target.previous.get(room_id)
+                if prev is None:
+                    changed += 1
+                    continue
+                if prev[0] != point:
+                    changed += 1
+                # 順位の動きはボラティリティとして加算する
+                changed += abs(prev[1] - rank)
+            target.observe(changed, now)
+        else:
+            target.observe(0, now)
+
+        if target.previous is None or changed:
+            self.sink.emit({"event_id": target.event_id, "block_id": target.block_id, "ts": int(now), "ranking": ranking})
+            if self.record_snapshots and ranking:
+                from ranking_snapshots import get_store
+                store = get_store(target.event_id, target.block_id)
+                with store.lock():
+                    store.append(ranking, now)
+        target.previous = current
+
+    async def poll(self, target):
+        await self.limiter.acquire()
+        now = time.time()
+        try:
+            async with self.semaphore:
+                if target.kind == "room":
+                    await self.poll_room(target, now)
+                else:
+                    await self.poll_ranking(target, now)
+            target.consecutive_errors = 0
+        except Exception as e:
+            target.errors += 1
+            target.consecutive_errors += 1
+            self.sink.emit({"target": target.name, "error": str(e)})
+        target.polls += 1
+
+    # --- スケジューリング ---
+
+    def reschedule(self, now):
+        """全対象の間隔を計算し直し、予算を超えるなら同じ比率で延ばす。"""
+        intervals = {
+            name: desired_interval(t, now, self.min_interval, self.max_interval, self.activity_ref)
+            for name, t in self.targets.items()
+        }
+        demand = sum(1 / i for i in intervals.values())
+        self.budget_scale = max(1.0, demand / self.budget) if self.budget > 0 else 1.0
+        for name, interval in intervals.items():
+            self.targets[name].interval = interval * self.budget_scale
+
+    async def run(self):
+        await self.sink.start()
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        now = time.time()
+        self.reschedule(now)
+        # (次回時刻, 名前) のヒープ。最初は予算内に収まるように少しずつずらして始める
+        spacing = 1 / self.budget if self.budget > 0 else 0
+        queue = [(now + i * spacing, name) for i, name in enumerate(self.targets)]
+        heapq.heapify(queue)
+        running = set()
+
+        async def run_one(name):
+            target = self.targets[name]
+            await self.poll(target)
+            done = time.time()
+            self.reschedule(done)
+            heapq.heappush(queue, (done + target.interval, name))
+
+        while queue or running:
+            if not queue:
+                await asyncio.sleep(0.1)
+                continue
+            due, name = queue[0]
+            wait = due - time.time()
+            if wait > 0:
+                await asyncio.sleep(min(wait, 1.0))
+                continue
+            heapq.heappop(queue)
+            task = asyncio.create_task(run_one(name))
+            running.add(task)
+            task.add_done_callback(running.discard)
+
+    # --- メトリクス ---
+
+    def metrics(self):
+        lines = [
+            "# HELP poll_interval_seconds Interval chosen for the next poll of the target",
+            "# TYPE poll_interval_seconds gauge",
+        ]
+        for t in self.targets.values():
+            lines.append(f'poll_interval_seconds{{target="{t.name}",kind="{t.kind}"}} {t.interval or 0:.3f}')
+        lines += ["# HELP poll_activity_per_minute Smoothed changes per minute observed on the target",
+                  "# TYPE poll_activity_per_minute gauge"]
+        for t in self.targets.values():
+            lines.append(f'poll_activity_per_minute{{target="{t.name}",kind="{t.kind}"}} {t.activity or 0:.3f}')
+        lines += ["# HELP poll_requests_total Polls sent to the upstream", "# TYPE poll_requests_total counter"]
+        for t in self.targets.values():
+            lines.append(f'poll_requests_total{{target="{t.name}",kind="{t.kind}"}} {t.polls}')
+        lines += ["# HELP poll_errors_total Polls that failed", "# TYPE poll_errors_total counter"]
+        for t in self.targets.values():
+            lines.append(f'poll_errors_total{{target="{t.name}",kind="{t.kind}"}} {t.errors}')
+        lines += [
+            "# HELP poll_budget_requests_per_second Global request budget",
+            "# TYPE poll_budget_requests_per_second gauge",
+            f"poll_budget_requests_per_second {self.budget}",
+            "# HELP poll_budget_scale Factor applied to all intervals to stay within the budget",
+            "# TYPE poll_budget_scale gauge",
+            f"poll_budget_scale {self.budget_scale:.3f}",
+        ]
+        return "\n".join(lines) + "\n"
+
+    async def serve_metrics(self, host, port):
+        async def handle(reader, writer):
+            try:
+                request = await reader.readline()
+                # ヘッダは読み捨てる
+                while (await reader.readline()).strip():
+                    pass
+                path = request.split()[1].decode() if len(request.split()) > 1 else "/"
+                if path.startswith("/metrics.json"):
+                    body = json.dumps({
+                        t.name: {"interval": t.interval, "activity": t.activity, "polls": t.polls,
+                                 "errors": t.errors, "ends_at": t.ends_at}
+                        for t in self.targets.values()
+                    }).encode()
+                    content_type = "application/json"
+                else:
+                    body = self.metrics().encode()
+                    content_type = "text/plain; version=0.0.4"
+                writer.write(
+                    f"HTTP/1.1 200 OK\r\nContent-Type: {content_type}\r\nContent-Length: {len(body)}\r\n"
+                    "Connection: close\r\n\r\n".encode() + body
+                )
+                await writer.drain()
+            finally:
+                writer.close()
+
+        await asyncio.start_server(handle, host, port)
+        print(f"[poll_scheduler] metrics on http://{host}:{port}/metrics", file=sys.stderr)
+
+def parse_targets(args):
+    targets = [RoomTarget(r, args.ends_at) for r in args.room or []]
+    for spec in args.ranking or []:
+        event_id, _, block_id = spec.partition(":")
+        targets.append(RankingTarget(event_id, block_id or None, args.ends_at))
+    if args.targets:
+        f = sys.stdin if args.targets == "-" else open(args.targets, encoding='utf-8')
+        with f:
+            for line in f:
+                line = line.strip()
+                if not line:
+                    continue
+                spec = json.loads(line)
+                ends_at = spec.get("ends_at", args.ends_at)
+                if spec.get("type") == "ranking":
+                    targets.append(RankingTarget(spec["event_id"], spec.get("block_id"), ends_at))
+                else:
+                    targets.append(RoomTarget(spec["room_id"], ends_at))
+    return targets
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Adaptive polling of comment logs and event rankings")
+    parser.add_argument("--room", action="append", help="room_id to poll (repeatable)")
+    parser.add_argument("--ranking", action="append", help="event_id[:block_id] to poll (repeatable)")
+    parser.add_argument("--targets", help="NDJSON file of targets ('-' for stdin)")
+    parser.add_argument("--ends-at", type=int, help="Default event end (unix time) for targets")
+    parser.add_argument("--budget", type=float, default=2.0, help="Global upstream requests per second")
+    parser.add_argument("--min-interval", type=float, default=5.0)
+    parser.add_argument("--max-interval", type=float, default=120.0)
+    parser.add_argument("--activity-ref", type=float, default=6.0,
+                        help="Changes per minute at which the interval is half of --max-interval")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--record-snapshots", action="store_true", help="Append ranking polls to ranking_snapshots")
+    parser.add_argument("--metrics-port", type=int, help="Serve /metrics (Prometheus text) and /metrics.json")
+    parser.add_argument("--metrics-host", default="127.0.0.1")
+    args = parser.parse_args(argv)
+
+    targets = parse_targets(args)
+    if not targets:
+        print(json.dumps({"error": "No targets provided"}))
+        return
+
+    scheduler = PollScheduler(
+        targets, StdoutSink(), budget=args.budget, min_interval=args.min_interval,
+        max_interval=args.max_interval, activity_ref=args.activity_ref,
+        concurrency=args.concurrency, record_snapshots=args.record_snapshots
+    )
+
+    async def run():
+        if args.metrics_port:
+            await scheduler.serve_metrics(args.metrics_host, args.metrics_port)
+        await scheduler.run()
+
+    try:
+        asyncio.run(run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,156 @@
+import sys
+import io
+import json
+import time
+import asyncio
+import argparse
+
+import http_client
+
+from comment_poller import RateLimiter
+from scrape_ranking import BASE_URL, HEADERS, normalize_block_entry
+
+# イベントの全ブロック・全ページのランキングを取得して NDJSON で流すクローラ。
+#
+#   python ranking_crawler.py <event_url_key>          # find_block_info でブロックを調べて全部
+#   python ranking_crawler.py 41234 --block-id 412340  # event_id 指定 (ブロックは --block-id で)
+#
+# 出力は1行1レコードで、取れたページから順に書き出す (全体を溜めてから dumps しない):
+#   {"block_id": "412340", "page": 1, "rank": 1, "point": 123, "room": {...}}
+#   {"block_id": "412340", "page": 7, "error": "HTTP 503"}          (リトライしても失敗したページ)
+#   {"done": true, "event_id": 41234, "blocks": 2, "pages": 14, "rows": 650, "errors": 0, "elapsed": 1.2}
+#
+# 各ブロックの1ページ目で last_page が分かれば残りのページを一度に投げ、
+# 分からなければ next_page を辿る。上流へのリクエストは --rate (req/s) と --concurrency で抑える。
+
+class RankingCrawler:
+    def __init__(self, event_id, blocks, emit, rate=5.0, concurrency=4, max_pages=200, retries=2, timeout=10):
+        self.event_id = event_id
+        # None はブロック無しのイベント (/api/event/ranking を使う)
+        self.blocks = list(blocks) or [None]
+        self.emit = emit
+        self.limiter = RateLimiter(rate)
+        self.semaphore = None
+        self.concurrency = concurrency
+        self.max_pages = max_pages
+        self.retries = retries
+        self.timeout = timeout
+        self.stats = {"pages": 0, "rows": 0, "errors": 0}
+
+    def page_url(self, block_id, page):
+        if block_id is None:
+            return f"{BASE_URL}/api/event/ranking?event_id={self.event_id}&page={page}"
+        return f"{BASE_URL}/api/event/block_ranking?event_id={self.event_id}&block_id={block_id}&page={page}"
+
+    def _get(self, url):
+        # リトライは fetch_page 側で (待ち時間にスレッドを塞がないように) 行う
+        res = http_client.get(url, HEADERS, self.timeout, retries=0)
+        if res.status_code != 200:
+            raise RuntimeError(f"HTTP {res.status_code}")
+        return res.json()
+
+    async def fetch_page(self, block_id, page):
+        """ページを取得して行を書き出す。戻り値はそのページの応答 (失敗時は None)。"""
+        url = self.page_url(block_id, page)
+        delay = 1.0
+        for attempt in range(self.retries + 1):
+            await self.limiter.acquire()
+            try:
+                async with self.semaphore:
+                    data = await asyncio.to_thread(self._get, url)
+                break
+            except Exception as e:
+                if attempt == self.retries:
+                    self.stats["errors"] += 1
+                    self.emit({"block_id": block_id, "page": page, "error": str(e)})
+                    return None
+                await asyncio.sleep(delay)
+                delay *= 2
+
+        entries = data.get("ranking") if block_id is None else data.get("block_ranking_list")
+        self.stats["pages"] += 1
+        for entry in entries or []:
+            record = normalize_block_entry(entry)
+            self.emit(dict(record, block_id=block_id, page=page))
+            self.stats["rows"] += 1
+        data["_rows"] = len(entries or [])
+        return data
+
+    async def crawl_block(self, block_id):
+        first = await self.fetch_page(block_id, 1)
+        if not first or not first["_rows"]:
+            return
+
+        last_page = first.get("last_page")
+        if isinstance(last_page, int):
+            # 総ページ数が分かっていれば残りを並列に取る
+            pages = range(2, min(last_page, self.max_pages) + 1)
+            await asyncio.gather(*(self.fetch_page(block_id, p) for p in pages))
+            return
+
+        # 分からない場合は next_page (無ければ空ページまで) を順に辿る
+        page, data = 1, first
+        while page < self.max_pages:
+            next_page = data.get("next_page")
+            if next_page is None and "next_page" in data:
+                return
+            page = next_page if isinstance(next_page, int) else page + 1
+            data = await self.fetch_page(block_id, page)
+            if not data or not data["_rows"]:
+                return
+
+    async def run(self):
+        self.semaphore = asyncio.Semaphore(self.concurrency)
+        started = time.monotonic()
+        await asyncio.gather(*(self.crawl_block(b) for b in self.blocks))
+        summary = dict(self.stats, done=True, event_id=self.event_id,
+                       blocks=len(self.blocks), elapsed=round(time.monotonic() - started, 3))
+        self.emit(summary)
+        return summary
+
+def resolve_event(target, block_ids=None):
+    """event_url_key または event_id から (event_id, [block_id, ...]) を求める。"""
+    if target.isdigit():
+        return int(target), list(block_ids or [])
+
+    from scrape_event_info import find_block_info
+    info = find_block_info(target)
+    if info.get("error"):
+        raise RuntimeError(info["error"])
+    if not info.get("event_id"):
+        raise RuntimeError("event_id not found")
+    blocks = block_ids or [b["block_id"] for b in info.get("blocks") or []]
+    return info["event_id"], blocks
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Crawl every page of every block of an event ranking as NDJSON")
+    parser.add_argument("target", help="event_url_key or event_id")
+    parser.add_argument("--block-id", action="append", help="Only these blocks (repeatable)")
+    parser.add_argument("--rate", type=float, default=5.0, help="Max upstream requests per second")
+    parser.add_argument("--concurrency", type=int, default=4, help="Max requests in flight")
+    parser.add_argument("--max-pages", type=int, default=200, help="Upper bound of pages per block")
+    args = parser.parse_args(argv)
+
+    out = sys.stdout
+
+    def emit(record):
+        out.write(json.dumps(record, ensure_ascii=False, separators=(",", ":")) + "\n")
+        out.flush()
+
+    target = args.target.split('?')[0]
+    try:
+        event_id, blocks = resolve_event(target, args.block_id)
+    except Exception as e:
+        emit({"error": str(e)})
+        return
+
+    crawler = RankingCrawler(event_id, blocks, emit, rate=args.rate,
+                             concurrency=args.concurrency, max_pages=args.max_pages)
+    try:
+        asyncio.run(crawler.run())
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    main(sys.argv[1:])
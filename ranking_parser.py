@@ -0,0 +1,84 @@
+import re
+
+# contentlist-row 形式のランキングHTMLを先頭から1回なめて行ごとのレコードを返すパーサ。
+# 旧ループ (scrape_ranking) は html.split() で行ごとの部分文字列を全部作ってから
+# 毎回 re.search (パターンキャッシュ引き) していたが、ここでは
+#   - 行の境界は str.find で順に探すだけ (コピーを作らない)
+#   - 各項目はコンパイル済みパターンを元の文字列に pos/endpos 付きで当てる
+# ので、ページ全体の行リストを持たずにジェネレータで流せる。
+#
+#   for row in iter_ranking_rows(html):
+#       row -> {"rank", "room_id", "name", "url_key", "point"}
+#
+# 全項目を1本の選択パターンで finditer する形も試したが、候補の先頭文字ごとに止まるぶん
+# CPython では旧ループより遅かった (bench/bench_ranking_parser.py)。
+
+ROW_MARKER = 'class="contentlist-row"'
+
+# 旧ループと同じく、これらの alt はルーム名として扱わない
+IGNORED_ALTS = {"Official", "Onlive", "Badge", "Profile", "Follow"}
+
+_RANK_RE = re.compile(r'is-rank-(\d+)')
+_ROOM_ID_RE = re.compile(r'data-room-id="(\d+)"')
+_H4_RE = re.compile(r'listcardinfo-main-text[^>]*>([\s\S]*?)</')
+_IMG_MAIN_ALT_RE = re.compile(r'class="[^"]*img-main[^"]*"[^>]*alt="([^"]+)"')
+_ALT_RE = re.compile(r'alt="([^"]+)"')
+_URL_KEY_RE = re.compile(r'href="/r/([^"]+)"')
+# テキストノード先頭の "1,234pt" / "1234 pt"
+_POINT_RE = re.compile(r'>\s*(\d[\d,]*)\s*pt\b')
+
+def _parse_row(html, start, end):
+    rank = _RANK_RE.search(html, start, end)
+    room_id = _ROOM_ID_RE.search(html, start, end)
+    if not rank or not room_id:
+        return None
+
+    name = ""
+    h4 = _H4_RE.search(html, start, end)
+    if h4:
+        name = h4.group(1).strip()
+    if not name:
+        alt = _IMG_MAIN_ALT_RE.search(html, start, end) or _ALT_RE.search(html, start, end)
+        if alt:
+            potential_name = alt.group(1).strip()
+            if potential_name not in IGNORED_ALTS:
+                name = potential_name
+    if not name:
+        return None
+
+    url_key = _URL_KEY_RE.search(html, start, end)
+    point = _POINT_RE.search(html, start, end)
+    return {
+        "rank": int(rank.group(1)),
+        "room_id": int(room_id.group(1)),
+        "name": name,
+        "url_key": url_key.group(1) if url_key else "",
+        "point": int(point.group(1).replace(",", "")) if point else 0
+    }
+
+def iter_ranking_rows(html):
+    """contentlist-row ごとのレコードを文書順に返すジェネレータ。"""
+    find = html.find
+    marker_len = len(ROW_MARKER)
+    pos = find(ROW_MARKER)
+    while pos >= 0:
+        start = pos + marker_len
+        pos = find(ROW_MARKER, start)
+        rec = _parse_row(html, start, pos if pos >= 0 else len(html))
+        if rec:
+            yield rec
+
+def parse_ranking(html):
+    """scrape_ranking の出力形式 ({"rank", "point", "room": {...}}) のリストを返す。"""
+    return [
+        {
+            "rank": rec["rank"],
+            "point": rec["point"],
+            "room": {
+                "room_id": rec["room_id"],
+                "room_name": rec["name"],
+                "url_key": rec["url_key"]
+            }
+        }
+        for rec in iter_ranking_rows(html)
+    ]
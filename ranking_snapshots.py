@@ -0,0 +1,255 @@
+import os
+import sys
+import json
+import time
+import struct
+import threading
+import contextlib
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+from result_cache import cached_main
+
+# イベントランキングのスナップショットを追記専用のバイナリファイルに貯め、
+# 任意の2時刻間のポイント増分 / 速度 / 順位変動を返す。
+# 1イベント(ブロック)につき1ファイル:
+#   .cache/snapshots/<event_id>_<block_id>.bin
+# レコード:
+#   スナップショットヘッダ  <II  (ts, 行数)
+#   行                      <IqI (room_id, point, rank)  x 行数
+# ルーム名などは <...>.rooms.json に room_id -> {room_name, url_key} で持つ。
+#
+# 問い合わせ時に最新スナップショットが古ければ1回だけ取り直すので、
+# 閲覧者が何人いても上流へのアクセスは間隔あたり1回になる。
+
+SNAPSHOT_DIR = os.environ.get(
+    "SNAPSHOT_DIR",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "snapshots")
+)
+SNAPSHOT_INTERVAL = int(os.environ.get("SNAPSHOT_INTERVAL", "60"))
+
+HEADER = struct.Struct("<II")
+ROW = struct.Struct("<IqI")
+
+class SnapshotStore:
+    def __init__(self, event_id, block_id=None, directory=SNAPSHOT_DIR):
+        self.event_id = str(event_id)
+        self.block_id = str(block_id) if block_id else "0"
+        # ファイル名に使うので数字以外は受け付けない
+        if not all(v.isascii() and v.isdigit() for v in (self.event_id, self.block_id)):
+            raise ValueError(f"invalid event_id/block_id: {self.event_id!r}, {self.block_id!r}")
+        os.makedirs(directory, exist_ok=True)
+        base = os.path.join(directory, f"{self.event_id}_{self.block_id}")
+        self.path = base + ".bin"
+        self.rooms_path = base + ".rooms.json"
+        self.lock_path = base + ".lock"
+        # (ts, offset, count) のリスト。ファイル末尾から読み足していく
+        self._index = []
+        self._indexed_size = 0
+        self._mutex = threading.Lock()
+
+    @contextlib.contextmanager
+    def lock(self):
+        with self._mutex:
+            if fcntl is None:
+                yield
+                return
+            with open(self.lock_path, "w") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def _refresh_index(self):
+        try:
+            size = os.path.getsize(self.path)
+        except OSError:
+            return
+        if size <= self._indexed_size:
+            return
+        with open(self.path, "rb") as f:
+            f.seek(self._indexed_size)
+            offset = self._indexed_size
+            while offset + HEADER.size <= size:
+                ts, count = HEADER.unpack(f.read(HEADER.size))
+                end = offset + HEADER.size + count * ROW.size
+                if end > size:
+                    # 書き込み途中のレコードは次回に回す
+                    break
+                self._index.append((ts, offset + HEADER.size, count))
+                f.seek(end)
+                offset = end
+        self._indexed_size = offset
+
+    def timestamps(self):
+        self._refresh_index()
+        return [ts for ts, _, _ in self._index]
+
+    def latest_ts(self):
+        self._refresh_index()
+        return self._index[-1][0] if self._index else None
+
+    def append(self, ranking, ts=None):
+        """ranking (scrape_ranking と同じ形) を1スナップショットとして追記する。"""
+        ts = int(ts if ts is not None else time.time())
+        rows = []
+        rooms = {}
+        for entry in ranking:
+            room = entry.get("room") or {}
+            room_id = room.get("room_id")
+            if room_id is None:
+                continue
+            rows.append(ROW.pack(int(room_id), int(entry.get("point") or 0), int(entry.get("rank") or 0)))
+            rooms[str(room_id)] = {
+                "room_name": room.get("room_name", ""),
+                "url_key": room.get("url_key") or room.get("room_url_key") or ""
+            }
+
+        with open(self.path, "ab") as f:
+            f.write(HEADER.pack(ts, len(rows)) + b"".join(rows))
+
+        known = self.rooms()
+        if any(known.get(k) != v for k, v in rooms.items()):
+            known.update(rooms)
+            tmp = self.rooms_path + ".tmp"
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(known, f, ensure_ascii=False)
+            os.replace(tmp, self.rooms_path)
+        return ts
+
+    def rooms(self):
+        try:
+            with open(self.rooms_path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def read(self, ts):
+        """指定時刻以前で最も新しいスナップショットを {room_id: (point, rank)} で返す。"""
+        self._refresh_index()
+        chosen = None
+        for entry in self._index:
+            if entry[0] > ts:
+                break
+            chosen = entry
+        if chosen is None:
+            if not self._index:
+                return None, {}
+            # 範囲より前を指定された場合は最初のスナップショット
+            chosen = self._index[0]
+
+        snap_ts, offset, count = chosen
+        with open(self.path, "rb") as f:
+            f.seek(offset)
+            data = f.read(count * ROW.size)
+        return snap_ts, {room_id: (point, rank) for room_id, point, rank in ROW.iter_unpack(data)}
+
+_stores = {}
+_stores_lock = threading.Lock()
+
+def get_store(event_id, block_id=None):
+    # 常駐ワーカーではインデックスを使い回す
+    key = (str(event_id), str(block_id) if block_id else "0")
+    with _stores_lock:
+        if key not in _stores:
+            _stores[key] = SnapshotStore(event_id, block_id)
+        return _stores[key]
+
+def fetch_ranking(event_id, block_id=None):
+    from scrape_ranking import fetch_api_ranking
+    return fetch_api_ranking(event_id, block_id)
+
+def ensure_fresh(store, max_age=SNAPSHOT_INTERVAL):
+    """最新スナップショットが max_age 秒より古ければ1回だけ取り直す。"""
+    latest = store.latest_ts()
+    if latest is not None and time.time() - latest < max_age:
+        return latest
+    with store.lock():
+        # 待っている間に他のプロセスが取得していればそれを使う
+        latest = store.latest_ts()
+        if latest is not None and time.time() - latest < max_age:
+            return latest
+        ranking = fetch_ranking(store.event_id, store.block_id if store.block_id != "0" else None)
+        if not ranking:
+            return latest
+        return store.append(ranking)
+
+def compare(store, since, until=None):
+    """since -> until 間のルームごとのポイント増分・速度(pt/分)・順位変動。"""
+    t1, after = store.read(until if until is not None else time.time())
+    t0, before = store.read(since)
+    if t1 is None:
+        return {"error": "No snapshots"}
+
+    rooms = store.rooms()
+    minutes = (t1 - t0) / 60 if t1 > t0 else 0
+    deltas = []
+    for room_id, (point, rank) in after.items():
+        info = rooms.get(str(room_id), {})
+        entry = {
+            "room_id": room_id,
+            "room_name": info.get("room_name", ""),
+            "url_key": info.get("url_key", ""),
+            "rank": rank,
+            "point": point,
+            # 途中からランキングに入ったルームは比較対象が無い
+            "point_delta": None,
+            "velocity": None,
+            "rank_change": None
+        }
+        if room_id in before:
+            prev_point, prev_rank = before[room_id]
+            gained = point - prev_point
+            entry["point_delta"] = gained
+            entry["velocity"] = round(gained / minutes, 2) if minutes else 0
+            entry["rank_change"] = prev_rank - rank
+        deltas.append(entry)
+    deltas.sort(key=lambda d: (d["rank"] or sys.maxsize))
+    return {"event_id": store.event_id, "block_id": store.block_id, "from": t0, "to": t1, "deltas": deltas}
+
+# record は常駐するので共有しない
+@cached_main("ranking_snapshots.py", skip=lambda argv: argv[:1] == ["record"])
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Ranking snapshot store")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_record = sub.add_parser("record", help="Take snapshots every --interval seconds")
+    p_record.add_argument("event_id")
+    p_record.add_argument("--block-id")
+    p_record.add_argument("--interval", type=int, default=SNAPSHOT_INTERVAL)
+    p_record.add_argument("--once", action="store_true")
+
+    p_query = sub.add_parser("query", help="Point deltas / velocity / rank changes between two times")
+    p_query.add_argument("event_id")
+    p_query.add_argument("--block-id")
+    p_query.add_argument("--since", type=int, help="Unix time (negative = seconds ago, default -300)", default=-300)
+    p_query.add_argument("--until", type=int, help="Unix time (default now)")
+    p_query.add_argument("--max-age", type=int, default=SNAPSHOT_INTERVAL,
+                         help="Take a new snapshot first if the latest is older than this (0 = never)")
+
+    args = parser.parse_args(argv)
+    store = get_store(args.event_id, args.block_id)
+
+    if args.command == "record":
+        while True:
+            ts = ensure_fresh(store, 0 if args.once else args.interval)
+            print(json.dumps({"event_id": store.event_id, "block_id": store.block_id, "ts": ts}), flush=True)
+            if args.once:
+                return
+            time.sleep(args.interval)
+    else:
+        if args.max_age > 0:
+            try:
+                ensure_fresh(store, args.max_age)
+            except Exception as e:
+                print(f"[ranking_snapshots] snapshot failed: {e}", file=sys.stderr)
+        since = args.since if args.since >= 0 else int(time.time()) + args.since
+        print(json.dumps(compare(store, since, args.until), ensure_ascii=False))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
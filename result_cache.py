@@ -0,0 +1,261 @@
+import io
+import os
+import sys
+import json
+import time
+import sqlite3
+import hashlib
+import threading
+import functools
+import contextlib
+
+import timing
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# スクリプトの出力を (script, args) ごとに共有するキャッシュ。
+# 同じイベントを大勢が開いていると server.js から同じ引数の呼び出しが同時に来るので、
+# 最初の1回だけ実際に取得し、同時に来た呼び出しはその完了を待って同じ出力を返す
+# (プロセス内はスレッドロック、プロセス間はロックファイル)。
+# 成功はスクリプトごとの TTL、エラー ({"error": ...}) は短い ERROR_TTL だけ使い回す。
+#
+#   @cached_main("scrape_ranking.py")
+#   def main(argv): ...
+#
+# RESULT_CACHE=0 で無効、RESULT_CACHE_TTL / RESULT_CACHE_ERROR_TTL で TTL を上書きできる。
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+DB_PATH = os.environ.get("RESULT_CACHE_PATH", os.path.join(CACHE_DIR, "result_cache.sqlite"))
+ENABLED = os.environ.get("RESULT_CACHE", "1") not in ("0", "off", "false")
+
+# 成功時の TTL (秒)。ランキングやコメントは変わるので短め、アバターの対応はほぼ変わらない
+TTLS = {
+    "scrape_ranking.py": 30,
+    "scrape_event_info.py": 300,
+    "scrape_room_event.py": 120,
+    "search_avatar.py": 600,
+    "fetch_comment_log.py": 2,
+    "ranking_snapshots.py": 5,
+}
+DEFAULT_TTL = 30
+ERROR_TTL = float(os.environ.get("RESULT_CACHE_ERROR_TTL", "5"))
+
+# これより古い行は書き込みのついでに消す
+KEEP_SECONDS = 24 * 3600
+# single-flight のロックはキーのハッシュで固定数に振り分ける (キー毎に作るとロックファイルが増え続ける)
+LOCK_STRIPES = 64
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    key TEXT PRIMARY KEY,
+    script TEXT NOT NULL,
+    args TEXT NOT NULL,
+    ok INTEGER NOT NULL,
+    output TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_results_created ON results(created_at);
+"""
+
+def ttl_for(script):
+    if "RESULT_CACHE_TTL" in os.environ:
+        return float(os.environ["RESULT_CACHE_TTL"])
+    return TTLS.get(script, DEFAULT_TTL)
+
+def make_key(script, args):
+    return hashlib.sha1(json.dumps([script, [str(a) for a in args]]).encode("utf-8")).hexdigest()
+
+_NOT_JSON = object()
+
+def parse_output(output):
+    # スクリプトは JSON を1つ出力する (複数行の場合は最後の行)。JSON でなければ _NOT_JSON
+    text = output.strip()
+    try:
+        return json.loads(text)
+    except ValueError:
+        try:
+            return json.loads(text.splitlines()[-1])
+        except (ValueError, IndexError):
+            return _NOT_JSON
+
+def is_json_output(output):
+    return parse_output(output) is not _NOT_JSON
+
+def is_error_output(output):
+    data = parse_output(output)
+    return isinstance(data, dict) and "error" in data
+
+def with_tier(output, tier):
+    # 保存済みの出力の "tier" は保存時に答えた段なので、返すときの段に書き換える
+    # (出力全体が1つの JSON オブジェクトで "tier" を持つ場合だけ)
+    try:
+        data = json.loads(output)
+    except ValueError:
+        return output
+    if not isinstance(data, dict) or "tier" not in data:
+        return output
+    data["tier"] = tier
+    return json.dumps(data, ensure_ascii=False) + "\n"
+
+class ResultCache:
+    def __init__(self, path=DB_PATH):
+        self.path = path
+        self.lock_dir = os.path.join(os.path.dirname(path), "locks")
+        os.makedirs(self.lock_dir, exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.executescript(SCHEMA)
+        self._db_lock = threading.Lock()
+        self._key_locks = [threading.Lock() for _ in range(LOCK_STRIPES)]
+
+    def get(self, script, args, ttl=None, error_ttl=ERROR_TTL):
+        """TTL 内の出力があれば返す。無ければ None。"""
+        with self._db_lock:
+            row = self._conn.execute(
+                "SELECT ok, output, created_at FROM results WHERE key = ?", (make_key(script, args),)
+            ).fetchone()
+        if not row:
+            return None
+        ok, output, created_at = row
+        limit = (ttl if ttl is not None else ttl_for(script)) if ok else error_ttl
+        if time.time() - created_at <= limit:
+            return output
+        return None
+
+    def set(self, script, args, output, ok=None):
+        if ok is None:
+            ok = not is_error_output(output)
+        now = time.time()
+        with self._db_lock, self._conn:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, script, args, ok, output, created_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (make_key(script, args), script, json.dumps([str(a) for a in args], ensure_ascii=False),
+                 1 if ok else 0, output, now)
+            )
+            self._conn.execute("DELETE FROM results WHERE created_at < ?", (now - KEEP_SECONDS,))
+
+    def invalidate(self, script, args):
+        with self._db_lock, self._conn:
+            self._conn.execute("DELETE FROM results WHERE key = ?", (make_key(script, args),))
+
+    def clear(self, script=None):
+        with self._db_lock, self._conn:
+            if script:
+                self._conn.execute("DELETE FROM results WHERE script = ?", (script,))
+            else:
+                self._conn.execute("DELETE FROM results")
+
+    def stats(self):
+        with self._db_lock:
+            rows = self._conn.execute(
+                "SELECT script, SUM(ok), COUNT(*) - SUM(ok) FROM results GROUP BY script ORDER BY script"
+            ).fetchall()
+        return {script: {"ok": ok, "error": err} for script, ok, err in rows}
+
+    @contextlib.contextmanager
+    def key_lock(self, key):
+        stripe = int(key[:8], 16) % LOCK_STRIPES
+        with self._key_locks[stripe]:
+            if fcntl is None:
+                yield
+                return
+            with open(os.path.join(self.lock_dir, f"result-{stripe:02d}.lock"), "w") as f:
+                fcntl.flock(f, fcntl.LOCK_EX)
+                try:
+                    yield
+                finally:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    def get_or_run(self, script, args, run, ttl=None, error_ttl=ERROR_TTL):
+        """
+        キャッシュに無ければ run() (出力文字列を返す) を1回だけ実行して保存する。
+        戻り値: (出力, キャッシュから返したか)
+        """
+        output = self.get(script, args, ttl, error_ttl)
+        if output is not None:
+            return output, True
+        with self.key_lock(make_key(script, args)):
+            # 待っている間に他の呼び出しが実行済みならそれを使う
+            output = self.get(script, args, ttl, error_ttl)
+            if output is not None:
+                return output, True
+            output = run()
+            # テキスト出力 (対話モードなど) は成否が判定できないので保存しない
+            if output.strip() and is_json_output(output):
+                self.set(script, args, output)
+            return output, False
+
+_cache = None
+_cache_lock = threading.Lock()
+
+def get_cache():
+    global _cache
+    with _cache_lock:
+        if _cache is None:
+            _cache = ResultCache()
+        return _cache
+
+def cached_main(script, skip=None):
+    """
+    main(argv) の出力を (script, argv) で共有するデコレータ。
+    skip(argv) が真の呼び出し (stdin を読む / 常駐する など) と、
+    位置引数の無い呼び出し (対話入力になる) はそのまま実行する。
+    """
+    def decorator(main):
+        @functools.wraps(main)
+        def wrapper(argv):
+            argv = [str(a) for a in argv]
+            positional = [a for a in argv if not a.startswith("-")]
+            if not ENABLED or not positional or (skip and skip(argv)):
+                return main(argv)
+
+            def run():
+                buf = io.StringIO()
+                try:
+                    with contextlib.redirect_stdout(buf):
+                        main(argv)
+                except BaseException:
+                    # argparse のエラーや例外は保存せず、出力だけ流してそのまま上げる
+                    sys.stdout.write(buf.getvalue())
+                    raise
+                return buf.getvalue()
+
+            try:
+                cache = get_cache()
+            except Exception as e:
+                print(f"[result_cache] disabled: {e}", file=sys.stderr)
+                return main(argv)
+            output, hit = cache.get_or_run(script, argv, run)
+            timing.record_cache("result_cache", hit)
+            if hit:
+                timing.set_tier("result_cache")
+                output = with_tier(output, "result_cache")
+            sys.stdout.write(output)
+            sys.stdout.flush()
+        return wrapper
+    return decorator
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Shared script result cache")
+    sub = parser.add_subparsers(dest="command", required=True)
+    p_inv = sub.add_parser("invalidate")
+    p_inv.add_argument("script")
+    p_inv.add_argument("args", nargs=argparse.REMAINDER)
+    sub.add_parser("clear").add_argument("script", nargs="?")
+    sub.add_parser("stats")
+    args = parser.parse_args(argv)
+
+    cache = get_cache()
+    if args.command == "invalidate":
+        cache.invalidate(args.script, args.args)
+    elif args.command == "clear":
+        cache.clear(args.script)
+    else:
+        print(json.dumps(cache.stats(), ensure_ascii=False))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -1,16 +1,92 @@
-import requests
+import os
 import re
 import json
 import sys
+from concurrent.futures import ThreadPoolExecutor, as_completed
 
-def find_block_info(event_url_key):
-    headers = {
-        'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-    }
-    url = f"https://www.showroom-live.com/event/{event_url_key}"
+import http_client
+import timing
+from result_cache import cached_main
+from timing import timed_main
+
+BASE_URL = os.environ.get("SHOWROOM_BASE_URL", "https://www.showroom-live.com").rstrip("/")
+
+# event_and_support を同時に問い合わせるルーム数
+PROBE_WIDTH = int(os.environ.get("EVENT_PROBE_WIDTH", "5"))
+# 一致が見つかった後も実行中のプローブは止められないので、応答待ちは短めにする
+PROBE_TIMEOUT = float(os.environ.get("EVENT_PROBE_TIMEOUT", "3"))
+
+def fetch_room_event(room_id):
+    api_url = f"{BASE_URL}/api/room/event_and_support?room_id={room_id}"
+    api_res = http_client.get(api_url, timeout=PROBE_TIMEOUT, retries=0).json()
+    return api_res.get('event') or None
+
+def probe_event(event_url_key, room_ids, width=PROBE_WIDTH):
+    """
+    ルームの event_and_support を並列に問い合わせ、event_url に event_url_key を含む
+    最初の応答を返す。一致するものが無ければ最初に取れたイベントを返す。
+    """
+    # 重複を除いた先頭 width 件だけ試せば十分 (全部やると遅い)
+    candidates = list(dict.fromkeys(room_ids))[:max(width, 1)]
+    if not candidates:
+        return None, False
+
+    fallback = None
+    pool = ThreadPoolExecutor(max_workers=len(candidates))
+    try:
+        # 戻った後に終わったプローブが次の呼び出しの _timing に混ざらないよう、今の Trace に結び付ける
+        probe = timing.bind(fetch_room_event)
+        futures = [pool.submit(probe, rid) for rid in candidates]
+        for future in as_completed(futures):
+            try:
+                evt = future.result()
+            except Exception:
+                continue
+            if not evt:
+                continue
+            # イベントURLキーが含まれているかチェック (完全一致はしないこともある)
+            if event_url_key in (evt.get('event_url') or ''):
+                return evt, True
+            # キーが一致しなくても、とりあえず確保しておき、一致するものが見つかるまで待つ
+            if fallback is None:
+                fallback = evt
+    finally:
+        # 一致が見つかった時点で残りのプローブは待たない (実行中のものは PROBE_TIMEOUT 以内に終わる)
+        pool.shutdown(wait=False, cancel_futures=True)
+    return fallback, False
+
+def parse_event_page(html):
+    """イベントページから (ルームIDのリスト, ブロックのリスト) を取り出す。"""
+    room_ids = re.findall(r'room_id=(\d+)', html)
+
+    blocks = re.findall(r'<option[^>]*value=["\'](\d+)["\'][^>]*>([^<]+)</option>', html)
+    # 重複除外
+    unique_blocks = {}
+    for b in blocks:
+        unique_blocks[b[0]] = b[1]
+    return room_ids, [{"block_id": k, "name": v} for k, v in unique_blocks.items()]
+
+def find_block_info(event_url_key, probe_width=PROBE_WIDTH, use_cache=True):
+    # event_url_key -> {event_id, event_name, blocks} は共有キャッシュにあればネットワークを使わない
+    # fetch_block_info は例外を上げないので、ここで捕まるのはキャッシュ側の失敗だけ
+    if use_cache:
+        try:
+            from event_cache import get_cache
+            info = get_cache().get_or_fetch_event(event_url_key, lambda: fetch_block_info(event_url_key, probe_width))
+            timing.set_tier("cache")
+            return info
+        except Exception as e:
+            print(f"[scrape_event_info] event cache unavailable: {e}", file=sys.stderr)
+    return fetch_block_info(event_url_key, probe_width)
+
+def fetch_block_info(event_url_key, probe_width=PROBE_WIDTH):
+    url = f"{BASE_URL}/event/{event_url_key}"
     
     try:
-        response = requests.get(url, headers=headers, timeout=15)
+        # イベントページは変わっていなければ 304 で済ませる
+        timing.set_tier("fetch")
+        with timing.stage("fetch_page"):
+            response = http_client.get(url, timeout=15, cache=True)
         if response.status_code != 200:
             return {"error": f"Failed to fetch page: {response.status_code}"}
         
@@ -19,67 +95,39 @@ def find_block_info(event_url_key):
         
         # 1. event_id の特定
         # ページ内のルームIDを抽出してAPIを叩く
-        room_ids = re.findall(r'room_id=(\d+)', html)
-        
-        # room_idsが空の場合の対策 (プロフィールリンクなど別のパターンも考慮)
-        if not room_ids:
-             # href="/room/profile?room_id=..." パターン
-             room_ids = re.findall(r'room_id=(\d+)', html)
+        with timing.stage("parse_html"):
+            room_ids, blocks = parse_event_page(html)
         
         # URLキーのみでAPIが叩ける場合もあるが、確実なのはルーム経由
-        found_event = False
-        
-        # 抽出したルームIDを使ってAPIを試し、該当イベントの情報を探す
-        # 最初の数個だけ試せば十分 (全部やると遅い)
-        for rid in set(room_ids[:5]): 
-            api_url = f"https://www.showroom-live.com/api/room/event_and_support?room_id={rid}"
-            try:
-                api_res = requests.get(api_url, headers=headers, timeout=5).json()
-                if 'event' in api_res and api_res['event']:
-                    # イベントIDが取れたら、それが探しているイベントか確認する術はないが、
-                    # イベントページのリンクにあるルームなので、そのイベントに参加している可能性が高い。
-                    # ただし、複数のイベントバナーがある可能性もあるので、event_url_key比較ができればベスト。
-                    
-                    evt = api_res['event']
-                    # イベントURLキーが含まれているかチェック (完全一致はしないこともある)
-                    if event_url_key in evt.get('event_url', ''):
-                        results['event_id'] = evt.get('event_id')
-                        results['event_name'] = evt.get('event_name')
-                        found_event = True
-                        break
-                    
-                    # キーが一致しなくても、とりあえず確保しておき、ループ終了もしくは一致するものが見つかるまで探す
-                    if 'event_id' not in results:
-                         results['event_id'] = evt.get('event_id')
-                         results['event_name'] = evt.get('event_name')
-
-            except:
-                continue
-            
-            if found_event:
-                break
+        # 抽出したルームIDを使って event_and_support を並列に試し、該当イベントの情報を探す
+        # イベントページのリンクにあるルームなので、そのイベントに参加している可能性が高い。
+        with timing.stage("probe"):
+            evt, _ = probe_event(event_url_key, room_ids, probe_width)
+        if evt:
+            results['event_id'] = evt.get('event_id')
+            results['event_name'] = evt.get('event_name')
         
         # 2. block_id の特定 (セレクトボックスから)
-        blocks = re.findall(r'<option[^>]*value=["\'](\d+)["\'][^>]*>([^<]+)</option>', html)
         if blocks:
-            # 重複除外
-            unique_blocks = {}
-            for b in blocks:
-                unique_blocks[b[0]] = b[1]
-            results['blocks'] = [{"block_id": k, "name": v} for k, v in unique_blocks.items()]
+            results['blocks'] = blocks
         
         return results
 
     except Exception as e:
         return {"error": str(e)}
 
-if __name__ == "__main__":
+@timed_main("scrape_event_info.py")
+@cached_main("scrape_event_info.py")
+def main(argv):
     # 引数がなければエラー、あれば実行
-    if len(sys.argv) > 1:
-        key = sys.argv[1]
+    if len(argv) > 0:
+        key = argv[0]
         # URLキーに余計なクエリがついていたら除去
         key = key.split('?')[0].split('&')[0]
         info = find_block_info(key)
         print(json.dumps(info, indent=2, ensure_ascii=False))
     else:
         print(json.dumps({"error": "No event_url_key provided"}, indent=2))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
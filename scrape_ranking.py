@@ -1,135 +1,204 @@
+import os
 import sys
-import urllib.request
 import re
 import json
 
+import http_client
+import timing
+from ranking_parser import parse_ranking
+from result_cache import cached_main
+from timing import timed_main
 
-from selenium import webdriver
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
 
-def scrape(url_key):
-    url = f"https://www.showroom-live.com/event/{url_key}"
-    
+# オフラインのベンチ (bench/stub_server.py) などに向ける場合は環境変数で上書きする
+BASE_URL = os.environ.get("SHOWROOM_BASE_URL", "https://www.showroom-live.com").rstrip("/")
+# User-Agent などの共通ヘッダは http_client が付ける
+HEADERS = {
+    "Referer": "https://www.showroom-live.com/"
+}
+
+# url_key -> event_id のキャッシュ (イベントIDは開催中に変わらない)
+# scrape_event_info / scrape_room_event と共有の event_cache に保存する
+def load_event_id(url_key):
     try:
-        # Use Selenium to handle dynamic content (SPA) and bot protection
-        options = Options()
-        options.add_argument('--headless') # Run in background
-        options.add_argument('--disable-gpu')
-        options.add_argument('--no-sandbox')
-        options.add_argument('--disable-dev-shm-usage')
-        # Mimic a real browser
-        options.add_argument('user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
-        
-        # Suppress logging
-        options.add_experimental_option('excludeSwitches', ['enable-logging'])
-
-        driver = webdriver.Chrome(options=options)
-        
-        try:
+        from event_cache import get_cache
+        event_id = get_cache().get_event_id(url_key)
+        timing.record_cache("event_cache", event_id is not None)
+        return str(event_id) if event_id is not None else None
+    except Exception:
+        return None
+
+def save_event_id(url_key, event_id):
+    try:
+        from event_cache import get_cache
+        get_cache().set_event_id(url_key, event_id)
+    except Exception:
+        pass
+
+def fetch_text(url, timeout=10, cache=False, retries=None):
+    return http_client.get(url, HEADERS, timeout, retries=retries, cache=cache).raise_for_status().text
+
+def find_event_id(html):
+    # Look for eventId in scripts
+    # Patterns: eventId:12345, "eventId":12345, event_id=12345
+    eid_match = re.search(r'["\']?eventId["\']?[:=]\s*(\d+)', html)
+    if not eid_match:
+        eid_match = re.search(r'["\']?event_id["\']?[:=]\s*(\d+)', html)
+    return eid_match.group(1) if eid_match else None
+
+def parse_ranking_html(html):
+    # contentlist-row の解析は ranking_parser に移した (url_key / point も取れる)
+    return parse_ranking(html)
+
+def normalize_block_entry(entry):
+    # block_ranking の要素はルーム情報がフラットな場合があるので ranking と同じ形に揃える
+    if "room" in entry:
+        return entry
+    return {
+        "rank": entry.get("rank"),
+        "point": entry.get("point", 0),
+        "room": {
+            "room_id": entry.get("room_id"),
+            "room_name": entry.get("room_name", ""),
+            "url_key": entry.get("room_url_key", entry.get("url_key", ""))
+        }
+    }
+
+def fetch_block_ranking(event_id, block_id=None, page=1, timeout=10, retries=None):
+    url = f"{BASE_URL}/api/event/block_ranking?event_id={event_id}&page={page}"
+    if block_id:
+        url += f"&block_id={block_id}"
+    block_data = json.loads(fetch_text(url, timeout, retries=retries))
+    return [normalize_block_entry(e) for e in block_data.get("block_ranking_list") or []]
+
+def fetch_ranking_or_raise(event_id, block_id=None, timeout=10, retries=None):
+    """
+    API からランキングを取る。取れなかった場合は例外を上げる (poll_scheduler はこれで失敗を数える)。
+    ブロック指定がある場合は block_ranking だけを見る。
+    """
+    if block_id:
+        return fetch_block_ranking(event_id, block_id, timeout=timeout, retries=retries)
+
+    # Showroom API ranking format:
+    # { "rank": 1, "point": 100, "room": { "room_id": 1, "room_name": "...", "room_url_key": "..." } }
+    # It matches our output format closely.
+    try:
+        api_data = json.loads(fetch_text(f"{BASE_URL}/api/event/ranking?event_id={event_id}", timeout, retries=retries))
+        if api_data.get("ranking"):
+            return api_data["ranking"]
+    except Exception:
+        pass
+
+    # ブロックイベントは通常APIが空になることがあるので block_ranking も試す
+    return fetch_block_ranking(event_id, timeout=timeout, retries=retries)
+
+def fetch_api_ranking(event_id, block_id=None):
+    # 失敗は [] (HTML / ブラウザの段に進む)
+    try:
+        return fetch_ranking_or_raise(event_id, block_id)
+    except Exception:
+        return []
+
+def render_page(url):
+    # Use Selenium to handle dynamic content (SPA) and bot protection
+    from selenium.webdriver.common.by import By
+    from selenium.webdriver.support.ui import WebDriverWait
+    from selenium.webdriver.support import expected_conditions as EC
+
+    from browser_pool import get_pool
+
+    # Browsers are borrowed from the shared pool instead of launched per call
+    with get_pool().driver() as driver:
+        with timing.stage("browser_get"):
             driver.get(url)
-            
-            # Wait for the ranking list to load (max 10 seconds)
-            try:
-                # Based on user provided HTML, look for listcard-ranking or contentlist-row
+
+        # Wait for the ranking list to load (max 10 seconds)
+        try:
+            # Based on user provided HTML, look for listcard-ranking or contentlist-row
+            with timing.stage("browser_wait"):
                 WebDriverWait(driver, 10).until(
                     EC.presence_of_element_located((By.CLASS_NAME, "contentlist-row"))
                 )
-            except:
-                # Continue even if wait times out, maybe it loaded partially or class changed
-                pass
-            
-            html = driver.page_source
-        finally:
-            driver.quit()
-        
-        ranking = []
-        
-        # Robust parsing strategy:
-        # Split HTML by list item markers to isolate each room's block
-        items = html.split('class="contentlist-row"')
-        
-        # The first chunk is before the first item, so skip it
-        if len(items) > 1:
-            items.pop(0)
-            
-            for item in items:
-                # Extract Rank
-                rank_match = re.search(r'is-rank-(\d+)', item)
-                
-                # Extract Room ID
-                id_match = re.search(r'data-room-id="(\d+)"', item)
-                
-                # Extract Room Name (Try 1: h4 tag text)
-                name = ""
-                name_match_h4 = re.search(r'listcardinfo-main-text[^>]*>([\s\S]*?)<\/', item)
-                if name_match_h4:
-                    name = name_match_h4.group(1).strip()
-                
-                # Extract Room Name (Try 2: img alt attribute)
-                if not name:
-                    # Look for img tag with class img-main and alt attribute
-                    # Pattern: <img ... class="img-main" ... alt="NAME" ...>
-                    # Be flexible with attribute order
-                    alt_match = re.search(r'class="[^"]*img-main[^"]*"[^>]*alt="([^"]+)"', item)
-                    if not alt_match:
-                         # Try simpler alt match if class order varies
-                         alt_match = re.search(r'alt="([^"]+)"', item)
-                    
-                    if alt_match:
-                        # Filter out common non-name alts if necessary, but usually alt on main img is name
-                        potential_name = alt_match.group(1).strip()
-                        if potential_name not in ["Official", "Onlive", "Badge", "Profile", "Follow"]:
-                             name = potential_name
-
-                if rank_match and id_match and name:
-                    ranking.append({
-                        "rank": int(rank_match.group(1)),
-                        "point": 0, # Points are usually not visible on this page type
-                        "room": {
-                            "room_id": int(id_match.group(1)),
-                            "room_name": name,
-                            "url_key": "" 
-                        }
-                    })
-
-        # If HTML scraping yielded no results, try to find eventId and call API
-        if len(ranking) == 0:
-            # Look for eventId in scripts
-            # Patterns: eventId:12345, "eventId":12345, event_id=12345
-            eid_match = re.search(r'["\']?eventId["\']?[:=]\s*(\d+)', html)
-            if not eid_match:
-                eid_match = re.search(r'["\']?event_id["\']?[:=]\s*(\d+)', html)
-            
-            if eid_match:
-                event_id = eid_match.group(1)
-                # Fetch API
-                api_url = f"https://www.showroom-live.com/api/event/ranking?event_id={event_id}"
-                try:
-                    with urllib.request.urlopen(api_url) as api_res:
-                        api_data = json.loads(api_res.read().decode('utf-8'))
-                        # API usually returns {"ranking": [...]} 
-                        if "ranking" in api_data:
-                            # Map API format to our format if necessary
-                            # Showroom API ranking format: 
-                            # { "rank": 1, "point": 100, "room": { "room_id": 1, "room_name": "...", "room_url_key": "..." } }
-                            # It matches our output format closely.
-                            ranking = api_data["ranking"]
-                except Exception as e:
-                    # API fetch failed, ignore and return empty
-                    pass
-
-        print(json.dumps({"ranking": ranking}, ensure_ascii=False))
+        except:
+            # Continue even if wait times out, maybe it loaded partially or class changed
+            pass
+
+        return driver.page_source
+
+def resolve_ranking(url_key):
+    """
+    Tiered resolver. Returns (ranking, tier).
+      cache   : cached event_id + JSON API
+      api     : event_id found in static HTML + JSON API
+      html    : rows parsed from the static HTML
+      browser : rows (or event_id + API) from the headless browser render
+    """
+    url = f"{BASE_URL}/event/{url_key}"
+
+    # Tier 1: url_key -> event_id cache
+    event_id = load_event_id(url_key)
+    if event_id:
+        with timing.stage("fetch_api"):
+            ranking = fetch_api_ranking(event_id)
+        if ranking:
+            return ranking, "cache"
+
+    # Tier 2/3: plain HTTP fetch of the event page
+    html = ""
+    try:
+        # イベントページは変わっていなければ 304 で済ませる
+        with timing.stage("fetch_page"):
+            html = fetch_text(url, cache=True)
+    except Exception:
+        pass
+
+    if html:
+        with timing.stage("parse_html"):
+            found_id = find_event_id(html)
+        if found_id:
+            save_event_id(url_key, found_id)
+            if found_id != event_id:
+                with timing.stage("fetch_api"):
+                    ranking = fetch_api_ranking(found_id)
+                if ranking:
+                    return ranking, "api"
+
+        with timing.stage("parse_html"):
+            ranking = parse_ranking_html(html)
+        if ranking:
+            return ranking, "html"
+
+    # Tier 4: headless browser (last resort)
+    with timing.stage("browser_render"):
+        html = render_page(url)
+    with timing.stage("parse_html"):
+        ranking = parse_ranking_html(html)
+    if ranking:
+        return ranking, "browser"
+
+    # If HTML scraping yielded no results, try to find eventId and call API
+    found_id = find_event_id(html)
+    if found_id:
+        save_event_id(url_key, found_id)
+        with timing.stage("fetch_api"):
+            ranking = fetch_api_ranking(found_id)
+    return ranking, "browser"
+
+def scrape(url_key):
+    try:
+        ranking, tier = resolve_ranking(url_key)
+        timing.set_tier(tier)
+        print(json.dumps({"ranking": ranking, "tier": tier}, ensure_ascii=False))
 
     except Exception as e:
         # Output JSON error
         print(json.dumps({"error": str(e)}, ensure_ascii=False))
 
-if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        arg = sys.argv[1]
+@timed_main("scrape_ranking.py")
+@cached_main("scrape_ranking.py")
+def main(argv):
+    if len(argv) > 0:
+        arg = argv[0]
         # Handle full URL or just the key
         # If arg contains 'showroom-live.com/event/', extract the part after it
         match = re.search(r'showroom-live\.com/event/([^/?]+)', arg)
@@ -140,3 +209,6 @@ if __name__ == "__main__":
             scrape(arg)
     else:
         print(json.dumps({"error": "No URL key provided"}))
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
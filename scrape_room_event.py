@@ -1,77 +1,203 @@
+import os
 import sys
-import urllib.request
 import re
 import json
+import urllib.parse
+from concurrent.futures import ThreadPoolExecutor
+
+import http_client
+import timing
+from result_cache import cached_main
+from timing import timed_main
+
+BASE_URL = os.environ.get("SHOWROOM_BASE_URL", "https://www.showroom-live.com").rstrip("/")
+
+# room_id -> event_url_key の解決は次の順に試す (ブラウザは最後の手段):
+#   api     : /api/room/event_and_support の event.event_url
+#   html    : ルームプロフィールの静的HTMLにあるイベントへのリンク
+#   browser : ヘッドレス Chrome で描画したプロフィール (API も HTML も応答しなかった場合だけ)
+# API が「イベント無し」と答えた場合はブラウザを使わずに見つからない扱いにする。
+#
+#   python scrape_room_event.py 123                  -> {"event_url_key": "...", "tier": "api"}
+#   python scrape_room_event.py 123 456 789          -> {"results": [{"room_id": "123", "event_url_key": ..., "tier": ...}, ...]}
+#
+# 複数指定は並列に解決する (同時数は --workers、同じホストへは http_client の HTTP_HOST_CONCURRENCY まで)。
+
+BATCH_WORKERS = int(os.environ.get("ROOM_EVENT_WORKERS", "16"))
+
+def profile_url(room_id):
+    return f"{BASE_URL}/room/profile?room_id={room_id}"
+
+def event_key_from_url(event_url):
+    """"https://www.showroom-live.com/event/<key>" (contribution や ?以降が付いていても可) からキーを取り出す。"""
+    if not event_url:
+        return None
+    parts = [p for p in urllib.parse.urlsplit(event_url).path.split("/") if p]
+    if len(parts) >= 2 and parts[0] == "event":
+        if parts[1] == "contribution":
+            return parts[2] if len(parts) >= 3 else None
+        return parts[1]
+    return None
+
+def fetch_api_event(room_id):
+    res = http_client.get(f"{BASE_URL}/api/room/event_and_support?room_id={room_id}", timeout=5, retries=0)
+    return res.raise_for_status().json().get("event") or None
+
+def api_event_key(room_id):
+    """戻り値: (event_url_key, API が応答したか)"""
+    try:
+        with timing.stage("fetch_api"):
+            event = fetch_api_event(room_id)
+    except Exception:
+        return None, False
+    return event_key_from_url((event or {}).get("event_url")), True
+
+def static_event_key(room_id):
+    """戻り値: (event_url_key, ページが取れたか)"""
+    try:
+        with timing.stage("fetch_page"):
+            html = http_client.get(profile_url(room_id), timeout=10).raise_for_status().text
+    except Exception:
+        return None, False
+    with timing.stage("parse_html"):
+        return find_event_key(html), True
+
+def resolve_event_key(room_id, use_browser=True):
+    """キャッシュを見ずに解決する。戻り値: (event_url_key, tier)"""
+    key, api_ok = api_event_key(room_id)
+    if key:
+        return key, "api"
+    key, _ = static_event_key(room_id)
+    if key:
+        return key, "html"
+    if api_ok or not use_browser:
+        return None, None
+    return render_room_event_key(room_id), "browser"
+
+def render_room_event_key(room_id):
+    url = profile_url(room_id)
 
-def scrape_room_event(room_id):
-    url = f"https://www.showroom-live.com/room/profile?room_id={room_id}"
-    
-    from selenium import webdriver
-    from selenium.webdriver.chrome.options import Options
     from selenium.webdriver.common.by import By
     from selenium.webdriver.support.ui import WebDriverWait
     from selenium.webdriver.support import expected_conditions as EC
 
-    try:
-        # Selenium options
-        options = Options()
-        options.add_argument('--headless')
-        options.add_argument('--disable-gpu')
-        options.add_argument('--no-sandbox')
-        options.add_argument('--disable-dev-shm-usage')
-        options.add_argument('user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36')
-        options.add_experimental_option('excludeSwitches', ['enable-logging'])
-
-        driver = webdriver.Chrome(options=options)
-        
-        try:
+    from browser_pool import get_pool
+
+    # Browsers are borrowed from the shared pool instead of launched per call
+    with get_pool().driver() as driver:
+        with timing.stage("browser_get"):
             driver.get(url)
-            # Wait briefly for dynamic content? Room profile might be static enough, but wait just in case
-            # Wait for event link or any content
-            try:
+        # Wait briefly for dynamic content? Room profile might be static enough, but wait just in case
+        # Wait for event link or any content
+        try:
+            with timing.stage("browser_wait"):
                 WebDriverWait(driver, 5).until(
                     EC.presence_of_element_located((By.TAG_NAME, "body"))
                 )
-            except:
-                pass
-            html = driver.page_source
-        finally:
-            driver.quit()
-
-        # Find Event Banner Link
-        # Pattern: <a href="/event/gamicurry06?room_id=..."> or similar
-        # Also need to match it with "current event" context if possible, but usually the main event banner is prominent.
-        
-        # Look for "event-box" or similar structure
-        # Or just find any link to /event/xxxx and assume it's the current one.
-        # But there might be past events.
-        
-        # The official API usually returns current event. If we just want the URL key for the active event ID...
-        # We can search for the known event_id in the HTML if provided, but we want to find the key.
-        
-        # Let's look for the ranking contribution link, which is definitely for the current event.
-        # href="/event/contribution/gamicurry06?room_id=..."
-        
-        contrib_match = re.search(r'href="/event/contribution/([^"?]+)\?room_id=', html)
-        if contrib_match:
-            event_url_key = contrib_match.group(1)
-            print(json.dumps({"event_url_key": event_url_key}))
-            return
-
-        # Fallback: simple /event/ link
-        event_match = re.search(r'href="/event/([^"?]+)\?room_id=', html)
-        if event_match:
-            event_url_key = event_match.group(1)
-            print(json.dumps({"event_url_key": event_url_key}))
-            return
-
-        print(json.dumps({"error": "Event key not found"}))
+        except:
+            pass
+        html = driver.page_source
+
+    with timing.stage("parse_html"):
+        return find_event_key(html)
+
+def find_event_key(html):
+    # Find Event Banner Link
+    # Pattern: <a href="/event/gamicurry06?room_id=..."> or similar
+    # Also need to match it with "current event" context if possible, but usually the main event banner is prominent.
+    
+    # Look for "event-box" or similar structure
+    # Or just find any link to /event/xxxx and assume it's the current one.
+    # But there might be past events.
+    
+    # The official API usually returns current event. If we just want the URL key for the active event ID...
+    # We can search for the known event_id in the HTML if provided, but we want to find the key.
+    
+    # Let's look for the ranking contribution link, which is definitely for the current event.
+    # href="/event/contribution/gamicurry06?room_id=..."
+    
+    contrib_match = re.search(r'href="/event/contribution/([^"?]+)\?room_id=', html)
+    if contrib_match:
+        return contrib_match.group(1)
+
+    # Fallback: simple /event/ link
+    event_match = re.search(r'href="/event/([^"?]+)\?room_id=', html)
+    if event_match:
+        return event_match.group(1)
 
+    return None
+
+def lookup_room_event(room_id, use_browser=True):
+    """共有キャッシュ経由で解決する。戻り値: (event_url_key, tier)"""
+    tiers = []
+    called = []
+    fetched = []
+
+    def fetch():
+        called.append(True)
+        key, tier = resolve_event_key(room_id, use_browser)
+        tiers.append(tier)
+        fetched.append(key)
+        return key
+
+    # room_id -> event_url_key は共有キャッシュにあればネットワークを使わない
+    try:
+        from event_cache import get_cache
+        key = get_cache().get_or_fetch_room_event(room_id, fetch)
     except Exception as e:
-        print(json.dumps({"error": str(e)}))
+        # 取得そのものの失敗はそのまま上げ、キャッシュ (SQLite / ロックファイル) の失敗なら直接取りに行く
+        if called and not fetched:
+            raise
+        print(f"[scrape_room_event] event cache unavailable: {e}", file=sys.stderr)
+        key = fetched[0] if fetched else fetch()
+    return key, tiers[0] if tiers else "cache"
 
-if __name__ == "__main__":
-    if len(sys.argv) > 1:
-        scrape_room_event(sys.argv[1])
-    else:
+def room_result(room_id, use_browser=True):
+    try:
+        key, tier = lookup_room_event(room_id, use_browser)
+    except Exception as e:
+        return {"error": str(e)}
+    if not key:
+        return {"error": "Event key not found"}
+    return {"event_url_key": key, "tier": tier}
+
+def scrape_room_event(room_id, use_browser=True):
+    result = room_result(room_id, use_browser)
+    if result.get("tier"):
+        timing.set_tier(result["tier"])
+    print(json.dumps(result))
+
+def scrape_room_events(room_ids, use_browser=True, max_workers=BATCH_WORKERS):
+    """複数ルームを並列に解決する。入力順の結果のリストを返す (重複は1回だけ解決)。"""
+    unique = list(dict.fromkeys(str(r) for r in room_ids))
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(unique) or 1))) as pool:
+        resolved = dict(zip(unique, pool.map(lambda r: room_result(r, use_browser), unique)))
+    return [dict(room_id=str(r), **resolved[str(r)]) for r in room_ids]
+
+# 一括はルーム毎に event_cache で共有するので、出力全体 (一部の一時的な失敗を含む) は保存しない
+@timed_main("scrape_room_event.py")
+@cached_main("scrape_room_event.py",
+             skip=lambda argv: "--batch" in argv or sum(not a.startswith("-") for a in argv) > 1)
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Resolve room_id -> event_url_key")
+    parser.add_argument("room_ids", nargs="*")
+    parser.add_argument("--batch", action="store_true", help="Batch output ({\"results\": [...]}) even for a single room")
+    parser.add_argument("--workers", type=int, default=BATCH_WORKERS, help="Rooms resolved in parallel in batch mode")
+    parser.add_argument("--no-browser", action="store_true", help="Never fall back to the headless browser")
+    args = parser.parse_args(argv)
+    use_browser = not args.no_browser
+
+    invalid = [r for r in args.room_ids if not re.fullmatch(r"\d+", r, re.ASCII)]
+    if not args.room_ids:
         print(json.dumps({"error": "No Room ID provided"}))
+    elif invalid:
+        print(json.dumps({"error": f"Invalid room_id: {invalid[0]}"}))
+    elif len(args.room_ids) > 1 or args.batch:
+        timing.set_tier("batch")
+        print(json.dumps({"results": scrape_room_events(args.room_ids, use_browser, args.workers)}))
+    else:
+        scrape_room_event(args.room_ids[0], use_browser)
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
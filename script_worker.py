@@ -0,0 +1,105 @@
+import os
+import sys
+import io
+import json
+import signal
+import importlib
+import threading
+import contextlib
+
+import timing
+import browser_pool
+
+# Long-lived worker process for server.js.
+# Loads the scraper modules once and answers JSON-lines requests on stdin:
+#   {"id": 1, "script": "scrape_ranking.py", "args": ["event_key"]}
+#   {"id": 2, "script": "scrape_ranking.py", "args": ["event_key"], "timing": true}   (result gets "_timing")
+# Each reply is one JSON line on stdout:
+#   {"id": 1, "ok": true, "result": {...}}   (result = what the script prints today)
+#   {"id": 1, "ok": false, "error": "..."}
+
+SCRIPTS = {
+    "fetch_comment_log.py": "fetch_comment_log",
+    "scrape_event_info.py": "scrape_event_info",
+    "scrape_ranking.py": "scrape_ranking",
+    "scrape_room_event.py": "scrape_room_event",
+    "search_avatar.py": "search_avatar",
+    "ranking_snapshots.py": "ranking_snapshots",
+}
+
+_modules = {}
+
+def load_module(script):
+    name = SCRIPTS.get(script)
+    if not name:
+        raise ValueError(f"Unknown script: {script}")
+    if name not in _modules:
+        _modules[name] = importlib.import_module(name)
+    return _modules[name]
+
+def preload():
+    # 起動時に一度だけimportしておく (selenium / bs4 などの読み込みコストを前払い)
+    for script in SCRIPTS:
+        try:
+            load_module(script)
+        except Exception as e:
+            print(f"[script_worker] preload failed for {script}: {e}", file=sys.stderr)
+
+def run_script(script, args, with_timing=False):
+    module = load_module(script)
+    buf = io.StringIO()
+    with contextlib.redirect_stdout(buf), (timing.forced() if with_timing else contextlib.nullcontext()):
+        try:
+            module.main([str(a) for a in args])
+        except SystemExit:
+            # argparse / sys.exit() in CLI paths
+            pass
+    output = buf.getvalue().strip()
+    if not output:
+        raise RuntimeError("Script produced no output")
+    # Scripts print a single JSON document; keep the last one if there are several lines
+    try:
+        return json.loads(output)
+    except ValueError:
+        return json.loads(output.splitlines()[-1])
+
+def handle(line):
+    try:
+        req = json.loads(line)
+    except ValueError as e:
+        return {"id": None, "ok": False, "error": f"Invalid request: {e}"}
+
+    req_id = req.get("id")
+    try:
+        result = run_script(req.get("script"), req.get("args") or [], bool(req.get("timing")))
+        return {"id": req_id, "ok": True, "result": result}
+    except Exception as e:
+        return {"id": req_id, "ok": False, "error": str(e)}
+
+def on_sigterm(signum, frame):
+    # server.js はタイムアウトしたワーカーを SIGTERM で止める。atexit は走らないので、
+    # ここでブラウザ (chromedriver / Chrome) を閉じてから終わる。閉じるのが固まっても待ちすぎない
+    closer = threading.Thread(target=browser_pool.close_pool, daemon=True)
+    closer.start()
+    closer.join(10)
+    os._exit(128 + signum)
+
+def serve(stdin, stdout):
+    for line in stdin:
+        line = line.strip()
+        if not line:
+            continue
+        reply = handle(line)
+        stdout.write(json.dumps(reply, ensure_ascii=False) + "\n")
+        stdout.flush()
+
+if __name__ == "__main__":
+    stdin = io.TextIOWrapper(sys.stdin.buffer, encoding='utf-8')
+    stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8', line_buffering=True)
+    # Scripts write via print(); keep stray output away from the reply channel
+    sys.stdout = sys.stderr
+    signal.signal(signal.SIGTERM, on_sigterm)
+    if "--no-preload" not in sys.argv:
+        preload()
+    print("[script_worker] ready", file=sys.stderr)
+    serve(stdin, stdout)
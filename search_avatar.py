@@ -1,13 +1,132 @@
-import requests
-from bs4 import BeautifulSoup
+import os
 import math
 import sys
 import json
 
-# HTMLの文字化け対策（標準出力のエンコーディング設定）
-sys.stdout.reconfigure(encoding='utf-8')
+import http_client
+import timing
+from avatar_extract import AvatarPage
+from result_cache import cached_main
+from timing import timed_main
 
-def search_showroom_avatar(target_id, output_json=False):
+EXTERNAL_MAKEAVATAR = "EXTERNAL_MAKEAVATAR"
+
+# オフラインのベンチ (bench/stub_server.py) などに向ける場合は環境変数で上書きする
+AVATAR_BASE_URL = os.environ.get("SR_AVATAR_BASE_URL", "https://www.sr-avatar.com").rstrip("/")
+
+# アバターページはほとんど変わらないので、この秒数以内はディスクキャッシュをそのまま使う (以降は条件付きで再検証)
+AVATAR_PAGE_MAX_AGE = int(os.environ.get("AVATAR_PAGE_MAX_AGE", "600"))
+
+# "1000450" -> "1000401" のように、そのIDが含まれるページの先頭番号を計算
+def get_avatar_page_url(aid):
+    # Specific ranges from HTML
+    if 1 <= aid <= 100: return f"{AVATAR_BASE_URL}/ava1.html"
+    if 101 <= aid <= 145: return f"{AVATAR_BASE_URL}/ava101.html"
+    if 100001 <= aid <= 100100: return f"{AVATAR_BASE_URL}/ava100001.html"
+    if 203001 <= aid <= 203086: return f"{AVATAR_BASE_URL}/ava203001.html"
+    if 204001 <= aid <= 204042: return f"{AVATAR_BASE_URL}/ava204001.html"
+    if 205001 <= aid <= 205100: return f"{AVATAR_BASE_URL}/ava205001.html"
+    if 205101 <= aid <= 205148: return f"{AVATAR_BASE_URL}/ava205101.html"
+    if 300001 <= aid <= 300029: return f"{AVATAR_BASE_URL}/ava300001.html"
+
+    # Block A: 1000001 - 1070000 (Approx Original 001 - 700)
+    # Note: Original 700 is ava1069901, so range goes up to 1070000
+    if 1000001 <= aid < 1111101:
+         # Use formula
+         page_start = ((aid - 1) // 100) * 100 + 1
+         return f"{AVATAR_BASE_URL}/ava{page_start}.html"
+
+    # Block B: 1111101 - ... (Original 701 - 960+)
+    # Last listed is 960 (1137001), assuming pattern continues or stops there
+    if 1111101 <= aid < 2000000:
+         page_start = ((aid - 1) // 100) * 100 + 1
+         return f"{AVATAR_BASE_URL}/ava{page_start}.html"
+
+    # Avatar Shop
+    if aid >= 2000000 and aid < 3000001:
+        return f"{AVATAR_BASE_URL}/ava_shop.html"
+
+    # Make Avatar
+    if aid >= 3000001:
+        return EXTERNAL_MAKEAVATAR
+
+    # Fallback (Others)
+    return f"{AVATAR_BASE_URL}/ava999.html"
+
+def found_result(room_name, room_url, url):
+    if not room_name: room_name = "(画像リンク)"
+    if room_url and not room_url.startswith("http"):
+        room_url = "https://www.showroom-live.com" + room_url
+    return {
+        "found": True,
+        "room_name": room_name,
+        "room_url": room_url,
+        "source_url": url
+    }
+
+def render_result(result, target_id, output_json):
+    # JSON/テキスト両方の出力形式をここでまとめて組み立てる
+    if output_json:
+        return json.dumps(result, ensure_ascii=False)
+
+    if result.get("found"):
+        return f"特定成功\nルーム名: {result['room_name']}\nURL: {result['room_url']}"
+
+    error = result.get("error", "")
+    url = result.get("url")
+    if error.startswith("Page not found: "):
+        status = error[len("Page not found: "):]
+        return f"ページが見つかりませんでした (Status: {status})\nURL: {url}"
+    if error == "ID not found in page":
+        return f"このページ内に ID: {target_id} は見つかりませんでした。\n検索URL: {url}"
+    if error == "Link not found for ID":
+        return f"アバターID ({target_id}) はページ内に存在しましたが、ルームへのリンクが見つかりませんでした。\n（ルームが削除されたか、リンクが設定されていない可能性があります）"
+    return f"エラーが発生しました: {error}"
+
+def fetch_avatar_page(url):
+    # 2. ページを取得
+    timing.set_tier("live")
+    with timing.stage("fetch_page"):
+        response = http_client.get(url, cache=True, max_age=AVATAR_PAGE_MAX_AGE, detect_encoding=True)
+
+    if response.status_code != 200:
+        return response.status_code, None
+
+    # 3. HTML解析 (1パスでページ内の全IDの対応を作る)
+    with timing.stage("parse_html"):
+        return 200, AvatarPage(response.text)
+
+def result_from_page(status, page, target_id, url):
+    if status != 200:
+        return {"found": False, "error": f"Page not found: {status}", "url": url}
+
+    present, found_link = page.find(str(target_id))
+
+    if not present:
+        return {"found": False, "error": "ID not found in page", "url": url}
+    if not found_link:
+        return {"found": False, "error": "Link not found for ID", "url": url}
+    return found_result(found_link[0], found_link[1], url)
+
+def search_live(target_id, url):
+    status, page = fetch_avatar_page(url)
+    return result_from_page(status, page, target_id, url)
+
+def lookup_index(target_id_int):
+    # ローカルのアバターIDインデックスで引けるならページ取得を省略
+    try:
+        import avatar_index
+        with timing.stage("index_lookup"):
+            result, source = avatar_index.lookup_with_source(target_id_int)
+        # ページを取り直した場合はインデックスのヒットとは数えない
+        timing.record_cache("avatar_index", {"index": "hit", "revalidated": "revalidated"}.get(source, "miss"))
+        timing.set_tier("index" if source == "index" else "live")
+        return result
+    except Exception as e:
+        print(f"[search_avatar] index lookup failed: {e}", file=sys.stderr)
+        return None
+
+def search_showroom_avatar(target_id, output_json=False, use_index=True):
     # 1. URLの計算ロジック
     try:
         target_id_int = int(target_id)
@@ -15,153 +134,127 @@ def search_showroom_avatar(target_id, output_json=False):
         if output_json: return json.dumps({"found": False, "error": "Invalid ID"})
         return "エラー: 数値のIDを入力してください。"
 
-    # "1000450" -> "1000401" のように、そのIDが含まれるページの先頭番号を計算
-    
-    def get_avatar_page_url(aid):
-        # Specific ranges from HTML
-        if 1 <= aid <= 100: return "https://www.sr-avatar.com/ava1.html"
-        if 101 <= aid <= 145: return "https://www.sr-avatar.com/ava101.html"
-        if 100001 <= aid <= 100100: return "https://www.sr-avatar.com/ava100001.html"
-        if 203001 <= aid <= 203086: return "https://www.sr-avatar.com/ava203001.html"
-        if 204001 <= aid <= 204042: return "https://www.sr-avatar.com/ava204001.html"
-        if 205001 <= aid <= 205100: return "https://www.sr-avatar.com/ava205001.html"
-        if 205101 <= aid <= 205148: return "https://www.sr-avatar.com/ava205101.html"
-        if 300001 <= aid <= 300029: return "https://www.sr-avatar.com/ava300001.html"
-
-        # Block A: 1000001 - 1070000 (Approx Original 001 - 700)
-        # Note: Original 700 is ava1069901, so range goes up to 1070000
-        if 1000001 <= aid < 1111101: 
-             # Use formula
-             page_start = ((aid - 1) // 100) * 100 + 1
-             return f"https://www.sr-avatar.com/ava{page_start}.html"
-
-        # Block B: 1111101 - ... (Original 701 - 960+)
-        # Last listed is 960 (1137001), assuming pattern continues or stops there
-        if 1111101 <= aid < 2000000:
-             page_start = ((aid - 1) // 100) * 100 + 1
-             return f"https://www.sr-avatar.com/ava{page_start}.html"
-             
-        # Avatar Shop
-        if aid >= 2000000 and aid < 3000001:
-            return "https://www.sr-avatar.com/ava_shop.html"
-            
-        # Make Avatar
-        if aid >= 3000001:
-            return "EXTERNAL_MAKEAVATAR"
-
-        # Fallback (Others)
-        return "https://www.sr-avatar.com/ava999.html"
-
     # URL取得
     url = get_avatar_page_url(target_id_int)
-    
-    if url == "EXTERNAL_MAKEAVATAR":
+
+    if url == EXTERNAL_MAKEAVATAR:
         msg = "このアバターIDは Make Avatar (https://makeavatar.jp) の範囲です。\nSHOWROOMのルームプロフィールではありません。"
         if output_json: return json.dumps({"found": False, "error": msg, "external_url": "https://makeavatar.jp"})
         return msg
-    
-    # 2. ページを取得
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0"
-    }
-    
+
     try:
-        response = requests.get(url, headers=headers)
-        response.encoding = response.apparent_encoding
-        
-        if response.status_code != 200:
-            if output_json: return json.dumps({"found": False, "error": f"Page not found: {response.status_code}", "url": url})
-            return f"ページが見つかりませんでした (Status: {response.status_code})\nURL: {url}"
-
-        # 3. HTML解析
-        soup = BeautifulSoup(response.text, "html.parser")
-        target_id_str = str(target_id)
-        
-        target_text_nodes = soup.find_all(string=lambda t: t and target_id_str in t)
-        target_imgs = soup.find_all('img', src=lambda s: s and target_id_str in s)
-        
-        if not target_text_nodes and not target_imgs:
-             if output_json: return json.dumps({"found": False, "error": "ID not found in page", "url": url})
-             return f"このページ内に ID: {target_id} は見つかりませんでした。\n検索URL: {url}"
-
-        found_link = None
-        
-        # 画像検索からのリンク特定
-        for img in target_imgs:
-            link = img.find_parent('a')
-            if link:
-                room_name = link.get_text(strip=True)
-                room_url = link.get("href")
-                if room_url and ("showroom-live.com" in room_url or room_url.startswith("/room/")):
-                     found_link = (room_name, room_url)
-                     break
-
-        if not found_link:
-            for node in target_text_nodes:
-                text = node.strip()
-                if "～" in text or ("-" in text and len(text) > 15): 
-                     continue
-                
-                element = node.parent
-                link = None
-
-                if element.name == 'a':
-                    link = element
-                else:
-                    link = element.find_parent('a')
-                    if not link:
-                        p = element.previous_element
-                        for _ in range(20):
-                            if not p: break
-                            if p.name == 'a':
-                                link = p
-                                break
-                            p = p.previous_element
-                
-                if link:
-                    room_name = link.get_text(strip=True)
-                    room_url = link.get("href")
-                    if room_url and ("showroom-live.com" in room_url or room_url.startswith("/room/")):
-                         found_link = (room_name, room_url)
-                         break 
-
-        if found_link:
-            room_name, room_url = found_link
-            if not room_name: room_name = "(画像リンク)"
-            if room_url and not room_url.startswith("http"):
-                room_url = "https://www.showroom-live.com" + room_url
-
-            if output_json:
-                return json.dumps({
-                    "found": True,
-                    "room_name": room_name,
-                    "room_url": room_url,
-                    "source_url": url
-                }, ensure_ascii=False)
-            
-            return f"特定成功\nルーム名: {room_name}\nURL: {room_url}"
-        else:
-            if output_json:
-                 return json.dumps({"found": False, "error": "Link not found for ID", "url": url})
-            
-            if target_imgs or target_text_nodes:
-                 return f"アバターID ({target_id}) はページ内に存在しましたが、ルームへのリンクが見つかりませんでした。\n（ルームが削除されたか、リンクが設定されていない可能性があります）"
-            else:
-                 return f"このページ内に ID: {target_id} は見つかりませんでした。\n検索URL: {url}"
+        result = lookup_index(target_id_int) if use_index else None
+
+        if result is None:
+            result = search_live(target_id, url)
+
+        return render_result(result, target_id, output_json)
 
     except Exception as e:
         if output_json: return json.dumps({"found": False, "error": str(e)})
         return f"エラーが発生しました: {e}"
 
+def search_page_group(url, targets, use_index=True):
+    """同じページに載っているIDをまとめて解決する。targets: [(target_id, target_id_int), ...]"""
+    if use_index:
+        results = [lookup_index(aid) for _, aid in targets]
+        if all(r is not None for r in results):
+            return results
+
+    # ページは1回だけ取得・解析し、全IDをその結果から答える
+    try:
+        status, page = fetch_avatar_page(url)
+    except Exception as e:
+        return [{"found": False, "error": str(e)} for _ in targets]
+    return [result_from_page(status, page, tid, url) for tid, _ in targets]
+
+def search_avatars_batch(target_ids, use_index=True, max_workers=4):
+    """
+    複数IDの一括検索。get_avatar_page_url の結果でグループ化し、
+    ページごとに並列(最大 max_workers)で処理する。入力順の結果dictのリストを返す。
+    """
+    results = [None] * len(target_ids)
+    groups = {}
+
+    for i, target_id in enumerate(target_ids):
+        try:
+            aid = int(target_id)
+        except (TypeError, ValueError):
+            results[i] = {"found": False, "error": "Invalid ID"}
+            continue
+        url = get_avatar_page_url(aid)
+        if url == EXTERNAL_MAKEAVATAR:
+            msg = "このアバターIDは Make Avatar (https://makeavatar.jp) の範囲です。\nSHOWROOMのルームプロフィールではありません。"
+            results[i] = {"found": False, "error": msg, "external_url": "https://makeavatar.jp"}
+            continue
+        groups.setdefault(url, []).append((i, target_id, aid))
+
+    from concurrent.futures import ThreadPoolExecutor
+
+    def work(item):
+        url, members = item
+        return members, search_page_group(url, [(tid, aid) for _, tid, aid in members], use_index)
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        for members, group_results in pool.map(work, groups.items()):
+            for (i, _, _), result in zip(members, group_results):
+                results[i] = result
+
+    return [dict(avatar_id=str(tid), **result) for tid, result in zip(target_ids, results)]
+
+def read_ndjson_ids(stream):
+    # 1行1ID。数値そのままか {"avatar_id": ...} / {"target_id": ...} のどちらでも受け付ける
+    ids = []
+    for line in stream:
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            obj = json.loads(line)
+        except ValueError:
+            obj = line
+        if isinstance(obj, dict):
+            obj = obj.get("avatar_id", obj.get("target_id"))
+        ids.append(str(obj))
+    return ids
+
 # --- 実行 ---
-if __name__ == "__main__":
+# --stdin はストリーム、--json 無しは対話入力 / テキスト出力なので共有しない。
+# 一括は一部の一時的な失敗も成功として保存されてしまうので共有せず、ページは avatar_index で共有する
+@timed_main("search_avatar.py")
+@cached_main("search_avatar.py",
+             skip=lambda argv: "--stdin" in argv or "--json" not in argv or "--batch" in argv
+             or sum(not a.startswith("-") for a in argv) > 1)
+def main(argv):
     import argparse
     parser = argparse.ArgumentParser()
-    parser.add_argument("target_id", nargs='?', help="Target Avatar ID")
+    parser.add_argument("target_id", nargs='*', help="Target Avatar ID(s)")
     parser.add_argument("--json", action="store_true", help="Output in JSON format")
-    args = parser.parse_args()
+    parser.add_argument("--batch", action="store_true", help="Batch output ({\"results\": [...]}) even for a single ID")
+    parser.add_argument("--stdin", action="store_true", help="Read avatar IDs as NDJSON from stdin and write NDJSON results")
+    parser.add_argument("--workers", type=int, default=4, help="Max pages fetched in parallel in batch mode")
+    parser.add_argument("--no-index", action="store_true", help="Skip the local avatar index and fetch the page")
+    args = parser.parse_args(argv)
+    use_index = not args.no_index
+
+    # 一括モード: NDJSON入力 -> NDJSON出力
+    if args.stdin:
+        for result in search_avatars_batch(read_ndjson_ids(sys.stdin), use_index, args.workers):
+            print(json.dumps(result, ensure_ascii=False))
+        return
+
+    # 一括モード: 複数ID指定
+    if len(args.target_id) > 1 or args.batch:
+        results = search_avatars_batch(args.target_id, use_index, args.workers)
+        if args.json:
+            print(json.dumps({"results": results}, ensure_ascii=False))
+        else:
+            for result in results:
+                print(f"--- {result['avatar_id']} ---")
+                print(render_result(result, result['avatar_id'], False))
+        return
 
-    input_id = args.target_id
+    input_id = args.target_id[0] if args.target_id else None
     if not input_id:
         if not args.json:
             input_id = input("探したいアバターIDを入力してください: ")
@@ -169,5 +262,10 @@ if __name__ == "__main__":
             print(json.dumps({"found": False, "error": "No ID provided"}))
             sys.exit(1)
 
-    result = search_showroom_avatar(input_id, output_json=args.json)
+    result = search_showroom_avatar(input_id, output_json=args.json, use_index=use_index)
     print(result)
+
+if __name__ == "__main__":
+    # HTMLの文字化け対策（標準出力のエンコーディング設定）
+    sys.stdout.reconfigure(encoding='utf-8')
+    main(sys.argv[1:])
@@ -5,7 +5,7 @@ import express from "express";
 import fetch from "node-fetch";
 import * as cheerio from 'cheerio';
 import path from "path";
-import { spawn, exec } from "child_process";
+import { spawn } from "child_process";
 import { fileURLToPath } from "url";
 import { WebSocketServer } from "ws";
 import WebSocket from "ws";
@@ -17,6 +17,145 @@ const __dirname = path.dirname(__filename);
 const app = express();
 const PORT = process.env.PORT || 3000;
 
+// Python に渡す ID は数字のみ受け付ける (パス・フラグとして解釈されないように)
+const isDigits = (v) => /^\d+$/.test(String(v));
+
+// ===============================
+// Python Worker Pool (script_worker.py)
+// ===============================
+// スクリプト毎に python を起動する代わりに、常駐ワーカーへ JSON-lines で依頼する
+// 重いスクリプト (Selenium を使う scrape_ranking / scrape_room_event / search_avatar など) と、
+// 短い間隔でポーリングされる軽いスクリプト (fetch_comment_log / ranking_snapshots) はプールを分ける。
+// 同じプールだとブラウザ待ちの依頼で埋まったときに /comment_log が PY_TIMEOUT_MS まで待たされる。
+const PY_WORKERS = parseInt(process.env.PY_WORKERS || "2", 10);
+const PY_FAST_WORKERS = parseInt(process.env.PY_FAST_WORKERS || "2", 10);
+const PY_TIMEOUT_MS = parseInt(process.env.PY_TIMEOUT_MS || "60000", 10);
+// 起動直後に落ちるワーカー (import エラーなど) は 1s, 2s, 4s ... 最大 30s 待ってから起動し直す
+const PY_RESTART_WINDOW_MS = 5000;
+const PY_RESTART_MAX_DELAY_MS = 30000;
+
+class PythonWorkerPool {
+    constructor(size) {
+        this.size = Math.max(1, size);
+        this.workers = [];
+        this.queue = [];
+        this.nextId = 1;
+        this.crashes = 0;
+        for (let i = 0; i < this.size; i++) this.workers.push(this.spawnWorker());
+    }
+
+    spawnWorker() {
+        const proc = spawn('python', [path.join(__dirname, 'script_worker.py')], { cwd: __dirname });
+        const worker = { proc, busy: null, buffer: '', dead: false, exited: false, startedAt: Date.now() };
+
+        proc.stdout.on('data', (data) => {
+            worker.buffer += data.toString();
+            let idx;
+            while ((idx = worker.buffer.indexOf('\n')) >= 0) {
+                const line = worker.buffer.slice(0, idx).trim();
+                worker.buffer = worker.buffer.slice(idx + 1);
+                if (line) this.onReply(worker, line);
+            }
+        });
+        proc.stderr.on('data', (data) => {
+            console.error(`[PyWorker ${proc.pid}] ${data.toString().trim()}`);
+        });
+        // 停止済みのワーカーへの書き込み (EPIPE) でサーバーを落とさない
+        proc.stdin.on('error', (err) => {
+            console.error(`[PyWorker ${proc.pid}] stdin error: ${err.message}`);
+        });
+        proc.on('error', (err) => {
+            // python が見つからない等で起動できなかった。再起動を繰り返さず、次の run() で起動し直す
+            console.error(`[PyWorker] failed to start: ${err.message}`);
+            worker.dead = true;
+            this.failWorker(worker, new Error(`Python worker failed to start: ${err.message}`));
+            if (this.workers.every(w => w.dead)) {
+                for (const job of this.queue.splice(0)) job.reject(new Error(`Python worker failed to start: ${err.message}`));
+            }
+        });
+        proc.on('exit', (code) => {
+            if (worker.dead) return;
+            worker.exited = true;
+            console.error(`[PyWorker ${proc.pid}] exited with code ${code}`);
+            this.failWorker(worker, new Error(`Python worker exited (code ${code})`));
+            // タイムアウトで止めた場合などはすぐ起動し直し、起動直後の終了が続く場合だけ間隔を空ける
+            this.crashes = Date.now() - worker.startedAt < PY_RESTART_WINDOW_MS ? this.crashes + 1 : 0;
+            const delay = this.crashes ? Math.min(1000 * 2 ** (this.crashes - 1), PY_RESTART_MAX_DELAY_MS) : 0;
+            if (delay) {
+                console.error(`[PyWorker] restarting in ${delay} ms`);
+                if (this.workers.every(w => w.exited || w.dead)) {
+                    for (const job of this.queue.splice(0)) job.reject(new Error(`Python worker exited (code ${code})`));
+                }
+            }
+            setTimeout(() => {
+                const i = this.workers.indexOf(worker);
+                if (i >= 0) this.workers[i] = this.spawnWorker();
+                this.dispatch();
+            }, delay);
+        });
+        return worker;
+    }
+
+    failWorker(worker, error) {
+        const job = worker.busy;
+        worker.busy = null;
+        if (job) {
+            clearTimeout(job.timer);
+            job.reject(error);
+        }
+    }
+
+    onReply(worker, line) {
+        const job = worker.busy;
+        let reply;
+        try {
+            reply = JSON.parse(line);
+        } catch (e) {
+            console.error(`[PyWorker] Invalid reply: ${line}`);
+            return;
+        }
+        if (!job || reply.id !== job.id) return;
+        clearTimeout(job.timer);
+        worker.busy = null;
+        if (reply.ok) job.resolve(reply.result);
+        else job.reject(new Error(reply.error || "Python worker error"));
+        this.dispatch();
+    }
+
+    // options.timing: 結果に段階ごとの所要時間 (_timing) を付ける (timing.py)
+    run(script, args = [], options = {}) {
+        // 起動に失敗したワーカーはここで起動し直す
+        this.workers = this.workers.map(w => (w.dead ? this.spawnWorker() : w));
+        return new Promise((resolve, reject) => {
+            this.queue.push({ id: this.nextId++, script, args: args.map(String), timing: !!options.timing, resolve, reject });
+            this.dispatch();
+        });
+    }
+
+    dispatch() {
+        for (const worker of this.workers) {
+            if (this.queue.length === 0) return;
+            if (worker.busy || worker.dead || worker.exited || worker.proc.exitCode !== null) continue;
+            const job = this.queue.shift();
+            worker.busy = job;
+            job.timer = setTimeout(() => {
+                // 応答がないワーカーは強制終了 (exit ハンドラで再起動)
+                console.error(`[PyWorker ${worker.proc.pid}] timeout: ${job.script} ${job.args.join(' ')}`);
+                worker.proc.kill();
+            }, PY_TIMEOUT_MS);
+            const request = { id: job.id, script: job.script, args: job.args };
+            if (job.timing) request.timing = true;
+            worker.proc.stdin.write(JSON.stringify(request) + "\n");
+        }
+    }
+}
+
+const pyPool = new PythonWorkerPool(PY_WORKERS);
+const fastPool = new PythonWorkerPool(PY_FAST_WORKERS);
+
+// ?timing=1 で Python スクリプトの結果に _timing を付ける
+const timingOption = (req) => ({ timing: req.query.timing === '1' || req.query.timing === 'true' });
+
 // Debug Logger
 app.use((req, res, next) => {
     console.log(`[Request] ${req.method} ${req.url}`);
@@ -98,43 +237,30 @@ app.get("/get_broadcast_key", async (req, res) => {
 // ===============================
 // ② 過去コメント取得 API (/comment_log)
 // ===============================
-app.get("/comment_log", (req, res) => {
+app.get("/comment_log", async (req, res) => {
     const roomId = (req.query.room_id || "").trim();
     if (!roomId) return res.status(400).json({ error: "room_id required" });
 
-    const pythonProcess = spawn('python', ['fetch_comment_log.py', roomId]);
-
-    let dataString = '';
-    let errorString = '';
-
-    pythonProcess.stdout.on('data', (data) => {
-        dataString += data.toString();
-    });
-
-    pythonProcess.stderr.on('data', (data) => {
-        errorString += data.toString();
-    });
-
-    pythonProcess.on('close', (code) => {
-        if (code !== 0) {
-            console.error(`Python script exited with code ${code}: ${errorString}`);
-            return res.status(500).json({ error: "Python script failed", details: errorString });
-        }
+    // 差分モード: ?delta=1&cursor=<前回の cursor> で新しいコメントだけを返す
+    const args = [roomId];
+    if (req.query.delta || req.query.cursor) {
+        args.push('--delta');
+        if (req.query.cursor) args.push('--cursor', String(req.query.cursor));
+    }
 
-        try {
-            const json = JSON.parse(dataString);
-            if (json.error) {
-                if (json.error.includes("HTTP 404")) {
-                    return res.status(404).json(json);
-                }
-                return res.status(500).json(json);
+    try {
+        const json = await fastPool.run('fetch_comment_log.py', args, timingOption(req));
+        if (json.error) {
+            if (json.error.includes("HTTP 404")) {
+                return res.status(404).json(json);
             }
-            res.json(json);
-        } catch (e) {
-            console.error("Failed to parse Python output:", e, dataString);
-            res.status(500).json({ error: "Invalid JSON from Python script", details: e.toString() });
+            return res.status(500).json(json);
         }
-    });
+        res.json(json);
+    } catch (e) {
+        console.error("Python worker failed:", e);
+        res.status(500).json({ error: "Python script failed", details: e.toString() });
+    }
 });
 
 // ===============================
@@ -232,25 +358,28 @@ app.get("/gift_list", async (req, res) => {
 // Python Room Event Scraper Endpoint
 app.get("/api/room_event_py", async (req, res) => {
     const roomId = req.query.room_id;
-    if (!roomId) return res.status(400).json({ error: "room_id required" });
-
-    const { exec } = require('child_process');
-    const path = require('path');
-    const scriptPath = path.join(__dirname, 'scrape_room_event.py');
-
-    exec(`python "${scriptPath}" "${roomId}"`, { encoding: 'utf8' }, (error, stdout, stderr) => {
-        if (error) {
-            console.error(`[Proxy] Python exec error: ${error.message}`);
-            return res.status(500).json({ error: "Python exec failed" });
-        }
+    // 一括: ?room_ids=1,2,3 -> { results: [{ room_id, event_url_key, tier } | { room_id, error }] }
+    const roomIds = String(req.query.room_ids || "").split(",").map(s => s.trim()).filter(Boolean);
+    if (!roomIds.every(isDigits)) return res.status(400).json({ error: "invalid room_ids" });
+    if (roomIds.length > 0) {
         try {
-            const result = JSON.parse(stdout);
-            res.json(result);
+            const result = await pyPool.run('scrape_room_event.py', [...roomIds, '--batch'], timingOption(req));
+            return res.json(result);
         } catch (e) {
-            console.error(`[Proxy] Python Parse Error: ${e.message}`);
-            res.status(500).json({ error: "Python output parse failed" });
+            console.error(`[Proxy] Python worker error: ${e.message}`);
+            return res.status(500).json({ error: "Python exec failed" });
         }
-    });
+    }
+    if (!roomId) return res.status(400).json({ error: "room_id required" });
+    if (!isDigits(roomId)) return res.status(400).json({ error: "invalid room_id" });
+
+    try {
+        const result = await pyPool.run('scrape_room_event.py', [roomId], timingOption(req));
+        res.json(result);
+    } catch (e) {
+        console.error(`[Proxy] Python worker error: ${e.message}`);
+        res.status(500).json({ error: "Python exec failed" });
+    }
 });
 
 app.get("/api/event_points", async (req, res) => {
@@ -277,23 +406,95 @@ app.get("/api/event_ranking_py", async (req, res) => {
     if (!urlKey) return res.status(400).json({ error: "url_key required" });
 
     console.log(`[Proxy] Executing Python scraper for: ${urlKey}`);
-    const { exec } = require('child_process');
-    const path = require('path');
-    const scriptPath = path.join(__dirname, 'scrape_ranking.py');
+    try {
+        // Python script returns { ranking: [...] } or { error: ... }
+        const result = await pyPool.run('scrape_ranking.py', [urlKey], timingOption(req));
+        res.json(result);
+    } catch (e) {
+        console.error(`[Proxy] Python worker error: ${e.message}`);
+        res.status(500).json({ error: "Python exec failed" });
+    }
+});
 
-    exec(`python "${scriptPath}" "${urlKey}"`, { encoding: 'utf8' }, (error, stdout, stderr) => {
-        if (error) {
-            console.error(`[Proxy] Python exec error: ${error.message}`);
-            return res.status(500).json({ error: "Python exec failed" });
-        }
-        try {
-            const result = JSON.parse(stdout);
-            // Python script returns { ranking: [...] } or { error: ... }
-            res.json(result);
-        } catch (e) {
-            console.error(`[Proxy] Python Parse Error: ${e.message}`);
-            res.status(500).json({ error: "Python output parse failed" });
-        }
+// Ranking deltas from the snapshot store (ranking_snapshots.py)
+// 最新スナップショットが古い時だけ上流を1回叩き、全閲覧者で共有する
+app.get("/api/ranking_delta", async (req, res) => {
+    const eventId = req.query.event_id;
+    if (!eventId) return res.status(400).json({ error: "event_id required" });
+    if (!isDigits(eventId)) return res.status(400).json({ error: "invalid event_id" });
+    if (req.query.block_id && !isDigits(req.query.block_id)) return res.status(400).json({ error: "invalid block_id" });
+
+    const args = ['query', String(eventId)];
+    if (req.query.block_id) args.push('--block-id', String(req.query.block_id));
+    if (req.query.since) {
+        const since = parseInt(req.query.since, 10);
+        if (!Number.isFinite(since)) return res.status(400).json({ error: "invalid since" });
+        args.push(`--since=${since}`);
+    }
+    if (req.query.until) {
+        const until = parseInt(req.query.until, 10);
+        if (!Number.isFinite(until)) return res.status(400).json({ error: "invalid until" });
+        args.push(`--until=${until}`);
+    }
+
+    try {
+        const result = await fastPool.run('ranking_snapshots.py', args);
+        res.json(result);
+    } catch (e) {
+        console.error(`[Proxy] ranking_delta error: ${e.message}`);
+        res.status(500).json({ error: "Failed to compute ranking delta" });
+    }
+});
+
+// Full ranking of every block / page (ranking_crawler.py)
+// 取れた行から NDJSON で流すので、ワーカープールは使わず都度起動して stdout をそのまま返す
+app.get("/api/event_ranking_all", (req, res) => {
+    const target = req.query.url_key || req.query.event_id;
+    if (!target) return res.status(400).json({ error: "url_key or event_id required" });
+    if (req.query.url_key ? !/^[\w-]+$/.test(String(req.query.url_key)) : !isDigits(target)) {
+        return res.status(400).json({ error: "invalid url_key or event_id" });
+    }
+    const blockIds = [].concat(req.query.block_id || []);
+    if (!blockIds.every(isDigits)) return res.status(400).json({ error: "invalid block_id" });
+
+    const args = [path.join(__dirname, 'ranking_crawler.py'), String(target)];
+    for (const b of blockIds) args.push('--block-id', String(b));
+
+    const proc = spawn('python', args, { cwd: __dirname });
+    res.setHeader('Content-Type', 'application/x-ndjson; charset=utf-8');
+    proc.stdout.pipe(res);
+    proc.stderr.on('data', (data) => {
+        console.error(`[ranking_crawler] ${data.toString().trim()}`);
+    });
+    // python が起動できない場合など。ハンドラが無いとサーバーごと落ちる
+    proc.on('error', (err) => {
+        console.error(`[ranking_crawler] failed to start: ${err.message}`);
+        if (!res.headersSent) res.status(500).json({ error: "Failed to start ranking crawler" });
+        else res.end();
+    });
+    // クライアントが切断したらクロールも止める
+    res.on('close', () => {
+        if (proc.exitCode === null) proc.kill();
+    });
+});
+
+// Scraper stage timings as Prometheus histograms (timing.py)
+app.get("/metrics", (req, res) => {
+    const proc = spawn('python', [path.join(__dirname, 'timing.py'), 'prometheus'], { cwd: __dirname });
+    let body = '';
+    proc.stdout.on('data', (data) => { body += data.toString(); });
+    proc.stderr.on('data', (data) => {
+        console.error(`[timing] ${data.toString().trim()}`);
+    });
+    // 起動に失敗すると 'error' の後に 'close' も来ることがあるので、返すのは1回だけ
+    proc.on('error', (err) => {
+        console.error(`[timing] failed to start: ${err.message}`);
+        if (!res.headersSent) res.status(500).type('text/plain').send(`Failed to start timing.py: ${err.message}\n`);
+    });
+    proc.on('close', (code) => {
+        if (res.headersSent) return;
+        if (code !== 0) return res.status(500).type('text/plain').send(`timing.py exited with code ${code}\n`);
+        res.type('text/plain; version=0.0.4').send(body);
     });
 });
 
@@ -714,26 +915,29 @@ app.get("/api/server_status", (req, res) => {
 // ===============================
 app.get("/api/search_avatar", async (req, res) => {
     const avatarId = req.query.avatar_id;
-    if (!avatarId) return res.status(400).json({ error: "avatar_id required" });
-
-    const scriptPath = path.join(__dirname, 'search_avatar.py');
-
-    // --json フラグを使用してJSON出力を要求
-    exec(`python "${scriptPath}" "${avatarId}" --json`, { encoding: 'utf8' }, (error, stdout, stderr) => {
-        if (error) {
-            console.error(`[AvatarSearch] Python exec error: ${error.message} / ${stderr}`);
-            // Pythonスクリプト自体がエラーをJSONで返している可能性があるため、stdoutをチェック
-            // 致命的なエラー以外は続行を試みる
-        }
+    // 一括検索: ?avatar_ids=1000401,1000402,... -> { results: [...] }
+    const avatarIds = String(req.query.avatar_ids || "").split(",").map(s => s.trim()).filter(Boolean);
+    if (!avatarIds.every(isDigits)) return res.status(400).json({ error: "invalid avatar_ids" });
+    if (avatarIds.length > 0) {
         try {
-            // stdoutからJSONをパース
-            const result = JSON.parse(stdout);
-            res.json(result);
+            const result = await pyPool.run('search_avatar.py', [...avatarIds, '--json', '--batch'], timingOption(req));
+            return res.json(result);
         } catch (e) {
-            console.error(`[AvatarSearch] Python Parse Error: ${e.message} \nSTDOUT: ${stdout}`);
-            res.status(500).json({ error: "Python output parse failed", details: stdout });
+            console.error(`[AvatarSearch] Python worker error: ${e.message}`);
+            return res.status(500).json({ error: "Python output parse failed", details: e.message });
         }
-    });
+    }
+    if (!avatarId) return res.status(400).json({ error: "avatar_id required" });
+    if (!isDigits(avatarId)) return res.status(400).json({ error: "invalid avatar_id" });
+
+    try {
+        // --json フラグを使用してJSON出力を要求
+        const result = await pyPool.run('search_avatar.py', [avatarId, '--json'], timingOption(req));
+        res.json(result);
+    } catch (e) {
+        console.error(`[AvatarSearch] Python worker error: ${e.message}`);
+        res.status(500).json({ error: "Python output parse failed", details: e.message });
+    }
 });
 
 // ===============================
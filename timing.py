@@ -0,0 +1,376 @@
+import io
+import os
+import sys
+import json
+import time
+import sqlite3
+import functools
+import threading
+import contextlib
+
+# スクレイパーの1回の呼び出しについて
+#   - 段階ごとの経過時間 (time.perf_counter = 単調時計。段階は入れ子になってもよい)
+#   - ダウンロードしたバイト数 (圧縮されたままのサイズ) / リクエスト数 (http_client が記録する)
+#   - キャッシュのヒット / ミス (result_cache, event_cache, http, avatar_index)
+#   - どの段 (tier) が答えたか
+# を記録し、呼び出しごとにヒストグラム (SQLite) に足し込む。
+# SCRAPER_TIMING=1 (または script_worker への "timing": true) のときは出力の JSON に "_timing" を付ける:
+#   {"ranking": [...], "tier": "api", "_timing": {"total_ms": 212.4, "tier": "api",
+#     "stages": {"fetch_page": 101.2, "fetch_api": 98.7}, "bytes": 36901, "requests": 2,
+#     "cache": {"http": {"miss": 2}, "result_cache": {"miss": 1}}}}
+# 最初に set_tier した段が "_timing.tier" になる。result_cache から返した場合は本体の "tier" も
+# "result_cache" に書き換える (result_cache.with_tier)。
+#
+#   @timed_main("scrape_ranking.py")
+#   @cached_main("scrape_ranking.py")
+#   def main(argv): ...
+#
+#   with stage("fetch_api"): ...
+#
+#   python timing.py prometheus    # ヒストグラムを Prometheus のテキスト形式で出力
+#   python timing.py json | reset
+#
+# SCRAPER_METRICS=0 で集計しない。保存先は SCRAPER_METRICS_PATH。
+
+CACHE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache")
+METRICS_PATH = os.environ.get("SCRAPER_METRICS_PATH", os.path.join(CACHE_DIR, "scraper_metrics.sqlite"))
+METRICS_ENABLED = os.environ.get("SCRAPER_METRICS", "1") not in ("0", "off", "false")
+TIMING_ENABLED = os.environ.get("SCRAPER_TIMING", "0") in ("1", "on", "true")
+
+# ヒストグラムの上限 (秒)。Chrome の起動や WebDriverWait の 10 秒も入るように長めまで取る
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS histograms (
+    script TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    bucket INTEGER NOT NULL,   -- BUCKETS の添字 (len(BUCKETS) は +Inf)
+    count INTEGER NOT NULL,
+    PRIMARY KEY (script, stage, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS sums (
+    script TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    total REAL NOT NULL,
+    PRIMARY KEY (script, stage)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS counters (
+    name TEXT NOT NULL,
+    script TEXT NOT NULL,
+    labels TEXT NOT NULL,      -- Prometheus のラベル (script 以外) をそのまま
+    value REAL NOT NULL,
+    PRIMARY KEY (name, script, labels)
+) WITHOUT ROWID;
+"""
+
+class Trace:
+    def __init__(self, script):
+        self.script = script
+        self.started = time.perf_counter()
+        self.stages = {}
+        self.bytes = 0
+        self.requests = 0
+        self.cache = {}
+        self.tier = None
+        self.lock = threading.Lock()
+
+    def add_stage(self, name, seconds):
+        with self.lock:
+            self.stages[name] = self.stages.get(name, 0.0) + seconds
+
+    def add_cache(self, cache, result):
+        with self.lock:
+            counts = self.cache.setdefault(cache, {})
+            counts[result] = counts.get(result, 0) + 1
+
+    def add_download(self, nbytes):
+        with self.lock:
+            self.bytes += nbytes
+            self.requests += 1
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def summary(self, total=None):
+        total = self.elapsed() if total is None else total
+        return {
+            "total_ms": round(total * 1000, 2),
+            "tier": self.tier,
+            "stages": {name: round(s * 1000, 2) for name, s in self.stages.items()},
+            "bytes": self.bytes,
+            "requests": self.requests,
+            "cache": self.cache,
+        }
+
+# 呼び出しは1プロセスに1つずつ (script_worker も直列) なので、スレッドからも見えるようにグローバルに持つ
+_current = None
+_forced = False
+# bind() したスレッドだけは投入時の Trace に記録する
+_bound = threading.local()
+_UNBOUND = object()
+
+def current():
+    return _current
+
+def _trace():
+    trace = getattr(_bound, "trace", _UNBOUND)
+    return _current if trace is _UNBOUND else trace
+
+def bind(fn):
+    """
+    fn を今の Trace に結び付ける。スレッドプールに投げて待たずに戻る処理 (プローブなど) は、
+    呼び出しが終わった後に完了しても次の呼び出しの Trace に記録しない。
+    """
+    trace = _current
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        previous = getattr(_bound, "trace", _UNBOUND)
+        _bound.trace = trace
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            if previous is _UNBOUND:
+                del _bound.trace
+            else:
+                _bound.trace = previous
+    return wrapper
+
+@contextlib.contextmanager
+def stage(name):
+    trace = _trace()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add_stage(name, time.perf_counter() - started)
+
+def record_cache(cache, hit):
+    """hit は True / False か、"hit" / "miss" / "revalidated" などの文字列。"""
+    trace = _trace()
+    if trace is not None:
+        trace.add_cache(cache, hit if isinstance(hit, str) else ("hit" if hit else "miss"))
+
+def record_download(nbytes):
+    trace = _trace()
+    if trace is not None:
+        trace.add_download(nbytes)
+
+def set_tier(tier):
+    trace = _trace()
+    if trace is not None and trace.tier is None:
+        trace.tier = tier
+
+@contextlib.contextmanager
+def forced():
+    """この間の呼び出しは SCRAPER_TIMING に関係なく _timing を付ける (script_worker 用)。"""
+    global _forced
+    previous, _forced = _forced, True
+    try:
+        yield
+    finally:
+        _forced = previous
+
+def attach(output, summary):
+    """
+    出力が JSON オブジェクト1つなら末尾に "_timing" を足す。それ以外 (テキスト / NDJSON) はそのまま。
+    整形 (indent の有無) を変えないように文字列として差し込む。
+    """
+    text = output.rstrip()
+    if not text.endswith("}"):
+        return output
+    try:
+        if not isinstance(json.loads(text), dict):
+            return output
+    except ValueError:
+        return output
+    body = text[:-1].rstrip()
+    separator = "" if body.endswith("{") else ", "
+    return body + separator + '"_timing": ' + json.dumps(summary, ensure_ascii=False) + "}" + output[len(text):]
+
+# --- 集計 ---
+
+class MetricsStore:
+    def __init__(self, path=METRICS_PATH):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, timeout=30, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.executescript(SCHEMA)
+        self._lock = threading.Lock()
+
+    def observe(self, trace, total):
+        observations = [("total", total)] + list(trace.stages.items())
+        counters = [("scraper_bytes_downloaded_total", "", trace.bytes),
+                    ("scraper_upstream_requests_total", "", trace.requests)]
+        if trace.tier:
+            counters.append(("scraper_tier_total", f'tier="{trace.tier}"', 1))
+        for cache, counts in trace.cache.items():
+            for result, n in counts.items():
+                counters.append(("scraper_cache_total", f'cache="{cache}",result="{result}"', n))
+
+        with self._lock, self._conn:
+            self._conn.executemany(
+                "INSERT INTO histograms (script, stage, bucket, count) VALUES (?, ?, ?, 1) "
+                "ON CONFLICT(script, stage, bucket) DO UPDATE SET count = count + 1",
+                [(trace.script, name, bucket_index(seconds)) for name, seconds in observations]
+            )
+            self._conn.executemany(
+                "INSERT INTO sums (script, stage, count, total) VALUES (?, ?, 1, ?) "
+                "ON CONFLICT(script, stage) DO UPDATE SET count = count + 1, total = total + excluded.total",
+                [(trace.script, name, seconds) for name, seconds in observations]
+            )
+            self._conn.executemany(
+                "INSERT INTO counters (name, script, labels, value) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT(name, script, labels) DO UPDATE SET value = value + excluded.value",
+                [(name, trace.script, labels, value) for name, labels, value in counters]
+            )
+
+    def snapshot(self):
+        with self._lock:
+            buckets = self._conn.execute("SELECT script, stage, bucket, count FROM histograms").fetchall()
+            sums = self._conn.execute("SELECT script, stage, count, total FROM sums ORDER BY script, stage").fetchall()
+            counters = self._conn.execute(
+                "SELECT name, script, labels, value FROM counters ORDER BY name, script, labels").fetchall()
+        histograms = {}
+        for script, stage_name, count, total in sums:
+            histograms[(script, stage_name)] = {"buckets": [0] * (len(BUCKETS) + 1), "count": count, "sum": total}
+        for script, stage_name, bucket, count in buckets:
+            entry = histograms.get((script, stage_name))
+            if entry is not None and 0 <= bucket <= len(BUCKETS):
+                entry["buckets"][bucket] = count
+        return histograms, counters
+
+    def reset(self):
+        with self._lock, self._conn:
+            for table in ("histograms", "sums", "counters"):
+                self._conn.execute(f"DELETE FROM {table}")
+
+def bucket_index(seconds):
+    for i, upper in enumerate(BUCKETS):
+        if seconds <= upper:
+            return i
+    return len(BUCKETS)
+
+_store = None
+_store_failed = False
+_store_lock = threading.Lock()
+
+def get_store():
+    global _store, _store_failed
+    with _store_lock:
+        if _store is None and not _store_failed:
+            try:
+                _store = MetricsStore()
+            except Exception as e:
+                _store_failed = True
+                print(f"[timing] metrics disabled: {e}", file=sys.stderr)
+        return _store
+
+def format_value(value):
+    return str(int(value)) if float(value).is_integer() else repr(float(value))
+
+def prometheus_text(store=None):
+    histograms, counters = (store or get_store()).snapshot()
+    lines = [
+        "# HELP scraper_stage_seconds Time spent per scraper stage (stage=\"total\" is the whole call)",
+        "# TYPE scraper_stage_seconds histogram",
+    ]
+    for (script, stage_name), entry in sorted(histograms.items()):
+        labels = f'script="{script}",stage="{stage_name}"'
+        cumulative = 0
+        for upper, count in zip(BUCKETS, entry["buckets"]):
+            cumulative += count
+            lines.append(f'scraper_stage_seconds_bucket{{{labels},le="{upper}"}} {cumulative}')
+        lines.append(f'scraper_stage_seconds_bucket{{{labels},le="+Inf"}} {entry["count"]}')
+        lines.append(f'scraper_stage_seconds_sum{{{labels}}} {entry["sum"]:.6f}')
+        lines.append(f'scraper_stage_seconds_count{{{labels}}} {entry["count"]}')
+
+    helps = {
+        "scraper_bytes_downloaded_total": "Response bytes downloaded from upstream",
+        "scraper_upstream_requests_total": "Requests sent to upstream",
+        "scraper_tier_total": "Calls answered by each fallback tier",
+        "scraper_cache_total": "Cache lookups by cache and result",
+    }
+    seen = set()
+    for name, script, labels, value in counters:
+        if name not in seen:
+            seen.add(name)
+            lines += [f"# HELP {name} {helps.get(name, name)}", f"# TYPE {name} counter"]
+        all_labels = f'script="{script}"' + ("," + labels if labels else "")
+        lines.append(f"{name}{{{all_labels}}} {format_value(value)}")
+    return "\n".join(lines) + "\n"
+
+def metrics_json(store=None):
+    histograms, counters = (store or get_store()).snapshot()
+    result = {"buckets": list(BUCKETS), "histograms": [], "counters": []}
+    for (script, stage_name), entry in sorted(histograms.items()):
+        result["histograms"].append(dict(entry, script=script, stage=stage_name))
+    for name, script, labels, value in counters:
+        result["counters"].append({"name": name, "script": script, "labels": labels, "value": value})
+    return result
+
+# --- main のデコレータ ---
+
+def timed_main(script):
+    """
+    main(argv) の1回の呼び出しを Trace で囲み、終わったらヒストグラムに足す。
+    _timing を付けるときだけ標準出力を受け取って書き換える。
+    """
+    def decorator(main):
+        @functools.wraps(main)
+        def wrapper(argv):
+            global _current
+            trace = Trace(script)
+            previous, _current = _current, trace
+            show = TIMING_ENABLED or _forced
+            buf = io.StringIO() if show else None
+            try:
+                if buf is None:
+                    return main(argv)
+                with contextlib.redirect_stdout(buf):
+                    return main(argv)
+            finally:
+                _current = previous
+                total = trace.elapsed()
+                if buf is not None:
+                    output = buf.getvalue()
+                    if output:
+                        sys.stdout.write(attach(output, trace.summary(total)))
+                        sys.stdout.flush()
+                if METRICS_ENABLED:
+                    store = get_store()
+                    if store is not None:
+                        try:
+                            store.observe(trace, total)
+                        except sqlite3.Error as e:
+                            print(f"[timing] could not record metrics: {e}", file=sys.stderr)
+        return wrapper
+    return decorator
+
+def main(argv):
+    import argparse
+    parser = argparse.ArgumentParser(description="Scraper stage timings aggregated as histograms")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("prometheus", help="Prometheus text exposition format")
+    sub.add_parser("json")
+    sub.add_parser("reset")
+    args = parser.parse_args(argv)
+
+    store = get_store()
+    if store is None:
+        sys.exit(1)
+    if args.command == "prometheus":
+        sys.stdout.write(prometheus_text(store))
+    elif args.command == "json":
+        print(json.dumps(metrics_json(store)))
+    else:
+        store.reset()
+
+if __name__ == "__main__":
+    main(sys.argv[1:])
@@ -0,0 +1,270 @@
+import io
+import os
+import sys
+import json
+import time
+import sqlite3
+import argparse
+import datetime
+
+# コメントログから視聴者の uid / 名前を取り込み、名前の変更履歴を付けてローカルの SQLite に保存する。
+# users テーブルは schema.sql (Cloudflare Worker の D1) と同じ形で、history も同じ JSON
+#   [{"name": 以前の名前, "date": 変更を確認した時刻 (ISO8601)}, ...]
+# を持つので、そのままエクスポートして D1 に流し込める。
+# Worker の save_users はユーザーごとに SELECT + UPSERT するが、ここでは
+#   1. 入力を全部読んで uid ごとの (時刻, 名前) をメモリ上でまとめる
+#   2. 既存行を IN (...) でまとめて読む
+#   3. 履歴をマージして executemany で一括書き込み (WAL、1トランザクション/バッチ)
+# の順に行う。
+#
+#   python fetch_comment_log.py 123 | python user_ingest.py ingest
+#   python user_ingest.py ingest night.ndjson comment_poller.ndjson
+#   python user_ingest.py names 4567          # uid の名前履歴 (Worker の get_names と同じ形)
+#   python user_ingest.py who "なまえ" [--prefix]   # その名前を使ったことのある uid
+#
+# 入力は1行1 JSON (NDJSON) か JSON 1つで、次のどれでもよい:
+#   fetch_comment_log の出力        {"comment_log": [{"user_id", "name", "created_at", ...}, ...]}
+#   差分モード / comment_poller      {"fields": [...], "rows": [[...], ...]}
+#   コメント1件                      {"user_id", "name", "created_at"}
+
+DB_PATH = os.environ.get(
+    "USERS_DB_PATH",
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache", "users.sqlite")
+)
+BATCH_SIZE = 5000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    uid TEXT PRIMARY KEY,
+    name TEXT,
+    last_seen INTEGER,
+    history TEXT -- JSON文字列として過去の名前リストを保存
+);
+CREATE TABLE IF NOT EXISTS name_history (
+    uid TEXT NOT NULL,
+    name TEXT NOT NULL,
+    first_seen INTEGER NOT NULL,
+    last_seen INTEGER NOT NULL,
+    PRIMARY KEY (uid, name)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_name_history_name ON name_history(name);
+"""
+
+def connect(path=DB_PATH):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(SCHEMA)
+    return conn
+
+def iso(ms):
+    return datetime.datetime.fromtimestamp(ms / 1000, datetime.timezone.utc).isoformat(timespec="milliseconds").replace("+00:00", "Z")
+
+# --- 入力 ---
+
+def iter_comments(doc):
+    """1つの JSON ドキュメントから (uid, name, created_at 秒) を取り出す。"""
+    if isinstance(doc, list):
+        for item in doc:
+            yield from iter_comments(item)
+        return
+    if not isinstance(doc, dict):
+        return
+    if "comment_log" in doc:
+        yield from iter_comments(doc["comment_log"] or [])
+        return
+    if "rows" in doc and "fields" in doc:
+        fields = doc["fields"]
+        try:
+            i_uid, i_name, i_ts = fields.index("user_id"), fields.index("name"), fields.index("created_at")
+        except ValueError:
+            return
+        for row in doc["rows"] or []:
+            yield row[i_uid], row[i_name], row[i_ts]
+        return
+    if "user_id" in doc:
+        yield doc.get("user_id"), doc.get("name"), doc.get("created_at")
+
+def read_documents(stream):
+    """NDJSON として読む。1行目が読めなければ全体を1つの JSON (整形済み) として読む。"""
+    text = stream.read()
+    docs = []
+    for i, line in enumerate(text.splitlines()):
+        line = line.strip()
+        if not line:
+            continue
+        try:
+            docs.append(json.loads(line))
+        except ValueError:
+            if not docs:
+                return [json.loads(text)]
+            print(f"[user_ingest] skipped invalid line {i + 1}", file=sys.stderr)
+    return docs
+
+def collect(docs, observed=None):
+    """uid -> {ts_ms: name} にまとめる (同じコメントが重複していても1回分になる)。"""
+    observed = observed if observed is not None else {}
+    count = 0
+    for doc in docs:
+        for uid, name, ts in iter_comments(doc):
+            if uid is None or not name:
+                continue
+            try:
+                ts_ms = int(ts) * 1000
+            except (TypeError, ValueError):
+                continue
+            observed.setdefault(str(uid), {})[ts_ms] = name
+            count += 1
+    return observed, count
+
+# --- マージ / 書き込み ---
+
+def load_existing(conn, uids):
+    existing = {}
+    # SQLite の変数上限に収まるように分けて読む
+    for i in range(0, len(uids), 500):
+        chunk = uids[i:i + 500]
+        marks = ",".join("?" * len(chunk))
+        for uid, name, last_seen, history in conn.execute(
+                f"SELECT uid, name, last_seen, history FROM users WHERE uid IN ({marks})", chunk):
+            try:
+                history = json.loads(history or "[]")
+            except ValueError:
+                history = []
+            existing[uid] = (name, last_seen or 0, history)
+    return existing
+
+def merge_user(current, observations):
+    """
+    既存の (name, last_seen, history) に時刻順の観測 [(ts_ms, name), ...] を重ねる。
+    保存済みの last_seen より前の観測は名前の変化としては扱わない (name_history にだけ残す)。
+    """
+    name, last_seen, history = current if current else (None, 0, [])
+    history = list(history)
+    changes = 0
+    for ts_ms, observed_name in observations:
+        if ts_ms < last_seen:
+            continue
+        if name and observed_name != name:
+            history.append({"name": name, "date": iso(ts_ms)})
+            changes += 1
+        name = observed_name
+        last_seen = ts_ms
+    return (name, last_seen, history), changes
+
+def ingest(conn, observed, batch_size=BATCH_SIZE):
+    uids = list(observed)
+    stats = {"users": len(uids), "new_users": 0, "name_changes": 0}
+    for i in range(0, len(uids), batch_size):
+        chunk = uids[i:i + batch_size]
+        existing = load_existing(conn, chunk)
+        user_rows = []
+        name_rows = []
+        for uid in chunk:
+            observations = sorted(observed[uid].items())
+            merged, changes = merge_user(existing.get(uid), observations)
+            stats["name_changes"] += changes
+            if uid not in existing:
+                stats["new_users"] += 1
+            name, last_seen, history = merged
+            user_rows.append((uid, name, last_seen, json.dumps(history, ensure_ascii=False)))
+
+            spans = {}
+            for ts_ms, n in observations:
+                first, last = spans.get(n, (ts_ms, ts_ms))
+                spans[n] = (min(first, ts_ms), max(last, ts_ms))
+            name_rows += [(uid, n, first, last) for n, (first, last) in spans.items()]
+
+        with conn:
+            conn.executemany(
+                """INSERT INTO users (uid, name, last_seen, history) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(uid) DO UPDATE SET
+                   name = excluded.name, last_seen = excluded.last_seen, history = excluded.history""",
+                user_rows
+            )
+            conn.executemany(
+                """INSERT INTO name_history (uid, name, first_seen, last_seen) VALUES (?, ?, ?, ?)
+                   ON CONFLICT(uid, name) DO UPDATE SET
+                   first_seen = MIN(first_seen, excluded.first_seen),
+                   last_seen = MAX(last_seen, excluded.last_seen)""",
+                name_rows
+            )
+    return stats
+
+# --- 参照 ---
+
+def get_names(conn, uid):
+    """Worker の get_names と同じ形 (過去の名前のリスト) を返す。"""
+    row = conn.execute("SELECT history FROM users WHERE uid = ?", (str(uid),)).fetchone()
+    if not row:
+        return []
+    try:
+        return json.loads(row[0] or "[]")
+    except ValueError:
+        return []
+
+def name_history(conn, uid):
+    """uid が使った名前を初めて見た順に [{name, first_seen, last_seen}] で返す。"""
+    rows = conn.execute(
+        "SELECT name, first_seen, last_seen FROM name_history WHERE uid = ? ORDER BY first_seen", (str(uid),)
+    )
+    return [{"name": n, "first_seen": f, "last_seen": l} for n, f, l in rows]
+
+def find_by_name(conn, name, prefix=False, limit=100):
+    """その名前 (prefix=True なら前方一致) を使ったことのある uid を新しい順に返す。"""
+    if prefix:
+        # LIKE は大文字小文字を区別しないのでインデックスが効かない。範囲検索にする
+        rows = conn.execute(
+            "SELECT uid, name, first_seen, last_seen FROM name_history WHERE name >= ? AND name < ? "
+            "ORDER BY last_seen DESC LIMIT ?", (name, name + "\U0010ffff", limit)
+        )
+    else:
+        rows = conn.execute(
+            "SELECT uid, name, first_seen, last_seen FROM name_history WHERE name = ? "
+            "ORDER BY last_seen DESC LIMIT ?", (name, limit)
+        )
+    return [{"uid": u, "name": n, "first_seen": f, "last_seen": l} for u, n, f, l in rows]
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Bulk ingest of viewer names from comment logs")
+    parser.add_argument("--db", default=DB_PATH)
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p_ingest = sub.add_parser("ingest", help="Ingest comment logs (files or stdin)")
+    p_ingest.add_argument("files", nargs="*")
+    p_ingest.add_argument("--batch-size", type=int, default=BATCH_SIZE)
+
+    sub.add_parser("names", help="Name history of a uid (get_names format)").add_argument("uid")
+    sub.add_parser("history", help="Every name a uid used with first/last seen").add_argument("uid")
+    p_who = sub.add_parser("who", help="uids that used a name")
+    p_who.add_argument("name")
+    p_who.add_argument("--prefix", action="store_true")
+    p_who.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args(argv)
+
+    conn = connect(args.db)
+    if args.command == "ingest":
+        started = time.perf_counter()
+        observed, comments = {}, 0
+        if args.files:
+            for path in args.files:
+                with open(path, encoding="utf-8") as f:
+                    _, n = collect(read_documents(f), observed)
+                    comments += n
+        else:
+            _, comments = collect(read_documents(sys.stdin), observed)
+        stats = ingest(conn, observed, args.batch_size)
+        stats["comments"] = comments
+        stats["elapsed"] = round(time.perf_counter() - started, 3)
+        print(json.dumps(stats))
+    elif args.command == "names":
+        print(json.dumps(get_names(conn, args.uid), ensure_ascii=False))
+    elif args.command == "history":
+        print(json.dumps(name_history(conn, args.uid), ensure_ascii=False))
+    else:
+        print(json.dumps(find_by_name(conn, args.name, args.prefix, args.limit), ensure_ascii=False))
+
+if __name__ == "__main__":
+    sys.stdout = io.TextIOWrapper(sys.stdout.buffer, encoding='utf-8')
+    main(sys.argv[1:])